@@ -0,0 +1,302 @@
+"""
+Adaptive worker concurrency.
+
+Celery autoscaler (``worker_autoscaler``) that sizes the pool from what the
+node is actually doing instead of the number of queued messages. Every
+``autoscale_interval`` seconds it samples:
+
+- throughput: network bytes/sec of the node (/proc/net/dev)
+- CPU busy and I/O wait fractions of the node (/proc/stat)
+- memory in use (cgroup limit when set, else /proc/meminfo)
+- the fraction of finished downloads that failed with RATE_LIMITED or
+  TIMEOUT (from the worker's Prometheus counters)
+
+and moves the number of download slots between the ``--autoscale=MAX,MIN``
+bounds:
+
+- any signal over its threshold: shrink by BACKOFF (multiplicative)
+- all slots busy: grow by ``autoscale_step``, as long as the previous step
+  raised throughput by at least ``autoscale_min_gain``; a step that did not
+  is undone and growth pauses for HOLD_INTERVALS intervals
+- otherwise: hold
+
+Every decision is logged with the signals behind it. Enable with e.g.
+``celery -A app.celery_app worker --pool=gevent --autoscale=100,10``.
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from time import monotonic
+from typing import Optional
+
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+
+from app.config import settings
+from app.metrics import CONCURRENCY_LIMIT, DOWNLOAD_ERRORS, STAGE_DURATION
+
+logger = logging.getLogger(__name__)
+
+BACKOFF = 0.75  # concurrency multiplier when the node is under pressure
+SATURATED = 0.75  # mean share of busy slots that counts as "all slots busy"
+HOLD_INTERVALS = 4  # intervals without growth after a step that did not pay off
+THROTTLE_ERRORS = ("RATE_LIMITED", "TIMEOUT")
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _cpu_times():
+    """(busy, iowait, total) jiffies of the node, or None off Linux."""
+    text = _read("/proc/stat")
+    if not text:
+        return None
+    # cpu user nice system idle iowait irq softirq steal ...
+    values = [int(v) for v in text.split("\n", 1)[0].split()[1:]]
+    idle, iowait = values[3], values[4]
+    total = sum(values[:8])
+    return total - idle - iowait, iowait, total
+
+
+def _network_bytes() -> Optional[int]:
+    """Bytes received + sent on all non-loopback interfaces."""
+    text = _read("/proc/net/dev")
+    if not text:
+        return None
+    total = 0
+    for line in text.splitlines()[2:]:
+        name, _, fields = line.partition(":")
+        if name.strip() == "lo":
+            continue
+        values = fields.split()
+        total += int(values[0]) + int(values[8])
+    return total
+
+
+def _memory_used() -> Optional[float]:
+    """Fraction of memory in use: of the cgroup limit if set, else of the node."""
+    limit, current = _read("/sys/fs/cgroup/memory.max"), _read("/sys/fs/cgroup/memory.current")
+    if limit and current and limit.strip() != "max":
+        return int(current) / int(limit)
+
+    text = _read("/proc/meminfo")
+    if not text:
+        return None
+    info = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        info[key] = int(value.split()[0])
+    if not info.get("MemTotal") or "MemAvailable" not in info:
+        return None
+    return 1 - info["MemAvailable"] / info["MemTotal"]
+
+
+def _counter_total(metric, codes=None) -> float:
+    """Sum of a labelled counter, optionally only for some ``code`` labels."""
+    total = 0.0
+    for family in metric.collect():
+        for sample in family.samples:
+            if not sample.name.endswith("_total"):
+                continue
+            if codes is None or sample.labels.get("code") in codes:
+                total += sample.value
+    return total
+
+
+def _downloads_finished() -> float:
+    for family in STAGE_DURATION.collect():
+        for sample in family.samples:
+            if sample.name.endswith("_count") and sample.labels.get("stage") == "download":
+                return sample.value
+    return 0.0
+
+
+@dataclass
+class _Sample:
+    at: float
+    cpu: Optional[tuple]
+    network_bytes: Optional[int]
+    downloads: float
+    errors: float
+    throttle_errors: float
+
+    @classmethod
+    def take(cls) -> "_Sample":
+        return cls(
+            at=monotonic(),
+            cpu=_cpu_times(),
+            network_bytes=_network_bytes(),
+            downloads=_downloads_finished(),
+            errors=_counter_total(DOWNLOAD_ERRORS),
+            throttle_errors=_counter_total(DOWNLOAD_ERRORS, THROTTLE_ERRORS),
+        )
+
+
+@dataclass
+class Signals:
+    """What the node did between two samples."""
+
+    throughput_bps: Optional[float]
+    cpu: Optional[float]
+    iowait: Optional[float]
+    memory: Optional[float]
+    error_rate: float
+    busy: float  # mean busy slots over the interval
+
+    @classmethod
+    def between(cls, before: _Sample, after: _Sample, busy: float) -> "Signals":
+        elapsed = max(after.at - before.at, 1e-6)
+
+        throughput = None
+        if before.network_bytes is not None and after.network_bytes is not None:
+            throughput = (after.network_bytes - before.network_bytes) / elapsed
+
+        cpu = iowait = None
+        if before.cpu and after.cpu:
+            busy_jiffies, iowait_jiffies, total = (a - b for a, b in zip(after.cpu, before.cpu))
+            if total > 0:
+                cpu, iowait = busy_jiffies / total, iowait_jiffies / total
+
+        finished = (after.downloads - before.downloads) + (after.errors - before.errors)
+        throttled = after.throttle_errors - before.throttle_errors
+        return cls(
+            throughput_bps=throughput,
+            cpu=cpu,
+            iowait=iowait,
+            memory=_memory_used(),
+            error_rate=throttled / finished if finished > 0 else 0.0,
+            busy=busy,
+        )
+
+    def pressure(self) -> Optional[str]:
+        """The first signal over its threshold, or None."""
+        checks = (
+            ("cpu", self.cpu, settings.autoscale_cpu_high),
+            ("memory", self.memory, settings.autoscale_memory_high),
+            ("iowait", self.iowait, settings.autoscale_iowait_high),
+            ("error rate", self.error_rate, settings.autoscale_error_rate_high),
+        )
+        for name, value, threshold in checks:
+            if value is not None and value > threshold:
+                return f"{name} {value:.0%} > {threshold:.0%}"
+        return None
+
+    def __str__(self) -> str:
+        def pct(value):
+            return "n/a" if value is None else f"{value:.0%}"
+
+        throughput = "n/a" if self.throughput_bps is None else f"{self.throughput_bps / 1024 / 1024:.1f}MiB/s"
+        return (
+            f"throughput={throughput} cpu={pct(self.cpu)} memory={pct(self.memory)} "
+            f"iowait={pct(self.iowait)} errors={pct(self.error_rate)} busy={self.busy:.1f}"
+        )
+
+
+class AdaptiveAutoscaler(Autoscaler):
+    """Celery autoscaler driven by node throughput and resource pressure."""
+
+    def __init__(self, pool, max_concurrency, min_concurrency=0, *args, **kwargs):
+        super().__init__(pool, max_concurrency, min_concurrency, *args, **kwargs)
+        # The pool starts at min_concurrency; prefetch is sized for max_concurrency
+        self.concurrency = max(min_concurrency, 1)
+        self._prefetch_slots = max_concurrency
+        self._sample: Optional[_Sample] = None
+        self._busy_sum = self._busy_count = 0
+        self._next_at = 0.0
+        # Throughput before the last growth step, to judge whether it paid off
+        self._grown_from: Optional[float] = None
+        self._hold = 0
+        CONCURRENCY_LIMIT.set(self.concurrency)
+
+    def _maybe_scale(self, req=None):
+        # Called about every second (more often under prefork); tasks can be
+        # shorter than an interval, so average how many slots were in use
+        self._busy_sum += len(state.active_requests)
+        self._busy_count += 1
+        now = monotonic()
+        if now < self._next_at:
+            return False
+        self._next_at = now + settings.autoscale_interval
+
+        sample = _Sample.take()
+        previous, self._sample = self._sample, sample
+        if previous is None:
+            self._busy_sum = self._busy_count = 0
+            self._sync_prefetch()
+            return False
+
+        busy = self._busy_sum / self._busy_count
+        self._busy_sum = self._busy_count = 0
+        signals = Signals.between(previous, sample, busy=busy)
+        target, reason = self.decide(signals)
+        logger.info(f"Concurrency {self.concurrency} -> {target}: {reason} ({signals})")
+        if target == self.concurrency:
+            return False
+        self._resize(target)
+        return True
+
+    def decide(self, signals: Signals):
+        """New concurrency and the reason for it."""
+        current = self.concurrency
+        grown_from, self._grown_from = self._grown_from, None
+
+        pressure = signals.pressure()
+        if pressure:
+            return max(self.min_concurrency, 1, int(current * BACKOFF)), f"back off, {pressure}"
+
+        saturated = signals.busy >= SATURATED * current
+        if grown_from is not None and signals.throughput_bps is not None and saturated:
+            if signals.throughput_bps < grown_from * (1 + settings.autoscale_min_gain):
+                self._hold = HOLD_INTERVALS
+                target = max(self.min_concurrency, 1, current - settings.autoscale_step)
+                return target, "undo last step, throughput did not improve"
+
+        if self._hold:
+            self._hold -= 1
+            return current, f"hold ({self._hold + 1} intervals left)"
+        if not saturated:
+            return current, "hold, free slots"
+        if current >= self.max_concurrency:
+            return current, "hold, at maximum"
+
+        self._grown_from = signals.throughput_bps
+        return min(self.max_concurrency, current + settings.autoscale_step), "grow, all slots busy"
+
+    def _resize(self, target: int) -> None:
+        diff = target - self.concurrency
+        if diff > 0:
+            self.scale_up(diff)
+        else:
+            self._shrink(-diff)
+        if self.pool.is_green:
+            self.concurrency = target
+        else:
+            # Prefork cannot shrink below its busy processes
+            self.concurrency = self.processes
+        CONCURRENCY_LIMIT.set(self.concurrency)
+        self._sync_prefetch()
+
+    def _sync_prefetch(self) -> None:
+        """Reserve only as many messages as there are slots, leaving the rest to other workers."""
+        qos = getattr(getattr(self.worker, "consumer", None), "qos", None)
+        if qos is None or not qos.value:
+            return
+        multiplier = self.worker.consumer.prefetch_multiplier
+        diff = self.concurrency - self._prefetch_slots
+        if diff > 0:
+            qos.increment_eventually(diff * multiplier)
+        elif diff < 0:
+            qos.decrement_eventually(-diff * multiplier)
+        self._prefetch_slots = self.concurrency
+
+    def info(self):
+        info = super().info()
+        info["limit"] = self.concurrency
+        return info
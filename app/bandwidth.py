@@ -0,0 +1,204 @@
+"""
+Cluster-wide bandwidth budget.
+
+Every active transfer registers in Redis sorted sets, one for the whole
+cluster and one for its node, scored by a heartbeat expiry. A transfer's
+share is
+
+    min(cluster_limit / transfers in the cluster, node_limit / transfers on this node)
+
+and is recomputed every ``bandwidth_rebalance_interval`` seconds, so shares
+grow and shrink as other tasks start and finish. Entries of crashed
+workers expire on their own.
+
+Downloads are limited by yt-dlp itself (the ``ratelimit`` option reads the
+live share); uploads through the storage SDKs' progress callbacks
+(BandwidthShare.consume).
+Download and upload traffic have separate budgets. With no limit configured
+for a direction nothing is registered and transfers run unthrottled.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import redis
+
+from app.config import settings
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD = "download"
+UPLOAD = "upload"
+
+BANDWIDTH_KEY = "vds:bandwidth:{direction}"  # cluster-wide transfers
+NODE_BANDWIDTH_KEY = "vds:bandwidth:{direction}:{node}"  # transfers of one node
+
+BURST_SECONDS = 1.0  # upload throttle may run this far ahead of its share
+
+
+def _limits(direction: str):
+    if direction == DOWNLOAD:
+        return settings.bandwidth_download_limit, settings.bandwidth_node_download_limit
+    return settings.bandwidth_upload_limit, settings.bandwidth_node_upload_limit
+
+
+def node_name() -> str:
+    return settings.node_name or socket.gethostname()
+
+
+class BandwidthShare:
+    """One transfer's share of the bandwidth budget, in bytes/sec."""
+
+    # Transfers of this process per direction, used when Redis is unavailable
+    _local_active = {DOWNLOAD: 0, UPLOAD: 0}
+
+    def __init__(self, direction: str, transfer_id: str):
+        self.direction = direction
+        self.transfer_id = transfer_id
+        self.cluster_limit, self.node_limit = _limits(direction)
+        self.node = node_name()
+        self._keys = (
+            BANDWIDTH_KEY.format(direction=direction),
+            NODE_BANDWIDTH_KEY.format(direction=direction, node=self.node),
+        )
+        self._rate = math.inf
+        self._refresh_at = 0.0
+        self._lock = threading.Lock()
+        # Transfer throttle state (see consume)
+        self._allowance = 0.0
+        self._last = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        """Current share in bytes/sec, rebalanced at most every rebalance interval."""
+        if time.monotonic() >= self._refresh_at:
+            self.refresh()
+        return self._rate
+
+    def refresh(self) -> None:
+        """Renew this transfer's registration and recompute its share."""
+        interval = settings.bandwidth_rebalance_interval
+        now = time.time()
+        self._refresh_at = time.monotonic() + interval
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for key in self._keys:
+                pipe.zadd(key, {self.transfer_id: now + max(interval * 3, 30)})
+                pipe.zremrangebyscore(key, "-inf", now)
+                pipe.zcard(key)
+            results = pipe.execute()
+            cluster_count, node_count = results[2], results[5]
+        except redis.RedisError as e:
+            # Keep the last share; before the first one, split the node limit locally
+            logger.warning(f"Failed to rebalance {self.direction} bandwidth: {e}")
+            if self._rate != math.inf:
+                return
+            cluster_count = node_count = max(1, self._local_active[self.direction])
+
+        share = math.inf
+        if self.cluster_limit:
+            share = min(share, self.cluster_limit / max(1, cluster_count))
+        if self.node_limit:
+            share = min(share, self.node_limit / max(1, node_count))
+        if share != self._rate:
+            logger.debug(f"{self.direction} share of {self.transfer_id}: {share:.0f} B/s")
+        self._rate = share
+
+    def register(self) -> None:
+        self._local_active[self.direction] += 1
+        self.refresh()
+
+    def unregister(self) -> None:
+        self._local_active[self.direction] -= 1
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for key in self._keys:
+                pipe.zrem(key, self.transfer_id)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Failed to release {self.direction} bandwidth share: {e}")
+
+    def consume(self, amount: int) -> None:
+        """Account for ``amount`` bytes sent, sleeping to stay within the share."""
+        rate = self.rate
+        if rate == math.inf or amount <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(rate * BURST_SECONDS, self._allowance + (now - self._last) * rate)
+            self._last = now
+            self._allowance -= amount
+            wait = -self._allowance / rate if self._allowance < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+    def ratelimit(self) -> "LiveRateLimit":
+        """Value for yt-dlp's ``ratelimit`` option."""
+        return LiveRateLimit(self)
+
+
+class LiveRateLimit:
+    """
+    Number-like view of a share for yt-dlp's ``ratelimit`` option.
+
+    yt-dlp compares and divides by ``ratelimit`` on every chunk
+    (FileDownloader.slow_down) and copies its params for fragment
+    downloads, so passing this object instead of a number lets HTTP and
+    HLS/DASH downloads follow the share as it is rebalanced.
+    """
+
+    def __init__(self, share: BandwidthShare):
+        self.share = share
+
+    def __float__(self) -> float:
+        return self.share.rate
+
+    def __lt__(self, other) -> bool:
+        return self.share.rate < other
+
+    def __gt__(self, other) -> bool:
+        return self.share.rate > other
+
+    def __le__(self, other) -> bool:
+        return self.share.rate <= other
+
+    def __ge__(self, other) -> bool:
+        return self.share.rate >= other
+
+    def __rtruediv__(self, other) -> float:
+        return other / self.share.rate
+
+    def __repr__(self) -> str:
+        return f"{self.share.rate:.0f}"
+
+
+@contextmanager
+def bandwidth_share(direction: str, transfer_id: str) -> Iterator[Optional[BandwidthShare]]:
+    """
+    Hold a share of the ``direction`` budget for the duration of a transfer.
+
+    Yields None when no limit is configured for the direction.
+
+    Args:
+        direction: DOWNLOAD or UPLOAD
+        transfer_id: Unique ID of the transfer (the task ID)
+    """
+    if not any(_limits(direction)):
+        yield None
+        return
+
+    share = BandwidthShare(direction, transfer_id)
+    share.register()
+    try:
+        yield share
+    finally:
+        share.unregister()
+
@@ -2,122 +2,62 @@ from __future__ import annotations
 
 import logging
 from datetime import datetime
-from typing import Any, Optional, Dict
+from typing import Any, Dict
 
-import httpx
+from sqlalchemy.orm import Session
 
-from app.config import settings
+from app.models import CallbackOutbox
 
 logger = logging.getLogger(__name__)
 
 
-class CallbackService:
-    """Service for sending callback notifications."""
+CALLBACK_STATS_KEY = "vds:callbacks:stats"  # hash published by the relay
 
-    def __init__(
-        self,
-        timeout: Optional[int] = None,
-        max_retries: Optional[int] = None,
-    ):
-        self.timeout = timeout or settings.callback_timeout
-        self.max_retries = max_retries or settings.callback_max_retries
 
-    async def send_callback_async(
-        self,
-        callback_url: str,
-        payload: Dict[str, Any],
-    ) -> bool:
-        """
-        Send callback notification asynchronously.
+class CallbackService:
+    """
+    Service for queueing callback notifications.
 
-        Args:
-            callback_url: URL to send callback to
-            payload: JSON payload to send
+    Callbacks are staged in the ``callback_outbox`` table inside the
+    caller's transaction, so a notification exists if and only if the
+    status change it announces was committed. Delivery, retries and
+    batching are handled by the relay (``python -m app.callback_dispatcher``).
+    """
 
-        Returns:
-            True if successful, False otherwise
-        """
-        for attempt in range(self.max_retries):
-            try:
-                async with httpx.AsyncClient(timeout=self.timeout) as client:
-                    response = await client.post(
-                        callback_url,
-                        json=payload,
-                        headers={"Content-Type": "application/json"},
-                    )
-
-                    if response.status_code >= 200 and response.status_code < 300:
-                        logger.info(f"Callback sent successfully to {callback_url}")
-                        return True
-                    else:
-                        logger.warning(
-                            f"Callback failed with status {response.status_code}: {response.text}"
-                        )
-
-            except httpx.TimeoutException:
-                logger.warning(f"Callback timeout (attempt {attempt + 1}/{self.max_retries})")
-            except httpx.RequestError as e:
-                logger.warning(f"Callback request error (attempt {attempt + 1}/{self.max_retries}): {e}")
-            except Exception as e:
-                logger.exception(f"Unexpected callback error: {e}")
-
-            # Wait before retry (exponential backoff: 30s, 60s, 120s)
-            if attempt < self.max_retries - 1:
-                import asyncio
-                wait_time = 30 * (2 ** attempt)
-                await asyncio.sleep(wait_time)
-
-        logger.error(f"Callback failed after {self.max_retries} attempts: {callback_url}")
-        return False
-
-    def send_callback_sync(
+    def send_callback(
         self,
+        db: Session,
+        task_id: str,
         callback_url: str,
         payload: Dict[str, Any],
-    ) -> bool:
+    ) -> None:
         """
-        Send callback notification synchronously (for Celery tasks).
+        Stage a callback notification; it is queued when ``db`` commits.
 
         Args:
+            db: Session holding the task status change
+            task_id: Task the notification is about
             callback_url: URL to send callback to
-            payload: JSON payload to send
-
-        Returns:
-            True if successful, False otherwise
+            payload: JSON payload to send (its ``status`` identifies the event)
         """
-        import time
-
-        for attempt in range(self.max_retries):
-            try:
-                with httpx.Client(timeout=self.timeout) as client:
-                    response = client.post(
-                        callback_url,
-                        json=payload,
-                        headers={"Content-Type": "application/json"},
-                    )
-
-                    if response.status_code >= 200 and response.status_code < 300:
-                        logger.info(f"Callback sent successfully to {callback_url}")
-                        return True
-                    else:
-                        logger.warning(
-                            f"Callback failed with status {response.status_code}: {response.text}"
-                        )
-
-            except httpx.TimeoutException:
-                logger.warning(f"Callback timeout (attempt {attempt + 1}/{self.max_retries})")
-            except httpx.RequestError as e:
-                logger.warning(f"Callback request error (attempt {attempt + 1}/{self.max_retries}): {e}")
-            except Exception as e:
-                logger.exception(f"Unexpected callback error: {e}")
-
-            # Wait before retry
-            if attempt < self.max_retries - 1:
-                wait_time = 30 * (2 ** attempt)
-                time.sleep(wait_time)
-
-        logger.error(f"Callback failed after {self.max_retries} attempts: {callback_url}")
-        return False
+        event_key = f"{task_id}:{payload['status']}"
+
+        # A retried Celery task must not announce the same event twice
+        exists = (
+            db.query(CallbackOutbox.id)
+            .filter(CallbackOutbox.event_key == event_key)
+            .first()
+        )
+        if exists:
+            logger.info(f"Callback {event_key} already queued, skipping")
+            return
+
+        db.add(CallbackOutbox(
+            event_key=event_key,
+            task_id=task_id,
+            callback_url=callback_url,
+            payload=payload,
+        ))
 
 
 def build_success_payload(
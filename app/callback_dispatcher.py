@@ -0,0 +1,422 @@
+"""
+Async callback relay.
+
+Drains the ``callback_outbox`` table from a single asyncio process:
+
+- due rows are claimed with a lease, so several relays can run side by side
+  and a crashed relay's rows are picked up again (at-least-once delivery)
+- rows for the same ``callback_url`` can be batched into one POST
+  (``callback_batch_size``), cutting HTTP round trips under load
+- one shared ``httpx.AsyncClient`` keeps connections alive per callback
+  host, with a per-host concurrency cap: batches wait in a queue per host
+  and only take a relay-wide slot once their host has a free one, so a
+  slow receiver cannot starve the others. Hosts with a full queue are left
+  out of the next claim, and leases of queued rows are renewed while they
+  wait
+- retries are rescheduled in the table, so nothing sleeps while holding a
+  worker slot
+
+Run with:
+    python -m app.callback_dispatcher
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import httpx
+import redis
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.callback import CALLBACK_STATS_KEY
+from app.config import settings
+from app.database import AsyncSessionLocal, init_db
+from app.metrics import (
+    CALLBACK_DELIVERY_LATENCY,
+    CALLBACK_EVENTS,
+    CALLBACK_REQUEST_DURATION,
+    start_exporter,
+)
+from app.models import CallbackOutbox, CallbackStatus, Task
+from app.redis_client import get_async_redis
+from app.task_state import invalidate_task_state
+from app.task_stats import percentile
+
+logger = logging.getLogger(__name__)
+
+STATS_INTERVAL = 10  # seconds between stats publications
+LATENCY_WINDOW = 1000  # recent deliveries used for percentiles
+
+
+class DispatcherStats:
+    """Delivery counters and recent latencies of one relay process."""
+
+    def __init__(self):
+        self.delivered = 0
+        self.failed = 0  # gave up after max retries
+        self.retried = 0
+        self.requests = 0  # HTTP requests sent (one per batch)
+        self.in_flight = 0
+        # Time from outbox insert to successful delivery, in seconds
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "retried": self.retried,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "latency_p50_ms": round(percentile(self.latencies, 50) * 1000, 1),
+            "latency_p99_ms": round(percentile(self.latencies, 99) * 1000, 1),
+            "updated_at": time.time(),
+        }
+
+
+class CallbackDispatcher:
+    """Claim due outbox rows and deliver them concurrently."""
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        per_host: Optional[int] = None,
+        timeout: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        batch_size: Optional[int] = None,
+    ):
+        self.concurrency = concurrency or settings.callback_concurrency
+        self.per_host = per_host or settings.callback_max_connections_per_host
+        self.timeout = timeout or settings.callback_timeout
+        self.max_retries = max_retries or settings.callback_max_retries
+        self.batch_size = max(1, batch_size or settings.callback_batch_size)
+        # A claimed row becomes claimable again after this (relay crashed)
+        self.lease = timedelta(seconds=self.timeout * 2 + 30)
+
+        self.stats = DispatcherStats()
+        # Batches waiting for a slot of their host, at most per_host each
+        self._queues: Dict[str, Deque[Tuple[str, List[CallbackOutbox]]]] = defaultdict(deque)
+        self._queued_ids: Set[int] = set()  # leased rows in _queues, renewed while they wait
+        self._host_active: Dict[str, int] = defaultdict(int)
+        self._active = 0
+        self._room = asyncio.Event()  # set when a delivery finishes
+        self._stopping = asyncio.Event()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._deliveries: Set[asyncio.Task] = set()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._room.set()
+
+    async def run(self) -> None:
+        """Run until stop() is called, then drain in-flight deliveries."""
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency,
+            keepalive_expiry=60,
+        )
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            self._client = client
+            stats_task = asyncio.create_task(self._publish_stats())
+            lease_task = asyncio.create_task(self._renew_leases())
+            logger.info(
+                f"Callback relay started (concurrency={self.concurrency}, "
+                f"per_host={self.per_host}, batch_size={self.batch_size})"
+            )
+            try:
+                await self._poll()
+            finally:
+                stats_task.cancel()
+                lease_task.cancel()
+                await self._release_queued()
+                if self._deliveries:
+                    await asyncio.gather(*self._deliveries, return_exceptions=True)
+                await self._write_stats()
+                logger.info("Callback relay stopped")
+
+    async def _poll(self) -> None:
+        while not self._stopping.is_set():
+            # Deliveries finishing from here on wake the wait below
+            self._room.clear()
+            claimed = []
+            if self._active < self.concurrency or self._queued_batches() < self.concurrency:
+                try:
+                    claimed = await self._claim(exclude_urls=self._saturated_urls())
+                except Exception as e:
+                    logger.warning(f"Failed to claim callbacks: {e}")
+                self._enqueue(claimed)
+                self._dispatch()
+
+            # Keep draining while there is a backlog, otherwise wait for a free slot
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._room.wait(), settings.callback_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _queued_batches(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _saturated_urls(self) -> Set[str]:
+        """callback_urls of hosts with a full queue, left out of the next claim."""
+        return {
+            url
+            for queue in self._queues.values() if len(queue) >= self.per_host
+            for url, _ in queue
+        }
+
+    def _enqueue(self, rows: List[CallbackOutbox]) -> None:
+        """Queue claimed rows per host, in batches for the same callback_url."""
+        by_url: Dict[str, List[CallbackOutbox]] = defaultdict(list)
+        for row in rows:
+            by_url[row.callback_url].append(row)
+
+        for url, url_rows in by_url.items():
+            queue = self._queues[urlparse(url).netloc]
+            for i in range(0, len(url_rows), self.batch_size):
+                queue.append((url, url_rows[i:i + self.batch_size]))
+        self._queued_ids.update(row.id for row in rows)
+
+    async def _claim(self, exclude_urls: Iterable[str] = ()) -> List[CallbackOutbox]:
+        """Lease a batch of due rows to this relay, skipping rows for exclude_urls."""
+        now = datetime.utcnow()
+        due = (
+            (CallbackOutbox.status == CallbackStatus.PENDING.value)
+            & (CallbackOutbox.next_attempt_at <= now)
+        )
+        exclude_urls = list(exclude_urls)
+        if exclude_urls:
+            due = due & CallbackOutbox.callback_url.notin_(exclude_urls)
+        async with AsyncSessionLocal() as db:
+            ids = (await db.scalars(
+                select(CallbackOutbox.id)
+                .where(due)
+                .order_by(CallbackOutbox.next_attempt_at)
+                .limit(settings.callback_claim_limit)
+            )).all()
+            if not ids:
+                return []
+
+            # Only rows still due are taken, so concurrent relays never share one
+            claimed_ids = (await db.scalars(
+                update(CallbackOutbox)
+                .where(CallbackOutbox.id.in_(ids), due)
+                .values(next_attempt_at=now + self.lease)
+                .returning(CallbackOutbox.id)
+            )).all()
+            await db.commit()
+
+            if not claimed_ids:
+                return []
+            return list((await db.scalars(
+                select(CallbackOutbox).where(CallbackOutbox.id.in_(claimed_ids))
+            )).all())
+
+    def _dispatch(self) -> None:
+        """Start queued batches while their host and the relay have free slots."""
+        for host, queue in list(self._queues.items()):
+            while queue and self._host_active[host] < self.per_host and self._active < self.concurrency:
+                url, rows = queue.popleft()
+                self._queued_ids.difference_update(row.id for row in rows)
+                self._host_active[host] += 1
+                self._active += 1
+                delivery = asyncio.create_task(self._deliver(host, url, rows))
+                self._deliveries.add(delivery)
+                delivery.add_done_callback(self._deliveries.discard)
+            if not queue:
+                del self._queues[host]
+
+    async def _deliver(self, host: str, url: str, rows: List[CallbackOutbox]) -> None:
+        """Deliver one request worth of rows; _dispatch took the slots."""
+        self.stats.in_flight += 1
+        try:
+            error = await self._post(url, rows)
+            await self._record_result(rows, error)
+        except Exception as e:
+            # Rows stay leased and are retried when the lease expires
+            logger.exception(f"Failed to record callback delivery to {url}: {e}")
+        finally:
+            self.stats.in_flight -= 1
+            self._host_active[host] -= 1
+            if not self._host_active[host]:
+                del self._host_active[host]
+            self._active -= 1
+            self._room.set()
+            if not self._stopping.is_set():
+                self._dispatch()
+
+    async def _reschedule(self, ids: Iterable[int], when: datetime) -> None:
+        """Move the next attempt of leased, still pending rows."""
+        ids = list(ids)
+        if not ids:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(CallbackOutbox)
+                    .where(CallbackOutbox.id.in_(ids), CallbackOutbox.status == CallbackStatus.PENDING.value)
+                    .values(next_attempt_at=when)
+                )
+                await db.commit()
+        except Exception as e:
+            # The rows are claimed again when their lease expires
+            logger.warning(f"Failed to reschedule {len(ids)} callbacks: {e}")
+
+    async def _renew_leases(self) -> None:
+        """Keep rows waiting in host queues leased to this relay."""
+        interval = self.lease.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            await self._reschedule(self._queued_ids, datetime.utcnow() + self.lease)
+
+    async def _release_queued(self) -> None:
+        """Hand rows that never started back to the table (on shutdown)."""
+        ids = list(self._queued_ids)
+        self._queues.clear()
+        self._queued_ids.clear()
+        await self._reschedule(ids, datetime.utcnow())
+
+    async def _post(self, url: str, rows: List[CallbackOutbox]) -> Optional[str]:
+        """POST rows to ``url``; returns an error message, or None on success."""
+        attempt = max(row.attempts for row in rows) + 1
+        if len(rows) == 1:
+            body: Any = rows[0].payload
+            headers = {"X-Callback-Id": rows[0].event_key}
+        else:
+            body = {"events": [row.payload for row in rows]}
+            headers = {"X-Callback-Batch-Size": str(len(rows))}
+
+        self.stats.requests += 1
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self._client.post(url, json=body, headers=headers)
+            if 200 <= response.status_code < 300:
+                CALLBACK_REQUEST_DURATION.labels("success").observe(time.perf_counter() - started)
+                logger.info(f"Callback sent successfully to {url} ({len(rows)} events)")
+                return None
+            outcome = f"http_{response.status_code // 100}xx"
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+        except httpx.TimeoutException:
+            outcome = "timeout"
+            error = "Timeout"
+        except httpx.RequestError as e:
+            error = f"Request error: {e}"
+        except Exception as e:
+            logger.exception(f"Unexpected callback error: {e}")
+            error = str(e)
+
+        CALLBACK_REQUEST_DURATION.labels(outcome).observe(time.perf_counter() - started)
+        logger.warning(f"Callback to {url} failed (attempt {attempt}/{self.max_retries}): {error}")
+        return error
+
+    async def _record_result(self, rows: List[CallbackOutbox], error: Optional[str]) -> None:
+        now = datetime.utcnow()
+        timed_tasks = []
+        async with AsyncSessionLocal() as db:
+            for row in rows:
+                attempts = row.attempts + 1
+                values: Dict[str, Any] = {"attempts": attempts}
+
+                if error is None:
+                    values.update(status=CallbackStatus.DELIVERED.value, delivered_at=now, last_error=None)
+                    latency = (now - row.created_at).total_seconds()
+                    self.stats.delivered += 1
+                    self.stats.latencies.append(latency)
+                    CALLBACK_DELIVERY_LATENCY.observe(latency)
+                    CALLBACK_EVENTS.labels("delivered").inc()
+                    # Rows are staged when the task finishes, so this is the callback stage.
+                    # Core updates skip the ORM hook that versions the task state.
+                    await db.execute(
+                        update(Task).where(Task.id == row.task_id).values(
+                            callback_seconds=latency,
+                            state_version=func.coalesce(Task.state_version, 0) + 1,
+                        )
+                    )
+                    timed_tasks.append(row.task_id)
+                elif attempts >= self.max_retries:
+                    values.update(status=CallbackStatus.FAILED.value, last_error=error)
+                    self.stats.failed += 1
+                    CALLBACK_EVENTS.labels("failed").inc()
+                    logger.error(f"Callback {row.event_key} failed after {attempts} attempts")
+                else:
+                    # Exponential backoff: 30s, 60s, 120s, ...
+                    delay = settings.callback_retry_base_delay * (2 ** (attempts - 1))
+                    values.update(next_attempt_at=now + timedelta(seconds=delay), last_error=error)
+                    self.stats.retried += 1
+                    CALLBACK_EVENTS.labels("retried").inc()
+
+                await db.execute(
+                    update(CallbackOutbox).where(CallbackOutbox.id == row.id).values(**values)
+                )
+            await db.commit()
+
+            if timed_tasks:
+                # Versions as committed (or newer), for the cache tombstones
+                versions = (await db.execute(
+                    select(Task.id, Task.state_version).where(Task.id.in_(timed_tasks))
+                )).all()
+                for task_id, version in versions:
+                    await invalidate_task_state(task_id, version or 0)
+
+    async def _write_stats(self) -> None:
+        stats = self.stats.to_dict()
+        await get_async_redis().hset(CALLBACK_STATS_KEY, mapping=stats)
+
+    async def _publish_stats(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            try:
+                await self._write_stats()
+            except redis.RedisError as e:
+                logger.warning(f"Failed to publish callback stats: {e}")
+
+
+async def get_callback_stats(db: AsyncSession) -> Dict[str, Any]:
+    """Outbox backlog and relay delivery stats for the API."""
+    counts = dict((await db.execute(
+        select(CallbackOutbox.status, func.count(CallbackOutbox.id))
+        .where(CallbackOutbox.status != CallbackStatus.DELIVERED.value)
+        .group_by(CallbackOutbox.status)
+    )).all())
+
+    stats = await get_async_redis().hgetall(CALLBACK_STATS_KEY)
+    return {
+        "backlog_pending": counts.get(CallbackStatus.PENDING.value, 0),
+        "dead_letters": counts.get(CallbackStatus.FAILED.value, 0),
+        "delivered": int(stats.get("delivered", 0)),
+        "failed": int(stats.get("failed", 0)),
+        "retried": int(stats.get("retried", 0)),
+        "requests": int(stats.get("requests", 0)),
+        "in_flight": int(stats.get("in_flight", 0)),
+        "latency_p50_ms": float(stats.get("latency_p50_ms", 0)),
+        "latency_p99_ms": float(stats.get("latency_p99_ms", 0)),
+        "stats_updated_at": (
+            datetime.utcfromtimestamp(float(stats["updated_at"])) if "updated_at" in stats else None
+        ),
+    }
+
+
+async def main() -> None:
+    init_db()
+    start_exporter(settings.callback_metrics_port)
+    dispatcher = CallbackDispatcher()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, dispatcher.stop)
+    await dispatcher.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Cooperative task cancellation.
+
+Revoking a Celery task does not stop a download already running in a
+gevent greenlet, and never stops an upload. Instead the API sets a
+per-task flag in Redis and the worker checks it from the yt-dlp progress
+hook and the upload progress callbacks, both of which run for every chunk
+transferred. The check hits Redis at most every CHECK_INTERVAL seconds, so
+a cancelled transfer stops within a second while the cost per chunk stays
+a clock read.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+
+import redis
+
+from app.config import settings
+from app.redis_client import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+CANCEL_KEY = "vds:cancel:{task_id}"
+CHECK_INTERVAL = 0.5  # seconds between Redis reads per task
+
+
+class TaskCancelled(Exception):
+    """Raised inside a transfer when its task has been cancelled."""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        super().__init__(f"Task {task_id} was cancelled")
+
+
+async def request_cancel(task_id: str) -> None:
+    """Flag a task as cancelled; the flag outlives the longest possible run."""
+    await get_async_redis().set(CANCEL_KEY.format(task_id=task_id), 1, ex=settings.download_timeout * 2)
+
+
+class CancelToken:
+    """Checks the cancellation flag of one task."""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self._key = CANCEL_KEY.format(task_id=task_id)
+        self._cancelled = False
+        self._next_check = 0.0
+
+    def is_cancelled(self) -> bool:
+        if self._cancelled:
+            return True
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + CHECK_INTERVAL
+        try:
+            self._cancelled = bool(get_redis().exists(self._key))
+        except redis.RedisError as e:
+            logger.warning(f"Failed to check cancellation of task {self.task_id}: {e}")
+        return self._cancelled
+
+    def check(self) -> None:
+        """Raise TaskCancelled if the task has been cancelled."""
+        if self.is_cancelled():
+            raise TaskCancelled(self.task_id)
+
+    def clear(self) -> None:
+        try:
+            get_redis().delete(self._key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to clear cancellation flag of task {self.task_id}: {e}")
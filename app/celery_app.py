@@ -1,6 +1,11 @@
+import logging
+
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_init
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
 # Create Celery app
 celery_app = Celery(
     "video_download_service",
@@ -31,8 +36,94 @@ celery_app.conf.update(
 
     # Prefetch multiplier (1 for long-running tasks)
     worker_prefetch_multiplier=1,
+
+    # Used with --autoscale=MAX,MIN: pool size follows throughput and node load
+    worker_autoscaler="app.autoscale:AdaptiveAutoscaler",
+
+    # Info extraction runs on its own workers (-Q video_info); so does maintenance
+    # (-Q maintenance), whose long database batches would stall a gevent download worker
+    task_routes={
+        "app.tasks.extract_video_info_task": {"queue": settings.video_info_queue},
+        "app.tasks.archive_tasks_task": {"queue": settings.maintenance_queue},
+        "app.tasks.reseed_status_counts_task": {"queue": settings.maintenance_queue},
+        "app.tasks.cleanup_old_files_task": {"queue": settings.maintenance_queue},
+    },
+
+    # Periodic tasks (celery -A app.celery_app beat)
+    beat_schedule={
+        "archive-finished-tasks": {
+            "task": "app.tasks.archive_tasks_task",
+            "schedule": settings.archive_interval,
+        },
+        "reseed-status-counts": {
+            "task": "app.tasks.reseed_status_counts_task",
+            "schedule": settings.status_counts_reseed_interval,
+        },
+    },
 )
 
+
+
+@worker_init.connect
+def start_metrics_exporter(sender=None, **kwargs):
+    """
+    Expose this worker's Prometheus metrics (see app.metrics).
+
+    Only for pools that run tasks in this process (gevent, threads, solo):
+    worker_init runs in the prefork parent, whose registry never sees the
+    metrics recorded by its child processes.
+    """
+    from celery.concurrency import get_implementation
+    from app.metrics import start_exporter
+
+    pool_cls = get_implementation(sender.pool_cls) if sender is not None else None
+    if pool_cls is not None and pool_cls.__module__.endswith(".prefork"):
+        logger.warning("Metrics exporter not started: the prefork pool is not supported, use --pool=gevent")
+        return
+    start_exporter(settings.worker_metrics_port)
+
+
+@worker_init.connect
+def prune_ytdlp_cache(**kwargs):
+    """Drop shared yt-dlp caches left behind by older yt-dlp versions (see app.ytdlp_cache)."""
+    from app.ytdlp_cache import prune_stale_versions
+    prune_stale_versions()
+
+
+@task_prerun.connect
+def track_task_started(task=None, **kwargs):
+    from app.metrics import ACTIVE_TASKS
+    ACTIVE_TASKS.labels(task.name).inc()
+
+
+@task_postrun.connect
+def track_task_finished(task=None, **kwargs):
+    from app.metrics import ACTIVE_TASKS
+    ACTIVE_TASKS.labels(task.name).dec()
+
+
+# Celery task id -> Profile of sampled download runs (see app.profiling)
+_profiles = {}
+
+
+@task_prerun.connect
+def start_task_profile(task_id=None, task=None, args=None, kwargs=None, **extra):
+    if task.name != "app.tasks.download_video_task":
+        return
+    from app.profiling import should_profile_task, start_profile
+    db_task_id = args[0] if args else (kwargs or {}).get("task_id")
+    if db_task_id and should_profile_task(db_task_id):
+        _profiles[task_id] = start_profile(f"task-{db_task_id}")
+
+
+@task_postrun.connect
+def stop_task_profile(task_id=None, **kwargs):
+    profile = _profiles.pop(task_id, None)
+    if profile is not None:
+        from app.profiling import stop_profile
+        stop_profile(profile)
+
+
 # Note: For high concurrency (100+), use gevent pool:
 # celery -A app.celery_app worker --pool=gevent --concurrency=100
 # Requires: pip install gevent
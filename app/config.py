@@ -16,15 +16,36 @@ class Settings(BaseSettings):
     # Server
     host: str = "0.0.0.0"
     port: int = 8000
+    api_blocking_workers: int = 32  # executor for blocking calls in API handlers
 
     # Database
     database_url: str = "sqlite:///./data/tasks.db"
 
+    task_count_cache_ttl: int = 10  # seconds, cached total for task listing
+    task_state_cache_ttl: int = 300  # seconds a serialized task state stays in Redis; 0 disables the cache
+    progress_update_interval: float = 1.0  # seconds between progress writes of a running task
+    task_wait_max: int = 60  # longest ?wait= a status request may hold, seconds
+
+    # Archival of finished tasks (see app.task_archive; run by celery beat)
+    archive_dir: str = "./data/archive"
+    archive_retention_days: int = 30  # finished tasks older than this leave the tasks table; 0 disables
+    archive_compression: str = "gzip"  # gzip, or zstd (pip install zstandard)
+    archive_batch_size: int = 5000  # tasks per segment file
+    archive_max_batches: int = 20  # segments written per run, the rest waits for the next run; 0 = no limit
+    archive_interval: int = 3600  # seconds between archiver runs
+    status_counts_reseed_interval: int = 3600  # seconds between rebuilds of the Redis status counters
+    # Periodic maintenance (archiving, counter reseed, file cleanup) runs on its own worker queue,
+    # never on the gevent download workers
+    maintenance_queue: str = "maintenance"
+
     # Redis
     redis_url: str = "redis://localhost:6379/0"
 
     # Download settings
     download_dir: str = "./downloads"
+    # Files go to hashed subdirectories: depth levels of width hex chars (0 = flat, see app.download_layout)
+    download_shard_depth: int = 2
+    download_shard_width: int = 2
     max_concurrent_downloads: int = 100
     download_timeout: int = 3600  # 1 hour
     max_file_size: int = 5 * 1024 * 1024 * 1024  # 5GB
@@ -32,6 +53,14 @@ class Settings(BaseSettings):
     # yt-dlp settings
     ytdlp_format: str = "bestvideo+bestaudio/best"
     ytdlp_proxy: Optional[str] = None
+    # Shared cache of solved YouTube signature / n-parameter functions (see app.ytdlp_cache);
+    # put it on a volume every worker mounts. Empty = yt-dlp's per-user default
+    ytdlp_cache_dir: str = "./data/ytdlp-cache"
+
+    # Video info (preview) extraction, served by the video_info worker queue
+    video_info_queue: str = "video_info"
+    video_info_timeout: int = 30  # seconds the API waits for a worker reply
+    video_info_cache_ttl: int = 300  # seconds; 0 disables the result cache
 
     # Storage settings (for future use)
     storage_type: str = "local"  # local, s3, oss
@@ -39,16 +68,69 @@ class Settings(BaseSettings):
     s3_bucket: Optional[str] = None
     s3_access_key: Optional[str] = None
     s3_secret_key: Optional[str] = None
-    s3_region: Optional[str] = None
+
+    # Serving local files (GET /api/v1/tasks/{id}/file)
+    file_url_secret: Optional[str] = None  # HMAC key for signed links; unset = files are not served
+    file_url_unsigned: bool = False  # without a secret, serve unsigned, non-expiring links (trusted networks only)
+    file_url_ttl: int = 3600  # seconds a signed link stays valid
+    public_base_url: Optional[str] = None  # e.g. https://videos.example.com; links are relative when unset
+    presigned_url_ttl: int = 3600  # seconds a pre-signed object storage URL stays valid
+    presigned_url_refresh_margin: int = 300  # stop handing out a cached URL this long before it expires
+    s3_region: Optional[str] = None  # region of S3 buckets for pre-signing; unset = looked up per bucket
 
     # Callback settings
     callback_timeout: int = 30
     callback_max_retries: int = 3
+    callback_retry_base_delay: int = 30  # seconds, doubled on each retry
+    callback_concurrency: int = 200  # deliveries in flight per relay
+    callback_max_connections_per_host: int = 20
+    callback_batch_size: int = 1  # >1 sends {"events": [...]} per callback_url
+    callback_poll_interval: float = 1.0  # seconds between outbox polls when idle
+    callback_claim_limit: int = 500  # outbox rows claimed per poll
+
+    # Prometheus metrics (API: GET /metrics; workers and relay: own exporter port, 0 disables)
+    metrics_enabled: bool = True
+    worker_metrics_port: int = 9100
+    callback_metrics_port: int = 9101
+
+    # Pick the cheapest formats (no merge, native container, fewest bytes)
+    # for the requested quality instead of the fixed format strings
+    format_planner_enabled: bool = True
+
+    # Bandwidth budget in bytes/sec (0 = unlimited), shared by all active
+    # transfers in the cluster / on one node and rebalanced as they start and end
+    bandwidth_download_limit: int = 0
+    bandwidth_upload_limit: int = 0
+    bandwidth_node_download_limit: int = 0
+    bandwidth_node_upload_limit: int = 0
+    bandwidth_rebalance_interval: float = 5.0  # seconds
+    node_name: Optional[str] = None  # defaults to the hostname
+
+    # Adaptive concurrency (worker started with --autoscale=MAX,MIN)
+    autoscale_interval: float = 15.0  # seconds between decisions
+    autoscale_step: int = 5  # slots added per growth step
+    autoscale_min_gain: float = 0.05  # throughput gain a growth step must bring
+    autoscale_cpu_high: float = 0.90
+    autoscale_memory_high: float = 0.85
+    autoscale_iowait_high: float = 0.20
+    autoscale_error_rate_high: float = 0.10  # RATE_LIMITED / TIMEOUT share of finished downloads
+
+    # Sampling profiler (collapsed stacks for flamegraphs; 0.01 = 1% of runs)
+    profile_task_sample_rate: float = 0.0
+    profile_api_sample_rate: float = 0.0
+    profile_interval_ms: int = 10
+    profile_dir: str = "./profiles"
+    profile_storage_type: str = "local"  # or upload profiles like downloads (s3, gcs, s3_compatible)
+    profile_storage_url: Optional[str] = None
 
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
 
+    @property
+    def archive_path(self) -> Path:
+        return Path(self.archive_dir)
+
     @property
     def download_path(self) -> Path:
         path = Path(self.download_dir)
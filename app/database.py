@@ -1,7 +1,22 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.config import settings
 
+# Async drivers for the API (the worker keeps the sync engine)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def _async_database_url(url: str) -> str:
+    """Map a sync database URL to its async driver equivalent."""
+    scheme, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
 # Create engine
 engine = create_engine(
     settings.database_url,
@@ -11,12 +26,21 @@ engine = create_engine(
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session factory for the API
+async_engine = create_async_engine(_async_database_url(settings.database_url))
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,  # no implicit lazy loads after commit
+)
+
 # Base class for models
 Base = declarative_base()
 
 
 def get_db():
-    """Dependency for FastAPI routes."""
+    """Sync session dependency (scripts and worker-side helpers)."""
     db = SessionLocal()
     try:
         yield db
@@ -24,6 +48,46 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency for FastAPI routes."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _add_missing_columns():
+    """
+    Add model columns missing from existing tables.
+
+    A lightweight migration for new nullable columns; anything more
+    involved (renames, type changes) is out of scope.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
 def init_db():
     """Initialize database tables."""
-    Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            # Lets the archiver shrink the file (app.task_archive); only takes
+            # effect on a database without tables, an existing one needs VACUUM
+            conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            Base.metadata.create_all(bind=conn)
+            conn.commit()
+    else:
+        Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+
+    # create_all() skips indexes of tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
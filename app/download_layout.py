@@ -0,0 +1,187 @@
+"""
+Sharded layout of the download directory.
+
+Downloads are named ``<title>_<id>.<ext>``, where <id> is 8 random hex
+characters chosen per download. Instead of one flat directory holding every
+file, each download is written to a subdirectory derived from a hash of
+its id, ``download_shard_depth`` levels of ``download_shard_width`` hex
+characters each:
+
+    downloads/3f/a9/Some title_1b2c3d4e.mp4
+
+Fragments, .part files and post-processed outputs of a download share its
+id and so its directory, which keeps them easy to find and remove. A depth
+of 0 is the old flat layout.
+
+Existing files are moved into the current layout (and task rows pointing at
+them updated) with:
+
+    python -m app.download_layout [--dry-run] [--min-age SECONDS]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# "_<id>." in a download's file name; the last match wins over titles that happen to look alike
+_ID_PATTERN = re.compile(r"_([0-9a-f]{8})\.")
+
+
+def shard_dir(root: Path, unique_id: str) -> Path:
+    """Directory the files of a download with this id go to."""
+    depth, width = settings.download_shard_depth, settings.download_shard_width
+    if depth <= 0:
+        return root
+    digest = hashlib.sha1(unique_id.encode()).hexdigest()
+    return root.joinpath(*(digest[i * width:(i + 1) * width] for i in range(depth)))
+
+
+def shard_key(file_name: str) -> str:
+    """Download id of a file name, or the whole name for files not named by the downloader."""
+    ids = _ID_PATTERN.findall(file_name)
+    return ids[-1] if ids else file_name
+
+
+def path_for(root: Path, file_name: str) -> Path:
+    """Where a file of this name belongs in the current layout."""
+    return shard_dir(root, shard_key(file_name)) / file_name
+
+
+def remove_empty_dirs(root: Path) -> int:
+    """Delete empty shard directories below root; returns how many were removed."""
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if Path(dirpath) == root or filenames:
+            continue
+        try:
+            os.rmdir(dirpath)
+            removed += 1
+        except OSError:
+            pass  # not empty after all (a download just started there)
+    return removed
+
+
+def migrate_files(root: Path, min_age: float = 600, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Move every file below root to where the current layout puts it.
+
+    Args:
+        root: Download directory
+        min_age: Skip files modified less than this many seconds ago (still
+            being written or uploaded by a worker running the old layout)
+        dry_run: Only count what would be moved
+
+    Returns:
+        Counts of moved, skipped (too recent) and conflicting files
+    """
+    counts = {"moved": 0, "skipped": 0, "conflicts": 0}
+    cutoff = time.time() - min_age
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            source = Path(dirpath) / name
+            target = path_for(root, name)
+            if source == target:
+                continue
+            try:
+                if source.stat().st_mtime > cutoff:
+                    counts["skipped"] += 1
+                    continue
+            except FileNotFoundError:
+                continue
+            if target.exists():
+                logger.warning(f"Not moving {source}: {target} already exists")
+                counts["conflicts"] += 1
+                continue
+            if not dry_run:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(source, target)
+            counts["moved"] += 1
+    if not dry_run:
+        remove_empty_dirs(root)
+    return counts
+
+
+def migrate_task_paths(root: Path, batch_size: int = 1000) -> int:
+    """
+    Point tasks at the new location of their local files.
+
+    Only tasks whose recorded file is gone and whose file exists at its
+    current-layout path are changed; download_url is rewritten along with
+    local_path when it is the file:// URL of that path.
+
+    Returns:
+        Number of tasks updated
+    """
+    from app.database import SessionLocal
+    from app.models import Task
+
+    updated = 0
+    db = SessionLocal()
+    try:
+        last_id = ""
+        while True:
+            tasks = (
+                db.query(Task)
+                .filter(Task.local_path.isnot(None), Task.id > last_id)
+                .order_by(Task.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not tasks:
+                break
+            last_id = tasks[-1].id
+            for task in tasks:
+                old = Path(task.local_path)
+                new = path_for(root, old.name)
+                if old == new or old.exists() or not new.exists():
+                    continue
+                if task.download_url == f"file://{task.local_path}":
+                    task.download_url = f"file://{new}"
+                task.local_path = str(new)
+                updated += 1
+            db.commit()
+    finally:
+        db.close()
+    return updated
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Move downloaded files into the sharded directory layout")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without moving anything")
+    parser.add_argument(
+        "--min-age", type=float, default=600,
+        help="skip files modified within this many seconds (default: 600)",
+    )
+    args = parser.parse_args(argv)
+
+    root = settings.download_path
+    logger.info(
+        f"Migrating {root} to depth {settings.download_shard_depth} x width {settings.download_shard_width}"
+        f"{' (dry run)' if args.dry_run else ''}"
+    )
+    counts = migrate_files(root, min_age=args.min_age, dry_run=args.dry_run)
+    # A dry run moves nothing, so there are no task rows to repoint yet
+    tasks = 0 if args.dry_run else migrate_task_paths(root)
+    logger.info(
+        f"Files moved: {counts['moved']}, skipped (recent): {counts['skipped']}, "
+        f"conflicts: {counts['conflicts']}; tasks updated: {tasks}"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    main()
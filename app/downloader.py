@@ -1,18 +1,38 @@
 from __future__ import annotations
 
 import os
+import signal
+import threading
+import time
 import uuid
 import logging
 from pathlib import Path
-from typing import Callable, Any, Optional, List
-from dataclasses import dataclass
+from typing import Callable, Any, Optional, List, Dict, Tuple
+from dataclasses import dataclass, field
 
 import yt_dlp
+from yt_dlp.downloader.external import FFmpegFD
+from yt_dlp.postprocessor import FFmpegMergerPP
 
 from app.config import settings
+from app.bandwidth import BandwidthShare
+from app.cancellation import CHECK_INTERVAL, CancelToken, TaskCancelled
+from app.download_layout import shard_dir
+from app.format_planner import ORIGINAL_AUDIO, FormatPlan, audio_stream_copy, plan_formats
+from app.ytdlp_cache import cache_dir, use_counting_cache
 
 logger = logging.getLogger(__name__)
 
+# Format filters for audio already in the codec of an audio_format
+AUDIO_CODEC_FILTERS = {
+    "aac": "[acodec^=mp4a]",
+    "m4a": "[acodec^=mp4a]",
+    "opus": "[acodec=opus]",
+    "vorbis": "[acodec=vorbis]",
+    "mp3": "[acodec=mp3]",
+    "flac": "[acodec=flac]",
+}
+
 
 @dataclass
 class VideoInfo:
@@ -33,6 +53,12 @@ class DownloadResult:
     file_name: str
     file_size: int
     video_info: VideoInfo
+    extractor: Optional[str] = None  # yt-dlp extractor key, e.g. "Youtube"
+    downloaded_bytes: int = 0  # bytes fetched from the source (all streams)
+    timings: Dict[str, float] = field(default_factory=dict)  # seconds per stage: extract, download, postprocess
+    format_plan: Optional[FormatPlan] = None  # None when a fixed format spec was used
+    audio_mode: Optional[str] = None  # audio downloads: "copy" or "transcode"
+    audio_seconds: Optional[float] = None  # time spent extracting the audio (ffmpeg)
 
 
 class DownloadError(Exception):
@@ -43,6 +69,90 @@ class DownloadError(Exception):
         super().__init__(message)
 
 
+def _clip_section(
+    info: dict,
+    start_time: Optional[float],
+    end_time: Optional[float],
+    chapter: Optional[str],
+) -> Tuple[float, Optional[float]]:
+    """
+    (start, end) seconds of the part of a video to download.
+
+    Raises:
+        DownloadError: If no chapter title contains ``chapter``
+    """
+    if chapter:
+        # Plain substring: a client-supplied regex could stall the whole gevent worker
+        wanted = chapter.casefold()
+        for c in info.get("chapters") or []:
+            if wanted in (c.get("title") or "").casefold():
+                return c.get("start_time") or 0, c.get("end_time")
+        raise DownloadError("CHAPTER_NOT_FOUND", f"No chapter title contains {chapter!r}")
+    return start_time or 0, end_time
+
+
+def _kill_child_processes(marker: str) -> int:
+    """
+    Terminate child processes of this worker whose command line contains marker.
+
+    Linux only (reads /proc); elsewhere nothing is killed.
+    """
+    killed = 0
+    parent = os.getpid()
+    try:
+        pids = [int(name) for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                # "pid (comm) state ppid ...": comm may contain spaces
+                ppid = int(f.read().rsplit(b")", 1)[1].split()[1])
+            if ppid != parent:
+                continue
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                if marker.encode() not in f.read():
+                    continue
+            os.kill(pid, signal.SIGTERM)
+            killed += 1
+        except (OSError, ValueError, IndexError):
+            continue  # exited meanwhile, or not ours to read
+    return killed
+
+
+class _ClipWatchdog:
+    """
+    Stops the ffmpeg process of a clipped download when its task is cancelled.
+
+    yt-dlp's FFmpegFD reports progress only when ffmpeg exits, so the
+    progress hook (and the cancel check in it) does not run while a clip is
+    being fetched. This polls the cancel flag alongside and terminates the
+    download's ffmpeg, recognised by the download id in its output path.
+    """
+
+    def __init__(self, cancel: CancelToken, unique_id: str):
+        self.cancel = cancel
+        self.unique_id = unique_id
+        self._stop = threading.Event()
+        # A greenlet under the gevent pool (threading is patched)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(CHECK_INTERVAL):
+            if self.cancel.is_cancelled():
+                killed = _kill_child_processes(self.unique_id)
+                logger.info(f"Download {self.unique_id} cancelled, stopped {killed} ffmpeg process(es)")
+                return
+
+
 class VideoDownloader:
     """Wrapper around yt-dlp for downloading videos."""
 
@@ -65,6 +175,9 @@ class VideoDownloader:
         }
         if self.proxy:
             opts["proxy"] = self.proxy
+        shared_cache = cache_dir()
+        if shared_cache is not None:
+            opts["cachedir"] = str(shared_cache)
         return opts
 
     def get_video_info(self, url: str) -> VideoInfo:
@@ -85,6 +198,7 @@ class VideoDownloader:
 
         try:
             with yt_dlp.YoutubeDL(opts) as ydl:
+                use_counting_cache(ydl)
                 info = ydl.extract_info(url, download=False)
 
                 if info is None:
@@ -115,9 +229,11 @@ class VideoDownloader:
                 raise DownloadError("UNSUPPORTED_SITE", f"Unsupported URL: {url}")
             else:
                 raise DownloadError("EXTRACTION_ERROR", error_msg)
+        except DownloadError:
+            raise
         except Exception as e:
             logger.exception(f"Unexpected error extracting info from {url}")
-            raise DownloadError("UNKNOWN_ERROR", str(e))
+            raise DownloadError("UNKNOWN_ERROR", str(e)) from e
 
     def _extract_formats(self, formats: list) -> List[dict]:
         """Extract relevant format info."""
@@ -139,6 +255,7 @@ class VideoDownloader:
         download_type: str = "audio_video",
         video_quality: str = "720",
         format_spec: Optional[str] = None,
+        audio_format: str = "mp3",
     ) -> str:
         """
         Build yt-dlp format specification based on download_type and video_quality.
@@ -147,6 +264,7 @@ class VideoDownloader:
             download_type: audio, video, or audio_video
             video_quality: best, worst, or resolution (480, 720, 1080, 1440, 2160)
             format_spec: Override format spec (if provided, use directly)
+            audio_format: Audio codec for audio downloads, or "original"
 
         Returns:
             yt-dlp format string
@@ -161,7 +279,11 @@ class VideoDownloader:
 
         # Build format based on download_type and video_quality
         if download_type == "audio":
-            # Audio only: best audio, fallback to best overall
+            # Audio only: best audio already in the requested codec (copied,
+            # not transcoded), then best audio, fallback to best overall
+            codec_filter = AUDIO_CODEC_FILTERS.get(audio_format)
+            if codec_filter:
+                return f"bestaudio{codec_filter}/bestaudio/best"
             return "bestaudio/best"
 
         elif download_type == "video":
@@ -197,15 +319,33 @@ class VideoDownloader:
                     f"best"
                 )
 
+    def _make_video_info(self, info: dict, formats: Optional[List[dict]] = None) -> VideoInfo:
+        """Build VideoInfo from a yt-dlp info dict."""
+        return VideoInfo(
+            title=info.get("title", "Unknown"),
+            duration=info.get("duration"),
+            thumbnail=info.get("thumbnail"),
+            filesize=info.get("filesize") or info.get("filesize_approx"),
+            uploader=info.get("uploader"),
+            upload_date=info.get("upload_date"),
+            formats=formats,
+        )
+
     def download(
         self,
         url: str,
         progress_callback: Optional[Callable[[float, str], None]] = None,
+        info_callback: Optional[Callable[[VideoInfo], None]] = None,
         download_type: str = "audio_video",
         video_quality: str = "720",
         format_spec: Optional[str] = None,
         extract_audio: bool = False,
         audio_format: str = "mp3",
+        start_time: Optional[float] = None,
+        end_time: Optional[float] = None,
+        chapter: Optional[str] = None,
+        bandwidth: Optional[BandwidthShare] = None,
+        cancel: Optional[CancelToken] = None,
     ) -> DownloadResult:
         """
         Download video from URL.
@@ -213,28 +353,44 @@ class VideoDownloader:
         Args:
             url: Video URL
             progress_callback: Optional callback(progress_percent, status_message)
+            info_callback: Optional callback(video_info), called once extraction is done
             download_type: Download type - audio, video, or audio_video
             video_quality: Video quality - best, worst, or resolution (480, 720, 1080, 1440, 2160)
             format_spec: yt-dlp format specification (overrides download_type/video_quality)
             extract_audio: [Deprecated] Use download_type='audio' instead
-            audio_format: Audio format when download_type is 'audio' (mp3, aac, wav, m4a)
+            audio_format: Audio format when download_type is 'audio' (mp3, aac, m4a, opus,
+                flac, wav), or "original" to keep the source codec
+            start_time: Clip start in seconds; only the clip is downloaded
+            end_time: Clip end in seconds (default: end of the video)
+            chapter: Download only the first chapter whose title contains this text
+                (case-insensitive)
+            bandwidth: Optional download bandwidth share (rate limit follows it;
+                not applied to clips, which ffmpeg fetches itself)
+            cancel: Optional cancellation token, checked for every chunk downloaded
+                (for clips, by _ClipWatchdog)
 
         Returns:
             DownloadResult with file path and metadata
 
         Raises:
             DownloadError: If download fails
+            TaskCancelled: If the task was cancelled (partial files are removed)
         """
+        clip = start_time is not None or end_time is not None or bool(chapter)
+        if clip and not FFmpegFD.available():
+            raise DownloadError("FFMPEG_REQUIRED", "Downloading part of a video requires ffmpeg")
+
         # Handle legacy extract_audio parameter
         if extract_audio and download_type == "audio_video":
             download_type = "audio"
 
         # Build format specification
-        computed_format = self._build_format_spec(download_type, video_quality, format_spec)
+        computed_format = self._build_format_spec(download_type, video_quality, format_spec, audio_format)
 
         # Generate unique filename to avoid conflicts
         unique_id = str(uuid.uuid4())[:8]
-        output_template = str(self.download_dir / f"%(title).100s_{unique_id}.%(ext)s")
+        work_dir = shard_dir(self.download_dir, unique_id)
+        output_template = str(work_dir / f"%(title).100s_{unique_id}.%(ext)s")
 
         opts = self._get_base_opts()
         opts.update({
@@ -245,21 +401,44 @@ class VideoDownloader:
             "retries": 3,
             "fragment_retries": 3,
         })
-
-        # Audio extraction post-processing
+        if bandwidth is not None:
+            opts["ratelimit"] = bandwidth.ratelimit()
+        if clip:
+            # yt-dlp hands sections to ffmpeg, which seeks in the input: only
+            # the overlapping HLS/DASH fragments (or byte ranges of a
+            # progressive file) are fetched
+            def download_ranges(info_dict: dict, ydl) -> List[dict]:
+                start, end = _clip_section(info_dict, start_time, end_time, chapter)
+                return [{"start_time": start, "end_time": end if end is not None else float("inf")}]
+
+            opts["download_ranges"] = download_ranges
+
+        # Audio extraction post-processing. ffmpeg copies the stream when it
+        # is already in the requested codec and only transcodes otherwise
         if download_type == "audio":
-            opts["postprocessors"] = [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": audio_format,
-                "preferredquality": "192",
-            }]
+            if audio_format == ORIGINAL_AUDIO:
+                # Keep the source codec, at most changing the container
+                opts["postprocessors"] = [{"key": "FFmpegExtractAudio", "preferredcodec": "best"}]
+            else:
+                opts["postprocessors"] = [{
+                    "key": "FFmpegExtractAudio",
+                    "preferredcodec": audio_format,
+                    "preferredquality": "192",
+                }]
 
         # Progress tracking
         downloaded_file = None
         video_info = None
+        downloaded_bytes = 0
+        postprocess_seconds = 0.0
+        audio_seconds = None
+        postprocess_started: Dict[str, float] = {}
 
         def progress_hook(d: dict):
-            nonlocal downloaded_file
+            nonlocal downloaded_file, downloaded_bytes
+
+            if cancel is not None:
+                cancel.check()
 
             if d["status"] == "downloading":
                 total = d.get("total_bytes") or d.get("total_bytes_estimate", 0)
@@ -274,14 +453,81 @@ class VideoDownloader:
 
             elif d["status"] == "finished":
                 downloaded_file = d.get("filename")
+                downloaded_bytes += d.get("downloaded_bytes") or d.get("total_bytes") or 0
                 if progress_callback:
                     progress_callback(100, "Download complete, processing...")
 
+        def postprocessor_hook(d: dict):
+            nonlocal postprocess_seconds, audio_seconds
+            name = d.get("postprocessor")
+            if d["status"] == "started":
+                postprocess_started[name] = time.monotonic()
+            elif d["status"] == "finished" and name in postprocess_started:
+                seconds = time.monotonic() - postprocess_started.pop(name)
+                postprocess_seconds += seconds
+                if name == "ExtractAudio":
+                    audio_seconds = seconds
+
         opts["progress_hooks"] = [progress_hook]
+        opts["postprocessor_hooks"] = [postprocessor_hook]
+
+        # Let the format planner choose from the formats each video offers,
+        # unless the caller asked for a specific format
+        format_plan = None
+        duration = None  # known once extracted; sizes are estimated from bitrates without it
+        if settings.format_planner_enabled and not format_spec:
+            def select_formats(ctx: dict):
+                nonlocal format_plan
+                format_plan = plan_formats(
+                    ctx["formats"],
+                    download_type=download_type,
+                    video_quality=video_quality,
+                    duration=duration,
+                    can_merge=FFmpegMergerPP(ydl).available,
+                    audio_format=audio_format,
+                )
+                if format_plan and clip and duration and format_plan.estimated_size:
+                    # Only the clip is fetched
+                    start, end = _clip_section(ie_result, start_time, end_time, chapter)
+                    fraction = (min(end or duration, duration) - start) / duration
+                    format_plan.estimated_size = int(format_plan.estimated_size * max(fraction, 0))
+                    format_plan.reasons.append("clip")
+                if format_plan:
+                    logger.info(
+                        f"Format plan for {url}: {format_plan.format_spec} "
+                        f"({', '.join(format_plan.reasons)}, ~{format_plan.estimated_size or '?'} bytes)"
+                    )
+                spec = format_plan.format_spec if format_plan else computed_format
+                return ydl.build_format_selector(spec)(ctx)
+
+            opts["format"] = select_formats
 
         try:
             with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+                use_counting_cache(ydl)
+                # Extract first (no format selection yet), then download, so
+                # each stage can be timed separately
+                started = time.monotonic()
+                ie_result = ydl.extract_info(url, download=False, process=False)
+                extract_seconds = time.monotonic() - started
+
+                if ie_result is None:
+                    raise DownloadError("DOWNLOAD_ERROR", "Failed to download video")
+
+                duration = ie_result.get("duration")
+                if info_callback and ie_result.get("_type", "video") == "video":
+                    info_callback(self._make_video_info(ie_result))
+
+                if cancel is not None:
+                    cancel.check()
+
+                started = time.monotonic()
+                if clip and cancel is not None:
+                    with _ClipWatchdog(cancel, unique_id):
+                        info = ydl.process_ie_result(ie_result, download=True)
+                else:
+                    info = ydl.process_ie_result(ie_result, download=True)
+                process_seconds = time.monotonic() - started
 
                 if info is None:
                     raise DownloadError("DOWNLOAD_ERROR", "Failed to download video")
@@ -292,22 +538,17 @@ class VideoDownloader:
                     if entries:
                         info = entries[0]
 
-                video_info = VideoInfo(
-                    title=info.get("title", "Unknown"),
-                    duration=info.get("duration"),
-                    thumbnail=info.get("thumbnail"),
-                    filesize=info.get("filesize") or info.get("filesize_approx"),
-                    uploader=info.get("uploader"),
-                    upload_date=info.get("upload_date"),
-                    formats=None,
-                )
+                video_info = self._make_video_info(info)
+                audio_mode = None
+                if download_type == "audio":
+                    audio_mode = "copy" if audio_stream_copy(info, audio_format) else "transcode"
 
                 # Find the downloaded file
                 if downloaded_file and os.path.exists(downloaded_file):
                     file_path = Path(downloaded_file)
                 else:
                     # Fallback: find the file by pattern
-                    file_path = self._find_downloaded_file(info, unique_id)
+                    file_path = self._find_downloaded_file(work_dir, unique_id)
 
                 if not file_path or not file_path.exists():
                     raise DownloadError("FILE_NOT_FOUND", "Downloaded file not found")
@@ -327,29 +568,57 @@ class VideoDownloader:
                     file_name=file_path.name,
                     file_size=file_size,
                     video_info=video_info,
+                    extractor=info.get("extractor_key"),
+                    downloaded_bytes=downloaded_bytes or file_size,
+                    format_plan=format_plan,
+                    audio_mode=audio_mode,
+                    audio_seconds=audio_seconds,
+                    timings={
+                        "extract": extract_seconds,
+                        "download": max(process_seconds - postprocess_seconds, 0.0),
+                        "postprocess": postprocess_seconds,
+                    },
                 )
 
-        except yt_dlp.utils.DownloadError as e:
+        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+            if cancel is not None and cancel.is_cancelled():
+                # ffmpeg of a clip was stopped by _ClipWatchdog
+                self._remove_partial_files(work_dir, unique_id)
+                raise TaskCancelled(cancel.task_id)
             error_msg = str(e)
             if "Video unavailable" in error_msg:
                 raise DownloadError("VIDEO_UNAVAILABLE", "Video is unavailable")
             elif "HTTP Error 429" in error_msg or "rate limit" in error_msg.lower():
                 raise DownloadError("RATE_LIMITED", "Rate limited by source site")
+            elif "timed out" in error_msg.lower():
+                raise DownloadError("TIMEOUT", error_msg)
             else:
                 raise DownloadError("DOWNLOAD_ERROR", error_msg)
+        except TaskCancelled:
+            self._remove_partial_files(work_dir, unique_id)
+            raise
         except DownloadError:
             raise
         except Exception as e:
             logger.exception(f"Unexpected error downloading {url}")
             raise DownloadError("UNKNOWN_ERROR", str(e))
 
-    def _find_downloaded_file(self, info: dict, unique_id: str) -> Optional[Path]:
-        """Find downloaded file by matching pattern."""
-        title = info.get("title", "")[:100]
+    def _remove_partial_files(self, work_dir: Path, unique_id: str) -> None:
+        """Delete everything a download left behind (.part, fragments, finished streams)."""
+        for file in work_dir.glob(f"*_{unique_id}.*"):
+            try:
+                file.unlink()
+                logger.info(f"Deleted partial file: {file}")
+            except OSError as e:
+                logger.warning(f"Failed to delete partial file {file}: {e}")
 
-        # Look for files with our unique_id
-        for file in self.download_dir.iterdir():
-            if unique_id in file.name:
+    def _find_downloaded_file(self, work_dir: Path, unique_id: str) -> Optional[Path]:
+        """Find downloaded file by matching pattern."""
+        # Look for files with our unique_id (the shard directory holds only a few)
+        if not work_dir.is_dir():
+            return None
+        for file in work_dir.iterdir():
+            if unique_id in file.name and not file.name.endswith((".part", ".ytdl")):
                 return file
 
         return None
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.config import settings
+
+# Blocking calls made from API handlers (broker publish, revoke, ...) run
+# here, never on the event loop or Starlette's shared threadpool.
+blocking_executor = ThreadPoolExecutor(
+    max_workers=settings.api_blocking_workers,
+    thread_name_prefix="api-blocking",
+)
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking callable on the dedicated executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,62 @@
+"""
+Signed links to locally stored task files.
+
+Tasks with storage_type "local" are served by ``GET /api/v1/tasks/{id}/file``.
+The endpoint only accepts links carrying an HMAC-SHA256 signature (keyed
+with ``file_url_secret``) of the task ID and an expiry time:
+
+    /api/v1/tasks/<id>/file?expires=<unix time>&signature=<hex>
+
+Without a secret, files are not served at all unless ``file_url_unsigned``
+explicitly allows plain, non-expiring links for anyone with a task ID.
+
+Expiry times are rounded up to EXPIRY_GRANULARITY, so a task's link stays
+the same for a while instead of changing on every status poll.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import math
+import time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlencode
+
+from app.config import settings
+
+EXPIRY_GRANULARITY = 300  # seconds
+
+
+def _signature(task_id: str, expires: int) -> str:
+    message = f"{task_id}:{expires}".encode()
+    return hmac.new(settings.file_url_secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def signed_file_url(task_id: str) -> Optional[str]:
+    """Link to the task's file, or None when files are not served."""
+    url = f"{(settings.public_base_url or '').rstrip('/')}/api/v1/tasks/{task_id}/file"
+    if not settings.file_url_secret:
+        return url if settings.file_url_unsigned else None
+    expires = math.ceil((time.time() + settings.file_url_ttl) / EXPIRY_GRANULARITY) * EXPIRY_GRANULARITY
+    return f"{url}?{urlencode({'expires': expires, 'signature': _signature(task_id, expires)})}"
+
+
+def verify(task_id: str, expires: Optional[int], signature: Optional[str]) -> bool:
+    """Whether a request for the task's file is allowed."""
+    if not settings.file_url_secret:
+        return settings.file_url_unsigned
+    if expires is None or not signature or expires < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(task_id, expires))
+
+
+def local_file(download_url: Optional[str]) -> Optional[Path]:
+    """Path of a locally stored result, or None (cloud storage, or outside the download directory)."""
+    if not download_url or not download_url.startswith("file://"):
+        return None
+    path = Path(download_url[len("file://"):]).resolve()
+    if not path.is_relative_to(settings.download_path.resolve()):
+        return None
+    return path
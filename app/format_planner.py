@@ -0,0 +1,252 @@
+"""
+Cost-aware format selection.
+
+The fixed format strings of VideoDownloader._build_format_spec prefer
+separate video + audio streams, which need an ffmpeg merge even when a
+progressive (video with audio) format of the same height exists. The
+planner looks at the formats a video actually offers and picks the
+cheapest plan for the requested quality:
+
+1. the height: the highest available at or below the requested one
+   (the lowest available when the video has nothing that small)
+2. among plans of that height, in order: no merge, no remux (the output
+   keeps a native mp4/webm/m4a container), fewest bytes, plain HTTP over
+   fragmented protocols
+
+Audio-only requests prefer streams already in the requested codec (AAC
+for m4a/aac, Opus for opus, ...), which ffmpeg then copies instead of
+transcoding; "original" accepts any codec. Among those they take the best
+bitrate, then the same order. The plan is handed to yt-dlp as a format-ID
+spec such as "18" or "137+140".
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+NATIVE_EXTS = {"mp4", "webm", "m4a", "mp3", "ogg", "opus"}
+# Video / audio containers yt-dlp merges without falling back to mkv
+MERGE_COMPATIBLE = {("mp4", "m4a"), ("mp4", "mp4"), ("webm", "webm")}
+FRAGMENTED_PROTOCOLS = ("m3u8", "http_dash_segments", "f4m", "ism")
+
+# audio_format that keeps whatever codec the source has
+ORIGINAL_AUDIO = "original"
+# Codec of each audio_format; ffmpeg copies streams already in it (wav is PCM, always decoded)
+AUDIO_FORMAT_CODECS = {
+    "mp3": "mp3",
+    "aac": "aac",
+    "m4a": "aac",
+    "opus": "opus",
+    "vorbis": "vorbis",
+    "flac": "flac",
+    "alac": "alac",
+    "wav": None,
+}
+# Codec by container, for formats without codec info
+_EXT_CODECS = {"m4a": "aac", "mp3": "mp3", "opus": "opus", "ogg": "vorbis", "flac": "flac"}
+
+
+@dataclass
+class FormatPlan:
+    """Formats chosen for a download."""
+
+    format_ids: List[str]
+    estimated_size: Optional[int]  # bytes; None when the source gives no size or bitrate
+    merge: bool = False  # separate video and audio streams merged by ffmpeg
+    remux: bool = False  # output needs a container change (e.g. HLS fixup, mkv merge)
+    ext: Optional[str] = None
+    height: Optional[int] = None
+    audio_mode: Optional[str] = None  # audio downloads: "copy" or "transcode"
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def format_spec(self) -> str:
+        """yt-dlp format string selecting exactly these formats."""
+        return "+".join(self.format_ids)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _has_video(f: dict) -> bool:
+    # yt-dlp treats formats without codec info as carrying both streams
+    return f.get("vcodec") != "none"
+
+
+def _has_audio(f: dict) -> bool:
+    return f.get("acodec") != "none"
+
+
+def _is_progressive(f: dict) -> bool:
+    return _has_video(f) and _has_audio(f)
+
+
+def audio_codec(f: dict) -> Optional[str]:
+    """Audio codec of a format, in ffprobe's naming (aac, opus, mp3, ...)."""
+    acodec = (f.get("acodec") or "").lower()
+    if acodec.startswith("mp4a") or acodec == "aac":
+        return "aac"
+    for codec in ("opus", "vorbis", "mp3", "flac", "alac"):
+        if acodec.startswith(codec):
+            return codec
+    return _EXT_CODECS.get(f.get("ext"))
+
+
+def audio_stream_copy(f: dict, audio_format: str) -> bool:
+    """Whether extracting audio_format from this format copies the stream instead of transcoding."""
+    if audio_format == ORIGINAL_AUDIO:
+        return True
+    target = AUDIO_FORMAT_CODECS.get(audio_format)
+    return target is not None and audio_codec(f) == target
+
+
+def _estimated_size(f: dict, duration: Optional[float]) -> Optional[int]:
+    size = f.get("filesize") or f.get("filesize_approx")
+    if size:
+        return int(size)
+    if f.get("tbr") and duration:
+        return int(f["tbr"] * 125 * duration)  # kbit/s -> bytes
+    return None
+
+
+def _is_fragmented(f: dict) -> bool:
+    return (f.get("protocol") or "").startswith(FRAGMENTED_PROTOCOLS)
+
+
+def _needs_remux(f: dict) -> bool:
+    # HLS output is MPEG-TS until ffmpeg fixes up the container
+    return f.get("ext") not in NATIVE_EXTS or (f.get("protocol") or "").startswith("m3u8")
+
+
+class _Candidate:
+    def __init__(self, formats: List[dict], duration: Optional[float]):
+        self.formats = formats
+        self.merge = len(formats) > 1
+        sizes = [_estimated_size(f, duration) for f in formats]
+        self.size = None if None in sizes else sum(sizes)
+        if self.merge:
+            video, audio = formats
+            self.remux = (
+                (video.get("ext"), audio.get("ext")) not in MERGE_COMPATIBLE
+                or any(_needs_remux(f) for f in formats)
+            )
+        else:
+            self.remux = _needs_remux(formats[0])
+        self.fragmented = any(_is_fragmented(f) for f in formats)
+        self.height = formats[0].get("height")
+
+    def cost(self):
+        return (
+            self.merge,
+            self.remux,
+            self.size if self.size is not None else math.inf,
+            self.fragmented,
+        )
+
+    def plan(self) -> FormatPlan:
+        reasons = ["merge" if self.merge else "single file"]
+        reasons.append("remux" if self.remux else "native container")
+        if self.fragmented:
+            reasons.append("fragmented")
+        return FormatPlan(
+            format_ids=[str(f["format_id"]) for f in self.formats],
+            estimated_size=self.size,
+            merge=self.merge,
+            remux=self.remux,
+            ext=self.formats[0].get("ext"),
+            height=self.height,
+            reasons=reasons,
+        )
+
+
+def _target_height(formats: Iterable[dict], video_quality: str) -> Optional[int]:
+    heights = sorted({f["height"] for f in formats if f.get("height")})
+    if not heights:
+        return None
+    if video_quality == "best":
+        return heights[-1]
+    if video_quality == "worst":
+        return heights[0]
+    try:
+        limit = int(video_quality)
+    except ValueError:
+        return heights[-1]
+    at_most = [h for h in heights if h <= limit]
+    return at_most[-1] if at_most else heights[0]
+
+
+def _best_audio(audio: List[dict], video: dict, worst: bool) -> dict:
+    """Best (or worst) bitrate audio, preferring one that merges into the video's container."""
+    compatible = [a for a in audio if (video.get("ext"), a.get("ext")) in MERGE_COMPATIBLE] or audio
+    pick = min if worst else max
+    return pick(compatible, key=lambda a: a.get("abr") or a.get("tbr") or 0)
+
+
+def plan_formats(
+    formats: Optional[List[dict]],
+    download_type: str = "audio_video",
+    video_quality: str = "720",
+    duration: Optional[float] = None,
+    can_merge: bool = True,
+    audio_format: str = "mp3",
+) -> Optional[FormatPlan]:
+    """
+    Pick the cheapest formats for a download.
+
+    Args:
+        formats: yt-dlp format dicts of the video
+        download_type: audio, video, or audio_video
+        video_quality: best, worst, or maximum height (480, 720, 1080, ...)
+        duration: Video duration in seconds, for size estimates from bitrates
+        can_merge: Whether ffmpeg is available to merge separate streams
+        audio_format: Codec audio downloads are converted to, or "original"
+
+    Returns:
+        FormatPlan, or None when no format fits (the caller then falls back
+        to the fixed format strings)
+    """
+    formats = [f for f in formats or [] if f.get("format_id") and f.get("url")]
+    if not formats:
+        return None
+
+    if download_type == "audio":
+        audio = [f for f in formats if _has_audio(f) and not _has_video(f)]
+        if not audio:
+            return None
+        # A stream in the requested codec is copied; anything else is transcoded
+        copyable = [a for a in audio if audio_stream_copy(a, audio_format)]
+        pool = copyable or audio
+        pick = min if video_quality == "worst" else max
+        bitrate = pick(a.get("abr") or a.get("tbr") or 0 for a in pool)
+        candidates = [
+            _Candidate([a], duration) for a in pool
+            if (a.get("abr") or a.get("tbr") or 0) == bitrate
+        ]
+        plan = min(candidates, key=_Candidate.cost).plan()
+        plan.audio_mode = "copy" if copyable else "transcode"
+        plan.reasons.append("stream copy" if copyable else f"transcode to {audio_format}")
+        return plan
+
+    video_only = [f for f in formats if _has_video(f) and not _has_audio(f)]
+    progressive = [f for f in formats if _is_progressive(f)]
+    audio_only = [f for f in formats if _has_audio(f) and not _has_video(f)]
+
+    if download_type == "video":
+        # Video-only streams first; progressive formats carry audio bytes we do not need
+        pool = video_only or progressive
+        target = _target_height(pool, video_quality)
+        candidates = [_Candidate([f], duration) for f in pool if f.get("height") == target]
+    else:
+        mergeable = video_only if can_merge and audio_only else []
+        target = _target_height(progressive + mergeable, video_quality)
+        candidates = [_Candidate([f], duration) for f in progressive if f.get("height") == target]
+        candidates += [
+            _Candidate([v, _best_audio(audio_only, v, video_quality == "worst")], duration)
+            for v in mergeable if v.get("height") == target
+        ]
+
+    if not candidates:
+        return None
+    return min(candidates, key=_Candidate.cost).plan()
@@ -1,37 +1,75 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import json
+import os
 import logging
+import time
 from contextlib import asynccontextmanager
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Set, Tuple
 
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import FileResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+import redis
 
 from app.config import settings
-from app.database import get_db, init_db
-from app.models import Task, TaskStatus
+from app.database import SessionLocal, async_engine, get_async_db, init_db
+from app.models import FINISHED_STATUSES, ArchivedTask, Task, TaskStatus
 from app.schemas import (
     CreateTaskRequest,
     CreateTaskResponse,
     TaskResponse,
     TaskListResponse,
+    TaskStatusRequest,
+    TaskStatusResponse,
     CancelTaskResponse,
+    ProfileTaskResponse,
     VideoInfoRequest,
     VideoInfoResponse,
     VideoFormat,
     HealthResponse,
+    CallbackStatsResponse,
+    TimingStatsResponse,
     ErrorResponse,
-    VideoInfo,
-    TaskResult,
-    TaskError,
 )
-from app.downloader import get_video_info, DownloadError
+from app.downloader import DownloadError
+from app.executors import blocking_executor, run_blocking
 from app.tasks import download_video_task
+from app.callback_dispatcher import get_callback_stats
+from app.task_stats import get_timing_stats
+from app.video_info import VideoInfoTimeout, video_info_client
+from app.redis_client import get_async_redis, get_async_redis_blocking
+from app.metrics import QUEUE_DEPTH, TASKS_BY_STATUS, MetricsMiddleware
+from app.profiling import ProfilingMiddleware, flag_task
+from app.cancellation import request_cancel
+from app.file_links import local_file, verify
+from app.presigned_urls import presigned_url
+from app.task_archive import read_archived
+from app.task_events import task_event_hub
+from app.task_state import (
+    TaskState,
+    get_cached_task_states,
+    invalidate_task_state,
+    serialize,
+    store_task_states,
+    task_to_response,
+)
+from app.status_counters import (
+    get_queue_depth_async,
+    get_status_counts_async,
+    record_transition_async,
+    seed_status_counts,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -47,9 +85,22 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Initializing database...")
     init_db()
+    db = SessionLocal()
+    try:
+        seed_status_counts(db)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to seed status counters: {e}")
+    finally:
+        db.close()
     logger.info("Application started")
     yield
     # Shutdown
+    blocking_executor.shutdown(wait=False)
+    await task_event_hub.close()
+    for client in (get_async_redis, get_async_redis_blocking):
+        await client().aclose()
+        client.cache_clear()
+    await async_engine.dispose()
     logger.info("Application shutdown")
 
 
@@ -70,6 +121,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request duration metrics (see GET /metrics)
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
+# Sampling profiler for a fraction of requests (see app.profiling)
+if settings.profile_api_sample_rate > 0:
+    app.add_middleware(ProfilingMiddleware)
+
 # Static files
 STATIC_DIR = Path(__file__).parent / "static"
 if STATIC_DIR.exists():
@@ -81,19 +140,31 @@ if STATIC_DIR.exists():
 @app.post(
     "/api/v1/tasks",
     response_model=CreateTaskResponse,
-    responses={400: {"model": ErrorResponse}},
+    responses={400: {"model": ErrorResponse}, 409: {"model": ErrorResponse}, 503: {"model": ErrorResponse}},
     summary="Create download task",
-    description="Submit a new video download task",
+    description=(
+        "Submit a new video download task. With an Idempotency-Key header (or "
+        "idempotency_key field), resubmissions return the original task"
+    ),
 )
-def create_task(
+async def create_task(
     request: CreateTaskRequest,
-    db: Session = Depends(get_db),
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Create a new download task."""
     # Validate URL (basic check)
     if not request.video_url.startswith(("http://", "https://")):
         raise HTTPException(status_code=400, detail="Invalid video URL")
 
+    # A retried submission returns the original task: no writes, no new message
+    idempotency_key = idempotency_key or request.idempotency_key
+    if idempotency_key:
+        existing = await _task_by_idempotency_key(db, idempotency_key)
+        if existing is not None:
+            return _idempotent_replay(existing, request, response)
+
     # Validate storage configuration
     storage_type = request.storage_type.value if request.storage_type else "local"
     if storage_type != "local" and not request.storage_url:
@@ -107,25 +178,43 @@ def create_task(
         video_url=request.video_url,
         callback_url=request.callback_url,
         options=request.options.model_dump() if request.options else None,
+        idempotency_key=idempotency_key,
         status=TaskStatus.PENDING.value,
     )
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent request with the same key won the insert
+        await db.rollback()
+        existing = await _task_by_idempotency_key(db, idempotency_key) if idempotency_key else None
+        if existing is None:
+            raise
+        return _idempotent_replay(existing, request, response)
+    await record_transition_async(None, TaskStatus.PENDING.value)
 
     # Queue Celery task with new parameters
-    celery_task = download_video_task.delay(
-        task_id=task.id,
-        video_url=request.video_url,
-        callback_url=request.callback_url,
-        storage_type=storage_type,
-        storage_url=request.storage_url,
-        options=request.options.model_dump() if request.options else None,
-    )
+    try:
+        celery_task = await run_blocking(
+            download_video_task.delay,
+            task_id=task.id,
+            video_url=request.video_url,
+            callback_url=request.callback_url,
+            storage_type=storage_type,
+            storage_url=request.storage_url,
+            options=request.options.model_dump() if request.options else None,
+        )
+    except Exception as e:
+        # Never queued: drop the row so the idempotency key can be retried
+        logger.error(f"Failed to queue task {task.id}: {e}")
+        await db.delete(task)
+        await db.commit()
+        await record_transition_async(TaskStatus.PENDING.value, None)
+        raise HTTPException(status_code=503, detail=f"Task queue unavailable: {e}")
 
     # Update celery task id
     task.celery_task_id = celery_task.id
-    db.commit()
+    await db.commit()
 
     logger.info(f"Created task {task.id} for URL: {request.video_url} (storage: {storage_type})")
 
@@ -137,23 +226,166 @@ def create_task(
     )
 
 
+async def _task_by_idempotency_key(db: AsyncSession, key: str) -> Optional[Task]:
+    result = await db.execute(select(Task).where(Task.idempotency_key == key))
+    return result.scalar_one_or_none()
+
+
+def _idempotent_replay(task: Task, request: CreateTaskRequest, response: Response) -> CreateTaskResponse:
+    """Response for a resubmitted idempotency key."""
+    if task.video_url != request.video_url:
+        raise HTTPException(
+            status_code=409,
+            detail="Idempotency key was already used for a different video_url",
+        )
+    response.headers["Idempotent-Replayed"] = "true"
+    logger.info(f"Idempotent replay of task {task.id}")
+    return CreateTaskResponse(
+        task_id=task.id,
+        status=task.status,
+        video_url=task.video_url,
+        created_at=task.created_at,
+    )
+
+
 @app.get(
     "/api/v1/tasks/{task_id}",
     response_model=TaskResponse,
-    responses={404: {"model": ErrorResponse}},
+    responses={
+        304: {"description": "Not modified (If-None-Match matches the current ETag)"},
+        404: {"model": ErrorResponse},
+    },
     summary="Get task status",
-    description="Get the status and details of a download task",
+    description=(
+        "Get the status and details of a download task. Responses carry an ETag; "
+        "send it back in If-None-Match to get 304 while the task is unchanged. "
+        "With wait and since_version the request is held until the task's version "
+        "moves past since_version or wait seconds pass (long polling)"
+    ),
 )
-def get_task(
+async def get_task(
     task_id: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    wait: Optional[float] = Query(
+        None, gt=0,
+        description="Seconds to wait for a change (requires since_version; capped at TASK_WAIT_MAX)",
+    ),
+    since_version: Optional[int] = Query(None, ge=0, description="Last version seen by the client"),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Get task by ID."""
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if not task:
+    """Get task by ID, from the Redis state cache when possible."""
+    state = await _task_state(task_id, db)
+    if wait is not None and since_version is not None and state.version <= since_version:
+        deadline = time.monotonic() + min(wait, settings.task_wait_max)
+        # Watch before re-reading, so a change in between still wakes us
+        async with task_event_hub.watch(task_id) as changed:
+            state = await _task_state(task_id, db)
+            while state.version <= since_version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Don't hold a pooled connection (or stale identity map) while idle
+                await db.close()
+                changed.clear()
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                state = await _task_state(task_id, db)
+
+    response = Response(state.body, media_type="application/json", headers={"ETag": state.etag})
+    if _not_modified(request, response):
+        return Response(status_code=304, headers={"ETag": state.etag})
+    return response
+
+
+async def _task_state(task_id: str, db: AsyncSession) -> TaskState:
+    """State of one task; raises 404 for unknown IDs."""
+    state = (await _task_states([task_id], db)).get(task_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Task not found")
+    return state
+
+
+async def _task_states(task_ids: List[str], db: AsyncSession) -> Dict[str, TaskState]:
+    """
+    Serialized states of existing tasks among task_ids.
+
+    Served from the Redis state cache; misses are read with one IN query
+    and cached for the next request.
+    """
+    states = await get_cached_task_states(task_ids)
+    missing = [task_id for task_id in task_ids if task_id not in states]
+    if not missing:
+        return states
+
+    tasks = list((await db.execute(select(Task).where(Task.id.in_(missing)))).scalars().all())
+    if len(tasks) < len(missing):
+        tasks.extend(await _archived_tasks(set(missing) - {task.id for task in tasks}, db))
+    responses = [task_to_response(task) for task in tasks]
+    signed = [(task, response) for task, response in zip(tasks, responses) if response.result and task.storage_key]
+    if signed:
+        urls = await asyncio.gather(*(presigned_url(task) for task, _ in signed))
+        for (_, response), url in zip(signed, urls):
+            response.result.signed_url = url
+
+    fresh = {response.task_id: serialize(response) for response in responses}
+    await store_task_states(fresh)
+    states.update((task_id, state) for task_id, (state, _) in fresh.items())
+    return states
+
+
+async def _archived_tasks(task_ids: Set[str], db: AsyncSession) -> List[Task]:
+    """Tasks moved to the archive (app.task_archive), rebuilt from their segments."""
+    entries = (await db.execute(
+        select(ArchivedTask).where(ArchivedTask.task_id.in_(task_ids))
+    )).scalars().all()
+    if not entries:
+        return []
+    archived = await run_blocking(read_archived, entries, settings.archive_path)
+    return list(archived.values())
 
-    return _task_to_response(task)
+
+@app.post(
+    "/api/v1/tasks:status",
+    response_model=TaskStatusResponse,
+    summary="Get many task states",
+    description=(
+        "Get the states of up to 1000 tasks in one request, optionally only those "
+        "changed since a known version per task or since a point in time"
+    ),
+)
+async def get_task_states(
+    body: TaskStatusRequest,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Bulk status lookup from the state cache, falling back to one IN query."""
+    task_ids = list(dict.fromkeys(body.task_ids))
+    states = await _task_states(task_ids, db)
+
+    since_versions = body.since_versions or {}
+    updated_since = body.updated_since
+    if updated_since is not None and updated_since.tzinfo is not None:
+        updated_since = updated_since.astimezone(timezone.utc).replace(tzinfo=None)
+
+    bodies = []
+    for task_id in task_ids:
+        state = states.get(task_id)
+        if state is None:
+            continue
+        known = since_versions.get(task_id)
+        if known is not None and state.version <= known:
+            continue
+        if updated_since is not None and state.updated_at is not None and state.updated_at <= updated_since:
+            continue
+        bodies.append(state.body)
+
+    # Cached states are already JSON; splice them instead of re-serializing
+    not_found = [task_id for task_id in task_ids if task_id not in states]
+    return Response(
+        f'{{"tasks":[{",".join(bodies)}],"not_found":{json.dumps(not_found)}}}',
+        media_type="application/json",
+    )
 
 
 @app.get(
@@ -162,64 +394,110 @@ def get_task(
     summary="List tasks",
     description="Get a paginated list of download tasks",
 )
-def list_tasks(
+async def list_tasks(
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(20, ge=1, le=100, description="Items per page"),
     status: Optional[str] = Query(None, description="Filter by status"),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Keyset cursor from a previous page (overrides page)"),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """List all tasks with pagination."""
-    query = db.query(Task)
+    """List all tasks with pagination.
+
+    Pass ``cursor`` (the ``next_cursor`` of the previous page) for keyset
+    pagination; ``page`` is kept for backward compatibility but costs an
+    OFFSET scan on deep pages.
+    """
+    query = select(Task)
 
     if status:
-        query = query.filter(Task.status == status)
-
-    total = query.count()
-    tasks = (
-        query
-        .order_by(Task.created_at.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
+        query = query.where(Task.status == status)
+
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = _decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(
+            or_(
+                Task.created_at < cursor_created_at,
+                and_(Task.created_at == cursor_created_at, Task.id < cursor_id),
+            )
+        )
+
+    query = query.order_by(Task.created_at.desc(), Task.id.desc())
+    if not cursor:
+        query = query.offset((page - 1) * page_size)
+
+    # Fetch one extra row to know whether there is a next page
+    tasks = (await db.scalars(query.limit(page_size + 1))).all()
+
+    next_cursor = None
+    if len(tasks) > page_size:
+        tasks = tasks[:page_size]
+        next_cursor = _encode_cursor(tasks[-1])
 
     return TaskListResponse(
-        total=total,
+        total=await _count_tasks(db, status),
         page=page,
         page_size=page_size,
-        tasks=[_task_to_response(t) for t in tasks],
+        tasks=[task_to_response(t) for t in tasks],
+        next_cursor=next_cursor,
     )
 
 
 @app.delete(
     "/api/v1/tasks/{task_id}",
     response_model=CancelTaskResponse,
-    responses={404: {"model": ErrorResponse}},
+    responses={400: {"model": ErrorResponse}, 404: {"model": ErrorResponse}},
     summary="Cancel task",
     description="Cancel a pending or running download task",
 )
-def cancel_task(
+async def cancel_task(
     task_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Cancel a task."""
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if task.status in [TaskStatus.COMPLETED.value, TaskStatus.FAILED.value]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Cannot cancel task with status: {task.status}"
-        )
+    # Compare-and-set on the status just read: a completion or failure the worker
+    # commits meanwhile is kept, and the counters move the status actually replaced.
+    # The worker's own transitions skip cancelled tasks in the same way.
+    while True:
+        previous_status = await db.scalar(select(Task.status).where(Task.id == task_id))
+        if previous_status is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        if previous_status in FINISHED_STATUSES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot cancel task with status: {previous_status}"
+            )
+        cancelled = (await db.execute(
+            update(Task)
+            .where(Task.id == task_id, Task.status == previous_status)
+            .values(status=TaskStatus.CANCELLED.value, state_version=func.coalesce(Task.state_version, 0) + 1)
+            .execution_options(synchronize_session=False)
+        )).rowcount
+        if cancelled:
+            break
+    await db.commit()
+    await record_transition_async(previous_status, TaskStatus.CANCELLED.value)
+
+    # Running downloads and uploads watch this flag and stop within a second
+    try:
+        await request_cancel(task_id)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to flag task {task_id} as cancelled: {e}")
 
-    # Cancel Celery task if running
+    # Keep a queued Celery task from starting; the flag stops a running one
     if task.celery_task_id:
         from app.celery_app import celery_app
-        celery_app.control.revoke(task.celery_task_id, terminate=True)
+        await run_blocking(celery_app.control.revoke, task.celery_task_id)
 
-    task.status = TaskStatus.CANCELLED.value
-    db.commit()
+    # Re-read after the commit: the version is computed in SQL
+    version = await db.scalar(select(Task.state_version).where(Task.id == task_id))
+    await invalidate_task_state(task_id, version or 0)
 
     logger.info(f"Cancelled task {task_id}")
 
@@ -230,23 +508,127 @@ def cancel_task(
     )
 
 
+@app.api_route(
+    "/api/v1/tasks/{task_id}/file",
+    methods=["GET", "HEAD"],
+    responses={
+        200: {"content": {"application/octet-stream": {}}},
+        206: {"description": "Partial content (Range request)"},
+        304: {"description": "Not modified"},
+        403: {"model": ErrorResponse},
+        404: {"model": ErrorResponse},
+    },
+    summary="Download task file",
+    description=(
+        "Serve a locally stored result with Range and conditional GET support. "
+        "Requires the signed link from result.signed_url; disabled without FILE_URL_SECRET "
+        "unless FILE_URL_UNSIGNED is set"
+    ),
+)
+async def get_task_file(
+    task_id: str,
+    request: Request,
+    expires: Optional[int] = Query(None),
+    signature: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Stream a task's local file."""
+    if not verify(task_id, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+
+    task = await db.get(Task, task_id)
+    if task is None:
+        # Archived tasks keep their signed links (the file itself may be gone)
+        archived = await _archived_tasks({task_id}, db)
+        task = archived[0] if archived else None
+    if not task or task.status != TaskStatus.COMPLETED.value:
+        raise HTTPException(status_code=404, detail="Task not found or not completed")
+
+    path = local_file(task.download_url)
+    try:
+        stat_result = await run_blocking(os.stat, path) if path else None
+    except FileNotFoundError:
+        stat_result = None
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="File is not stored locally")
+
+    # FileResponse handles Range / If-Range and streams in chunks (no full read)
+    response = FileResponse(
+        path,
+        stat_result=stat_result,
+        filename=task.file_name or path.name,
+        content_disposition_type="inline",
+    )
+    if _not_modified(request, response):
+        return Response(
+            status_code=304,
+            headers={name: response.headers[name] for name in ("etag", "last-modified")},
+        )
+    return response
+
+
+def _not_modified(request: Request, response: Response) -> bool:
+    """Conditional GET: If-None-Match takes precedence over If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = response.headers["etag"]
+        return any(tag.strip() in (etag, f"W/{etag}", "*") for tag in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            modified = parsedate_to_datetime(response.headers["last-modified"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return modified <= since
+    return False
+
+
+@app.post(
+    "/api/v1/tasks/{task_id}/profile",
+    response_model=ProfileTaskResponse,
+    responses={404: {"model": ErrorResponse}, 503: {"model": ErrorResponse}},
+    summary="Profile task",
+    description="Profile the next run of a task (e.g. a pending task or a retry) regardless of the sample rate",
+)
+async def profile_task(
+    task_id: str,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Flag a task for profiling."""
+    task = await db.get(Task, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    try:
+        await flag_task(task_id)
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Redis unavailable: {e}")
+
+    return ProfileTaskResponse(
+        task_id=task_id,
+        message=f"Task will be profiled on its next run; profiles are saved to {settings.profile_dir}",
+    )
+
+
 @app.post(
     "/api/v1/video-info",
     response_model=VideoInfoResponse,
-    responses={400: {"model": ErrorResponse}},
+    responses={400: {"model": ErrorResponse}, 504: {"model": ErrorResponse}},
     summary="Get video info",
     description="Extract video information without downloading",
 )
-def get_video_info_endpoint(request: VideoInfoRequest):
-    """Get video info without downloading."""
+async def get_video_info_endpoint(request: VideoInfoRequest):
+    """Get video info without downloading (extracted by the video_info workers)."""
     try:
-        info = get_video_info(request.video_url)
+        info = await video_info_client.get_info(request.video_url)
         return VideoInfoResponse(
-            title=info.title,
-            duration=info.duration,
-            thumbnail=info.thumbnail,
-            uploader=info.uploader,
-            upload_date=info.upload_date,
+            title=info["title"],
+            duration=info["duration"],
+            thumbnail=info["thumbnail"],
+            uploader=info["uploader"],
+            upload_date=info["upload_date"],
             formats=[
                 VideoFormat(
                     format_id=f.get("format_id"),
@@ -254,9 +636,11 @@ def get_video_info_endpoint(request: VideoInfoRequest):
                     resolution=f.get("resolution"),
                     filesize=f.get("filesize"),
                 )
-                for f in (info.formats or [])
+                for f in (info["formats"] or [])
             ],
         )
+    except VideoInfoTimeout as e:
+        raise HTTPException(status_code=504, detail=f"TIMEOUT: {e}")
     except DownloadError as e:
         raise HTTPException(status_code=400, detail=f"{e.code}: {e.message}")
     except Exception as e:
@@ -270,7 +654,7 @@ def get_video_info_endpoint(request: VideoInfoRequest):
     summary="Health check",
     description="Check service health and status",
 )
-def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     """Health check endpoint."""
     # Get yt-dlp version
     try:
@@ -279,75 +663,134 @@ def health_check(db: Session = Depends(get_db)):
     except Exception:
         yt_dlp_version = None
 
-    # Count active downloads
-    active_count = (
-        db.query(Task)
-        .filter(Task.status == TaskStatus.DOWNLOADING.value)
-        .count()
-    )
-
-    # Count pending tasks (queue size approximation)
-    pending_count = (
-        db.query(Task)
-        .filter(Task.status == TaskStatus.PENDING.value)
-        .count()
-    )
+    # Counters are maintained on every status transition (O(1) lookup);
+    # fall back to counting rows if Redis is unreachable.
+    status = "healthy"
+    try:
+        counts = await get_status_counts_async()
+        active_count = counts.get(TaskStatus.DOWNLOADING.value, 0)
+        pending_count = counts.get(TaskStatus.PENDING.value, 0)
+        queue_size = await get_queue_depth_async()
+    except redis.RedisError as e:
+        logger.warning(f"Redis unavailable for health check: {e}")
+        status = "degraded"
+        active_count = await db.scalar(
+            select(func.count(Task.id))
+            .where(Task.status == TaskStatus.DOWNLOADING.value)
+        )
+        pending_count = await db.scalar(
+            select(func.count(Task.id))
+            .where(Task.status == TaskStatus.PENDING.value)
+        )
+        queue_size = pending_count
 
     return HealthResponse(
-        status="healthy",
+        status=status,
         version=settings.app_version,
         yt_dlp_version=yt_dlp_version,
-        queue_size=pending_count,
+        queue_size=queue_size,
+        pending_tasks=pending_count,
         active_downloads=active_count,
     )
 
 
+@app.get(
+    "/api/v1/callbacks/stats",
+    response_model=CallbackStatsResponse,
+    responses={503: {"model": ErrorResponse}},
+    summary="Callback stats",
+    description="Callback delivery backlog and latency",
+)
+async def callback_stats(db: AsyncSession = Depends(get_async_db)):
+    """Callback relay stats."""
+    try:
+        return CallbackStatsResponse(**await get_callback_stats(db))
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Redis unavailable: {e}")
+
+
+@app.get(
+    "/api/v1/stats/timings",
+    response_model=TimingStatsResponse,
+    summary="Task timing stats",
+    description="Per-stage duration percentiles per extractor, over tasks completed in a time window",
+)
+async def timing_stats(
+    window_hours: float = Query(24, gt=0, le=24 * 30, description="Completion window, hours"),
+    extractor: Optional[str] = Query(None, description="Only this extractor, e.g. Youtube"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Task timing percentiles."""
+    since = datetime.utcnow() - timedelta(hours=window_hours)
+    extractors, truncated = await get_timing_stats(db, since, extractor)
+    return TimingStatsResponse(
+        since=since,
+        window_hours=window_hours,
+        extractors=extractors,
+        truncated=truncated,
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics of the API process."""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+
+    try:
+        for queue in ("celery", settings.video_info_queue, settings.maintenance_queue):
+            QUEUE_DEPTH.labels(queue).set(await get_queue_depth_async(queue))
+        for status, count in (await get_status_counts_async()).items():
+            TASKS_BY_STATUS.labels(status).set(count)
+    except redis.RedisError as e:
+        # Still serve the process metrics; the gauges keep their last value
+        logger.warning(f"Failed to refresh queue metrics: {e}")
+
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 # ============ Helper Functions ============
 
-def _task_to_response(task: Task) -> TaskResponse:
-    """Convert Task model to TaskResponse."""
-    video_info = None
-    if task.video_title:
-        video_info = VideoInfo(
-            title=task.video_title,
-            duration=task.video_duration,
-            thumbnail=task.video_thumbnail,
-            filesize=task.video_filesize,
-        )
+# status -> (expires_at, count); see _count_tasks
+_count_cache: Dict[Optional[str], Tuple[float, int]] = {}
 
-    result = None
-    if task.status == TaskStatus.COMPLETED.value:
-        result = TaskResult(
-            download_url=task.download_url,
-            file_name=task.file_name,
-            file_size=task.file_size,
-        )
 
-    error = None
-    if task.status == TaskStatus.FAILED.value:
-        error = TaskError(
-            code=task.error_code,
-            message=task.error_message,
-        )
+async def _count_tasks(db: AsyncSession, status: Optional[str]) -> int:
+    """Count tasks, caching the result for ``task_count_cache_ttl`` seconds."""
+    now = time.monotonic()
+    cached = _count_cache.get(status)
+    if cached and cached[0] > now:
+        return cached[1]
 
-    return TaskResponse(
-        task_id=task.id,
-        video_url=task.video_url,
-        status=task.status,
-        progress=task.progress or 0,
-        video_info=video_info,
-        result=result,
-        error=error,
-        created_at=task.created_at,
-        updated_at=task.updated_at,
-        completed_at=task.completed_at,
-    )
+    query = select(func.count(Task.id))
+    if status:
+        query = query.where(Task.status == status)
+    count = await db.scalar(query) or 0
+
+    _count_cache[status] = (now + settings.task_count_cache_ttl, count)
+    return count
+
+
+def _encode_cursor(task: Task) -> str:
+    """Encode the keyset position of a task as an opaque cursor."""
+    raw = f"{task.created_at.isoformat()}|{task.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by _encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, task_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), task_id
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
 
 
 # ============ Root Route ============
 
 @app.get("/", include_in_schema=False)
-def root():
+async def root():
     """Serve frontend debug page."""
     index_path = STATIC_DIR / "index.html"
     if index_path.exists():
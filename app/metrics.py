@@ -0,0 +1,159 @@
+"""
+Prometheus metrics.
+
+The API serves them on ``GET /metrics``; Celery workers and the callback
+relay each start a small exporter thread on their own port
+(``worker_metrics_port`` / ``callback_metrics_port``).
+
+All metrics live in the default registry and are updated in-process, so
+recording a sample is a lock and an add - cheap enough for the hot paths.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Download pipeline (workers)
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+STAGE_DURATION = Histogram(
+    "vds_stage_duration_seconds",
+    "Time spent in each task stage (extract, download, postprocess, upload)",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+AUDIO_EXTRACT_DURATION = Histogram(
+    "vds_audio_extract_seconds",
+    "Time ffmpeg spent extracting audio, by mode (copy: stream copied, transcode: re-encoded)",
+    ["mode"],
+    buckets=STAGE_BUCKETS,
+)
+DOWNLOADED_BYTES = Counter(
+    "vds_downloaded_bytes",
+    "Bytes fetched from video sources",
+    ["extractor", "storage_type"],
+)
+UPLOADED_BYTES = Counter(
+    "vds_uploaded_bytes",
+    "Bytes uploaded to storage backends",
+    ["extractor", "storage_type"],
+)
+DOWNLOAD_ERRORS = Counter(
+    "vds_download_errors",
+    "Failed downloads by DownloadError code",
+    ["code"],
+)
+STORAGE_ERRORS = Counter(
+    "vds_storage_errors",
+    "Failed uploads by StorageError code",
+    ["code"],
+)
+YTDLP_CACHE_LOOKUPS = Counter(
+    "vds_ytdlp_cache_lookups",
+    "yt-dlp cache reads by section (youtube-nsig, youtube-sigfuncs, ...) and result (hit, miss)",
+    ["section", "result"],
+)
+ACTIVE_TASKS = Gauge(
+    "vds_worker_active_tasks",
+    "Tasks currently executing in this worker (greenlets under the gevent pool)",
+    ["task"],
+)
+CONCURRENCY_LIMIT = Gauge(
+    "vds_worker_concurrency_limit",
+    "Task slots allowed by the adaptive autoscaler (see app.autoscale)",
+)
+
+# Callback relay
+CALLBACK_REQUEST_DURATION = Histogram(
+    "vds_callback_request_duration_seconds",
+    "Duration of callback HTTP requests",
+    ["outcome"],
+)
+CALLBACK_DELIVERY_LATENCY = Histogram(
+    "vds_callback_delivery_latency_seconds",
+    "Time from queueing a callback to its successful delivery",
+    buckets=STAGE_BUCKETS,
+)
+CALLBACK_EVENTS = Counter(
+    "vds_callback_events",
+    "Callback events by delivery result (delivered, retried, failed)",
+    ["result"],
+)
+
+# API (queue and status gauges are refreshed from Redis on each scrape)
+QUEUE_DEPTH = Gauge(
+    "vds_queue_depth",
+    "Messages waiting in the broker queue",
+    ["queue"],
+)
+TASKS_BY_STATUS = Gauge(
+    "vds_tasks",
+    "Tasks by status",
+    ["status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "vds_http_request_duration_seconds",
+    "API request duration by route template",
+    ["method", "route", "status"],
+)
+
+
+def start_exporter(port: int) -> None:
+    """
+    Serve the default registry on ``port`` from a daemon thread.
+
+    Args:
+        port: TCP port; 0 disables the exporter
+    """
+    if not settings.metrics_enabled or not port:
+        return
+    try:
+        start_http_server(port)
+        logger.info(f"Metrics exporter listening on :{port}")
+    except OSError as e:
+        # Typically another worker on the same host already owns the port
+        logger.warning(f"Metrics exporter not started on :{port}: {e}")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request durations.
+
+    Requests are labelled with the route template (``/api/v1/tasks/{task_id}``)
+    rather than the raw path, which keeps label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"],
+                route.path if route is not None else "<unmatched>",
+                str(status),
+            ).observe(time.perf_counter() - started)
@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import Column, String, Integer, Float, Text, DateTime, JSON
+from sqlalchemy import Column, String, Integer, Float, Text, DateTime, JSON, Index, event, func
 from app.database import Base
 
 
@@ -14,8 +14,21 @@ class TaskStatus(str, Enum):
     CANCELLED = "cancelled"
 
 
+# Statuses a task ends in (a Celery retry may still restart a failed one)
+FINISHED_STATUSES = (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value)
+
+
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        # Listing: filter by status, newest first, keyset on (created_at, id)
+        Index("ix_tasks_status_created_at", "status", "created_at", "id"),
+        Index("ix_tasks_created_at", "created_at", "id"),
+        # Timing stats over a completion window
+        Index("ix_tasks_completed_at", "completed_at"),
+        # One task per idempotency key (NULLs are not compared)
+        Index("ux_tasks_idempotency_key", "idempotency_key", unique=True),
+    )
 
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
 
@@ -23,6 +36,7 @@ class Task(Base):
     video_url = Column(String(2048), nullable=False)
     callback_url = Column(String(2048), nullable=True)
     options = Column(JSON, nullable=True)  # format, extract_audio, etc.
+    idempotency_key = Column(String(255), nullable=True)  # client key for safe retries of task creation
 
     # Status
     status = Column(String(20), default=TaskStatus.PENDING.value, nullable=False)
@@ -41,10 +55,31 @@ class Task(Base):
     file_name = Column(String(500), nullable=True)
     file_size = Column(Integer, nullable=True)  # bytes
     local_path = Column(String(1024), nullable=True)  # temp local path
+    # Object storage location, for pre-signed URLs (storage_url without credentials)
+    storage_type = Column(String(20), nullable=True)
+    storage_url = Column(String(2048), nullable=True)
+    storage_key = Column(String(1024), nullable=True)
 
     # Celery task tracking
     celery_task_id = Column(String(50), nullable=True)
 
+    # Stage timings in seconds (populated as the task progresses)
+    extractor = Column(String(100), nullable=True)  # yt-dlp extractor key
+    queued_seconds = Column(Float, nullable=True)  # created -> picked up by a worker
+    extract_seconds = Column(Float, nullable=True)
+    download_seconds = Column(Float, nullable=True)
+    postprocess_seconds = Column(Float, nullable=True)
+    upload_seconds = Column(Float, nullable=True)
+    callback_seconds = Column(Float, nullable=True)  # completed -> callback delivered
+    downloaded_bytes = Column(Integer, nullable=True)
+    throughput_bps = Column(Float, nullable=True)  # average download bytes/sec
+
+    # Formats chosen by the format planner (see app.format_planner)
+    format_plan = Column(JSON, nullable=True)
+
+    # Incremented by every UPDATE; the ETag of the cached task state (app.task_state)
+    state_version = Column(Integer, default=0, nullable=True)
+
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -88,3 +123,66 @@ class Task(Base):
             }
 
         return result
+
+
+@event.listens_for(Task, "before_update")
+def _bump_state_version(mapper, connection, target: Task) -> None:
+    # Incremented in SQL, so concurrent writers (worker, API) never reuse a version
+    target.state_version = func.coalesce(Task.state_version, 0) + 1
+
+
+class CallbackStatus(str, Enum):
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+
+
+class CallbackOutbox(Base):
+    """
+    Callback notifications waiting for delivery.
+
+    Rows are written in the same transaction as the task status change
+    they announce, and drained by the callback relay (at-least-once).
+    """
+    __tablename__ = "callback_outbox"
+    __table_args__ = (
+        # Relay polling: pending rows that are due
+        Index("ix_callback_outbox_status_due", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # "<task_id>:<status>", so a retried task can't queue the same event twice
+    event_key = Column(String(100), unique=True, nullable=False)
+    task_id = Column(String(36), nullable=False, index=True)
+    callback_url = Column(String(2048), nullable=False)
+    payload = Column(JSON, nullable=False)
+
+    # Delivery state
+    status = Column(String(20), default=CallbackStatus.PENDING.value, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(Text, nullable=True)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    delivered_at = Column(DateTime, nullable=True)
+
+
+class ArchivedTask(Base):
+    """
+    Where an archived task's record lives (see app.task_archive).
+
+    Finished tasks past the retention window are moved out of ``tasks``
+    into compressed segment files; a row here points at the block of the
+    segment holding the task.
+    """
+    __tablename__ = "task_archive_index"
+
+    task_id = Column(String(36), primary_key=True)
+    segment = Column(String(255), nullable=False)  # file name within archive_dir
+    block_offset = Column(Integer, nullable=False)  # byte offset of the compressed block
+    block_length = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False)
+    created_at = Column(DateTime, nullable=False)  # of the task
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,69 @@
+"""
+Pre-signed download URLs for results in object storage.
+
+Results uploaded to S3, GCS or S3-compatible storage are downloaded straight
+from the bucket with a short-lived pre-signed GET URL, so buckets can stay
+private without proxying the bytes through this service. URLs are signed on
+demand and cached in Redis until ``presigned_url_refresh_margin`` seconds
+before they expire, so a client polling a task gets the same URL (and any
+CDN or browser cache keyed on it keeps working) and always has at least
+that long to use it.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+import redis
+
+from app.config import settings
+from app.executors import run_blocking
+from app.models import Task
+from app.redis_client import get_async_redis
+from app.storage import StorageError, StorageUploader
+
+logger = logging.getLogger(__name__)
+
+PRESIGNED_KEY = "vds:presigned:{task_id}"
+
+
+async def presigned_url(task: Task) -> Optional[str]:
+    """
+    Pre-signed GET URL of a task's uploaded file.
+
+    Returns:
+        URL, or None when the result is not in object storage or cannot be signed
+    """
+    if not task.storage_key:
+        return None
+
+    key = PRESIGNED_KEY.format(task_id=task.id)
+    redis_client = get_async_redis()
+    try:
+        cached = await redis_client.get(key)
+        if cached:
+            return cached
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read cached pre-signed URL of task {task.id}: {e}")
+
+    try:
+        # Creating SDK clients (and GCS signing) is too slow for the event loop
+        url = await run_blocking(
+            StorageUploader().presign,
+            task.storage_type,
+            task.storage_url,
+            task.storage_key,
+            settings.presigned_url_ttl,
+        )
+    except StorageError as e:
+        logger.warning(f"Failed to pre-sign result of task {task.id}: {e.code} - {e.message}")
+        return None
+
+    cache_ttl = settings.presigned_url_ttl - settings.presigned_url_refresh_margin
+    if cache_ttl > 0:
+        try:
+            await redis_client.set(key, url, ex=cache_ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to cache pre-signed URL of task {task.id}: {e}")
+    return url
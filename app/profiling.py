@@ -0,0 +1,325 @@
+"""
+Opt-in sampling profiler for worker tasks and API requests.
+
+A single background thread samples the stacks of the executions being
+profiled every ``profile_interval_ms`` and aggregates them into collapsed
+stacks ("frame;frame;frame count" lines), the input format of
+flamegraph.pl, speedscope and similar tools. Nothing is sampled for
+executions that were not selected, so the cost at a low sample rate is a
+random() call per task or request (plus one SISMEMBER per task for flagged
+IDs).
+
+What gets profiled:
+- a ``profile_task_sample_rate`` fraction of download tasks, and any task
+  whose ID is in the ``vds:profile:tasks`` Redis set (flag_task)
+- a ``profile_api_sample_rate`` fraction of API requests
+
+Samples are wall-clock: a task blocked on the network shows up in the
+frame it is waiting in. Under the gevent pool only the task's own greenlet
+is sampled, and in the API only the request's asyncio task.
+
+Profiles are written to ``profile_dir`` and, when ``profile_storage_type``
+is not "local", uploaded with the regular storage uploader.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Dict, List, Optional
+
+import redis
+
+from app.config import settings
+from app.executors import run_blocking
+from app.redis_client import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FLAGS_KEY = "vds:profile:tasks"  # set of task IDs to profile on their next run
+PROFILE_FLAGS_TTL = 86400  # seconds; the whole set expires a day after the last flag
+MAX_DEPTH = 128  # frames kept per sample, innermost first
+
+
+def _original(module: str, name: str):
+    """Unpatched threading primitive, so the sampler stays a real OS thread under gevent."""
+    try:
+        from gevent import monkey
+        return monkey.get_original(module, name)
+    except ImportError:
+        return getattr(__import__(module), name)
+
+
+_labels: Dict[CodeType, str] = {}
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    label = _labels.get(code)
+    if label is None:
+        # Keep the package and module name, e.g. "app/downloader.py"
+        directory, module = os.path.split(code.co_filename)
+        if directory:
+            module = f"{os.path.basename(directory)}/{module}"
+        label = _labels[code] = f"{code.co_name} ({module}:{code.co_firstlineno})"
+    return label
+
+
+def _walk(frame: Optional[FrameType], stop: Optional[FrameType] = None) -> List[str]:
+    """Labels from ``frame`` outwards (innermost first), up to and including ``stop``."""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        if frame is stop:
+            break
+        frame = frame.f_back
+    return labels
+
+
+# ============ Sampling targets ============
+
+class _ThreadTarget:
+    """An OS thread (threads / prefork pools)."""
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+
+    def stack(self) -> List[str]:
+        return _walk(sys._current_frames().get(self.thread_id))
+
+
+class _GreenletTarget:
+    """A greenlet (gevent pool): its saved frame while switched out."""
+
+    def __init__(self, glet, thread_id: int):
+        self.glet = glet
+        self.thread_id = thread_id
+
+    def stack(self) -> List[str]:
+        frame = self.glet.gr_frame
+        if frame is None:
+            # Running right now: it owns the thread's current frame
+            frame = sys._current_frames().get(self.thread_id)
+        return _walk(frame)
+
+
+class _AsyncTaskTarget:
+    """An asyncio task (API request): its coroutine chain."""
+
+    def __init__(self, task: asyncio.Task, thread_id: int):
+        self.coro = task.get_coro()
+        self.thread_id = thread_id
+
+    def stack(self) -> List[str]:
+        if self.coro.cr_running:
+            # Running right now: cut the thread's stack at the task's coroutine
+            return _walk(sys._current_frames().get(self.thread_id), stop=self.coro.cr_frame)
+
+        # Suspended: follow what each coroutine awaits, outermost first
+        outer_first = []
+        awaitable = self.coro
+        while awaitable is not None and len(outer_first) < MAX_DEPTH:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            outer_first.append(_frame_label(frame))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return outer_first[::-1]
+
+
+def _current_target():
+    """Target for the calling execution context."""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            from greenlet import getcurrent
+            return _GreenletTarget(getcurrent(), _original("_thread", "get_ident")())
+    except ImportError:
+        pass
+
+    thread_id = threading.get_ident()
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return _AsyncTaskTarget(task, thread_id)
+    return _ThreadTarget(thread_id)
+
+
+# ============ Profiles ============
+
+class Profile:
+    """Samples collected for one task or request."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.samples: Counter = Counter()
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self._target = _current_target()
+
+    def sample(self) -> None:
+        stack = self._target.stack()
+        if stack:
+            self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class _Sampler:
+    """Process-wide sampler thread, running only while profiles are active."""
+
+    def __init__(self):
+        self._profiles: set = set()
+        self._running = False
+        self._lock = _original("_thread", "allocate_lock")()
+        self._sleep = _original("time", "sleep")
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.add(profile)
+            if not self._running:
+                self._running = True
+                _original("_thread", "start_new_thread")(self._run, ())
+
+    def remove(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self) -> None:
+        interval = settings.profile_interval_ms / 1000
+        while True:
+            with self._lock:
+                profiles = tuple(self._profiles)
+                if not profiles:
+                    # Exit when idle; add() starts a new thread
+                    self._running = False
+                    return
+            for profile in profiles:
+                try:
+                    profile.sample()
+                except Exception:
+                    # A frame can vanish under us; skip the sample
+                    pass
+            self._sleep(interval)
+
+
+_sampler = _Sampler()
+
+
+def start_profile(name: str) -> Profile:
+    """Start sampling the calling thread, greenlet or asyncio task."""
+    profile = Profile(name)
+    _sampler.add(profile)
+    return profile
+
+
+def stop_profile(profile: Profile) -> Optional[str]:
+    """
+    Stop sampling and save the profile.
+
+    Returns:
+        Where the profile was saved (path or storage URL), or None if it
+        has no samples or could not be saved
+    """
+    _sampler.remove(profile)
+    profile.duration = time.monotonic() - profile.started
+    if not profile.samples:
+        return None
+
+    try:
+        return _save(profile)
+    except Exception as e:
+        logger.warning(f"Failed to save profile {profile.name}: {e}")
+        return None
+
+
+def _save(profile: Profile) -> str:
+    from app.storage import upload_to_storage
+
+    directory = Path(settings.profile_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    path = directory / f"{profile.name}-{timestamp}.collapsed"
+    path.write_text(profile.collapsed())
+
+    location = str(path)
+    if settings.profile_storage_type != "local":
+        location = upload_to_storage(
+            local_path=path,
+            storage_type=settings.profile_storage_type,
+            storage_url=settings.profile_storage_url,
+            delete_local=True,
+        )
+    logger.info(
+        f"Saved profile {profile.name} ({sum(profile.samples.values())} samples, "
+        f"{profile.duration:.1f}s) to {location}"
+    )
+    return location
+
+
+# ============ Selection ============
+
+def should_profile_task(task_id: str) -> bool:
+    """
+    Whether a download task should be profiled (sampled or flagged).
+
+    A flag is consumed by the run that sees it: SREM succeeds for exactly
+    one worker, so duplicate deliveries and later retries are not profiled
+    again because of it.
+    """
+    try:
+        flagged = get_redis().srem(PROFILE_FLAGS_KEY, task_id) == 1
+    except redis.RedisError as e:
+        logger.warning(f"Failed to check profile flags: {e}")
+        flagged = False
+    return flagged or random.random() < settings.profile_task_sample_rate
+
+
+async def flag_task(task_id: str) -> None:
+    """Profile the next run of a task regardless of the sample rate."""
+    pipe = get_async_redis().pipeline(transaction=False)
+    pipe.sadd(PROFILE_FLAGS_KEY, task_id)
+    pipe.expire(PROFILE_FLAGS_KEY, PROFILE_FLAGS_TTL)
+    await pipe.execute()
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware profiling a sample of API requests.
+
+    Installed only when ``profile_api_sample_rate`` > 0; unsampled requests
+    cost one random() call. The profile is saved after the response has
+    been sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= settings.profile_api_sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        profile = start_profile("api")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Name by route template, e.g. api-GET-api_v1_tasks_task_id-1a2b3c4d
+            route = scope.get("route")
+            path = route.path if route is not None else scope["path"]
+            slug = path.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+            profile.name = f"api-{scope['method']}-{slug}-{uuid.uuid4().hex[:8]}"
+            await run_blocking(stop_profile, profile)
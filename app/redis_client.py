@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from functools import lru_cache
+
+import redis
+import redis.asyncio
+
+from app.config import settings
+
+
+@lru_cache
+def get_redis() -> redis.Redis:
+    """Shared Redis client (same instance as the Celery broker)."""
+    return redis.Redis.from_url(
+        settings.redis_url,
+        decode_responses=True,
+        socket_timeout=5,
+        socket_connect_timeout=5,
+    )
+
+
+@lru_cache
+def get_async_redis() -> redis.asyncio.Redis:
+    """Shared asyncio Redis client for the API event loop."""
+    return redis.asyncio.Redis.from_url(
+        settings.redis_url,
+        decode_responses=True,
+        socket_timeout=5,
+        socket_connect_timeout=5,
+    )
+
+
+@lru_cache
+def get_async_redis_blocking() -> redis.asyncio.Redis:
+    """
+    Asyncio Redis client for blocking commands (BLPOP, pub/sub listeners).
+
+    Has no socket_timeout, which would cut those waits short; callers bound
+    them with their own timeouts. Everything else uses get_async_redis.
+    """
+    return redis.asyncio.Redis.from_url(
+        settings.redis_url,
+        decode_responses=True,
+        socket_connect_timeout=5,
+    )
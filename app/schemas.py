@@ -1,8 +1,8 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Any, Optional, List, Literal
-from pydantic import BaseModel, Field, HttpUrl
+from typing import Any, Dict, Optional, List, Literal
+from pydantic import BaseModel, Field, HttpUrl, model_validator
 from enum import Enum
 
 
@@ -51,7 +51,30 @@ class DownloadOptions(BaseModel):
     # Legacy parameters (keep for backward compatibility)
     format: Optional[str] = Field(None, description="yt-dlp format specification (overrides video_quality)")
     extract_audio: bool = Field(False, description="[Deprecated] Use download_type='audio' instead")
-    audio_format: str = Field("mp3", description="Audio format when download_type is 'audio' (mp3, aac, wav, m4a)")
+    audio_format: str = Field(
+        "mp3",
+        description=(
+            "Audio format when download_type is 'audio' (mp3, aac, m4a, opus, vorbis, flac, wav), "
+            "or 'original' to keep the source codec without re-encoding"
+        ),
+    )
+
+    # Clipping: only the selected part of the video is fetched (needs ffmpeg on the worker)
+    start_time: Optional[float] = Field(None, ge=0, description="Clip start in seconds")
+    end_time: Optional[float] = Field(None, gt=0, description="Clip end in seconds (default: end of the video)")
+    chapter: Optional[str] = Field(
+        None,
+        max_length=200,
+        description="Download only the first chapter whose title contains this text (case-insensitive)",
+    )
+
+    @model_validator(mode="after")
+    def _check_clip(self):
+        if self.chapter and (self.start_time is not None or self.end_time is not None):
+            raise ValueError("chapter cannot be combined with start_time/end_time")
+        if self.start_time is not None and self.end_time is not None and self.end_time <= self.start_time:
+            raise ValueError("end_time must be greater than start_time")
+        return self
 
 
 class CreateTaskRequest(BaseModel):
@@ -73,6 +96,13 @@ class CreateTaskRequest(BaseModel):
     # Download options
     options: Optional[DownloadOptions] = Field(None, description="Download options")
 
+    # Safe retries (the Idempotency-Key header takes precedence)
+    idempotency_key: Optional[str] = Field(
+        None,
+        max_length=255,
+        description="Client key; resubmitting it returns the original task instead of creating a new one",
+    )
+
     class Config:
         json_schema_extra = {
             "example": {
@@ -93,6 +123,19 @@ class VideoInfoRequest(BaseModel):
     video_url: str = Field(..., description="URL of the video")
 
 
+class TaskStatusRequest(BaseModel):
+    """Request for the states of many tasks at once."""
+    task_ids: List[str] = Field(..., min_length=1, max_length=1000, description="Task IDs (at most 1000)")
+    since_versions: Optional[Dict[str, int]] = Field(
+        None,
+        description="Last version seen per task ID; tasks still at (or below) it are left out",
+    )
+    updated_since: Optional[datetime] = Field(
+        None,
+        description="Only return tasks updated after this time (UTC)",
+    )
+
+
 # ============ Response Schemas ============
 
 class VideoInfo(BaseModel):
@@ -128,6 +171,13 @@ class TaskResult(BaseModel):
     download_url: Optional[str] = None
     file_name: Optional[str] = None
     file_size: Optional[int] = None
+    signed_url: Optional[str] = Field(
+        None,
+        description=(
+            "Time-limited download link: a pre-signed object storage URL, or an HTTP link "
+            "to a locally stored file. Pre-signed URLs are only included by GET /api/v1/tasks/{task_id}"
+        ),
+    )
 
 
 class TaskError(BaseModel):
@@ -136,6 +186,31 @@ class TaskError(BaseModel):
     message: Optional[str] = None
 
 
+class TaskTimings(BaseModel):
+    """Per-stage durations of a task, in seconds."""
+    extractor: Optional[str] = None
+    queued: Optional[float] = Field(None, description="Time waiting for a worker")
+    extract: Optional[float] = None
+    download: Optional[float] = None
+    postprocess: Optional[float] = None
+    upload: Optional[float] = None
+    callback: Optional[float] = Field(None, description="Completion to callback delivery")
+    downloaded_bytes: Optional[int] = None
+    throughput_bps: Optional[float] = Field(None, description="Average download speed, bytes/sec")
+
+
+class FormatPlan(BaseModel):
+    """Formats chosen for a task by the format planner."""
+    format_ids: List[str]
+    estimated_size: Optional[int] = Field(None, description="Estimated bytes to download")
+    merge: bool = Field(False, description="Separate video and audio streams merged by ffmpeg")
+    remux: bool = Field(False, description="Output needs a container change")
+    ext: Optional[str] = None
+    height: Optional[int] = None
+    audio_mode: Optional[str] = Field(None, description="Audio downloads: copy (no re-encode) or transcode")
+    reasons: List[str] = []
+
+
 class TaskResponse(BaseModel):
     """Response for a single task."""
     task_id: str
@@ -145,6 +220,9 @@ class TaskResponse(BaseModel):
     video_info: Optional[VideoInfo] = None
     result: Optional[TaskResult] = None
     error: Optional[TaskError] = None
+    timings: Optional[TaskTimings] = None
+    format_plan: Optional[FormatPlan] = None
+    version: int = Field(0, description="State version, incremented on every change (see since_version)")
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
@@ -163,10 +241,17 @@ class CreateTaskResponse(BaseModel):
 
 class TaskListResponse(BaseModel):
     """Response for task list."""
-    total: int
+    total: int = Field(..., description="Approximate total (cached for a few seconds)")
     page: int
     page_size: int
     tasks: List[TaskResponse]
+    next_cursor: Optional[str] = Field(None, description="Cursor for the next page, null on the last page")
+
+
+class TaskStatusResponse(BaseModel):
+    """Response for a bulk status lookup."""
+    tasks: List[TaskResponse] = Field(..., description="Requested tasks that passed the filters")
+    not_found: List[str] = []
 
 
 class CancelTaskResponse(BaseModel):
@@ -176,15 +261,64 @@ class CancelTaskResponse(BaseModel):
     message: str
 
 
+class ProfileTaskResponse(BaseModel):
+    """Response for flagging a task for profiling."""
+    task_id: str
+    message: str
+
+
 class HealthResponse(BaseModel):
     """Health check response."""
     status: str
     version: str
     yt_dlp_version: Optional[str] = None
-    queue_size: int = 0
+    queue_size: int = 0  # messages waiting in the broker queue
+    pending_tasks: int = 0
     active_downloads: int = 0
 
 
+class CallbackStatsResponse(BaseModel):
+    """Callback outbox backlog and relay delivery stats."""
+    backlog_pending: int = 0
+    dead_letters: int = 0
+    delivered: int = 0
+    failed: int = 0
+    retried: int = 0
+    requests: int = 0  # HTTP requests sent (a batch counts once)
+    in_flight: int = 0
+    latency_p50_ms: float = 0  # outbox insert -> delivered, recent deliveries
+    latency_p99_ms: float = 0
+    stats_updated_at: Optional[datetime] = None
+
+
+class StagePercentiles(BaseModel):
+    """Percentiles of one stage over the tasks of a window."""
+    count: int
+    p50: float
+    p90: float
+    p99: float
+
+
+class ExtractorTimingStats(BaseModel):
+    """Timing percentiles of one extractor."""
+    extractor: str
+    tasks: int
+    stages: Dict[str, StagePercentiles] = Field(
+        ..., description="queued, extract, download, postprocess, upload, callback (seconds)"
+    )
+    throughput_bps: Optional[StagePercentiles] = None
+
+
+class TimingStatsResponse(BaseModel):
+    """Response for task timing stats."""
+    since: datetime
+    window_hours: float
+    extractors: List[ExtractorTimingStats]
+    truncated: bool = Field(
+        False, description="The window held more completed tasks than are read; only the most recent are included"
+    )
+
+
 class ErrorResponse(BaseModel):
     """Error response."""
     error: str
@@ -0,0 +1,148 @@
+"""
+Per-status task counters kept in Redis.
+
+Every status transition adjusts a Redis hash atomically, so the health
+endpoint can report queue statistics without scanning the tasks table.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Dict, List, Optional
+
+import redis
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.celery_app import celery_app
+from app.models import Task
+from app.redis_client import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+STATUS_COUNTS_KEY = "vds:task_status_counts"
+
+# Kombu's Redis transport stores each priority level in its own list
+_PRIORITY_STEPS = (0, 3, 6, 9)
+_PRIORITY_SEP = "\x06\x16"
+
+
+def _queue_keys(queue: Optional[str]) -> List[str]:
+    """Broker list keys holding the messages of a queue."""
+    queue = queue or celery_app.conf.task_default_queue
+    return [f"{queue}{_PRIORITY_SEP}{step}" if step else queue for step in _PRIORITY_STEPS]
+
+
+def _queue_transition(pipe, old_status: Optional[str], new_status: Optional[str]) -> None:
+    """Add the counter updates for a transition to a pipeline."""
+    if old_status:
+        pipe.hincrby(STATUS_COUNTS_KEY, old_status, -1)
+    if new_status:
+        pipe.hincrby(STATUS_COUNTS_KEY, new_status, 1)
+
+
+def record_transition(old_status: Optional[str], new_status: Optional[str]) -> None:
+    """
+    Move one task from ``old_status`` to ``new_status`` in the counters.
+
+    Pass ``old_status=None`` for a newly created task. ``old_status`` must
+    be the status the committed change replaced (from a compare-and-set
+    UPDATE), not an earlier read. Redis failures are logged and ignored;
+    the drift they leave is repaired by the periodic forced reseed
+    (reseed_status_counts_task).
+    """
+    if old_status == new_status:
+        return
+
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        _queue_transition(pipe, old_status, new_status)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to update status counters ({old_status} -> {new_status}): {e}")
+
+
+async def record_transition_async(old_status: Optional[str], new_status: Optional[str]) -> None:
+    """Async version of record_transition for the API event loop."""
+    if old_status == new_status:
+        return
+
+    try:
+        pipe = get_async_redis().pipeline(transaction=True)
+        _queue_transition(pipe, old_status, new_status)
+        await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to update status counters ({old_status} -> {new_status}): {e}")
+
+
+def record_removed(counts: Dict[str, int]) -> None:
+    """Take tasks deleted from the table (e.g. archived) out of the counters, per status."""
+    if not counts:
+        return
+
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        for status, count in counts.items():
+            pipe.hincrby(STATUS_COUNTS_KEY, status, -count)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to update status counters for {sum(counts.values())} removed tasks: {e}")
+
+
+def get_status_counts() -> Dict[str, int]:
+    """
+    Get task counts per status.
+
+    Raises:
+        redis.RedisError: If Redis is unavailable
+    """
+    counts = get_redis().hgetall(STATUS_COUNTS_KEY)
+    return {status: max(int(count), 0) for status, count in counts.items()}
+
+
+async def get_status_counts_async() -> Dict[str, int]:
+    """Async version of get_status_counts."""
+    counts = await get_async_redis().hgetall(STATUS_COUNTS_KEY)
+    return {status: max(int(count), 0) for status, count in counts.items()}
+
+
+def seed_status_counts(db: Session, force: bool = False) -> None:
+    """
+    Initialize the counters from the database.
+
+    Runs a single GROUP BY; without ``force`` it does nothing if the
+    counters already exist.
+    """
+    client = get_redis()
+    if not force and client.exists(STATUS_COUNTS_KEY):
+        return
+
+    rows = db.query(Task.status, func.count(Task.id)).group_by(Task.status).all()
+
+    pipe = client.pipeline(transaction=True)
+    pipe.delete(STATUS_COUNTS_KEY)
+    if rows:
+        pipe.hset(STATUS_COUNTS_KEY, mapping={status: count for status, count in rows})
+    pipe.execute()
+    logger.info(f"Seeded status counters: {dict(rows)}")
+
+
+def get_queue_depth(queue: Optional[str] = None) -> int:
+    """
+    Get the number of messages waiting in the broker queue.
+
+    Raises:
+        redis.RedisError: If Redis is unavailable
+    """
+    pipe = get_redis().pipeline(transaction=False)
+    for key in _queue_keys(queue):
+        pipe.llen(key)
+    return sum(pipe.execute())
+
+
+async def get_queue_depth_async(queue: Optional[str] = None) -> int:
+    """Async version of get_queue_depth."""
+    pipe = get_async_redis().pipeline(transaction=False)
+    for key in _queue_keys(queue):
+        pipe.llen(key)
+    return sum(await pipe.execute())
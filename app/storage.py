@@ -13,10 +13,15 @@ from __future__ import annotations
 import os
 import re
 import logging
+from datetime import timedelta
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Callable, Dict, Optional, Tuple
 from urllib.parse import urlparse, parse_qs
 
+from app.bandwidth import BandwidthShare
+from app.config import settings
+from app.cancellation import CancelToken, TaskCancelled
+
 logger = logging.getLogger(__name__)
 
 
@@ -28,6 +33,81 @@ class StorageError(Exception):
         super().__init__(message)
 
 
+# Bucket name -> AWS region, for signing (see StorageUploader._s3_region)
+_s3_bucket_regions: Dict[str, str] = {}
+
+# Called with the number of bytes sent for every chunk of an upload
+ProgressCallback = Callable[[int], None]
+
+
+def _progress_callback(
+    bandwidth: Optional[BandwidthShare],
+    cancel: Optional[CancelToken],
+) -> Optional[ProgressCallback]:
+    """Per-chunk upload callback pacing to the bandwidth share and aborting on cancellation."""
+    if bandwidth is None and cancel is None:
+        return None
+
+    def callback(amount: int) -> None:
+        if cancel is not None:
+            cancel.check()
+        if bandwidth is not None:
+            bandwidth.consume(amount)
+
+    return callback
+
+
+def _oss_progress_callback(progress: Optional[ProgressCallback]) -> Optional[Callable[[int, Optional[int]], None]]:
+    """Adapt oss2's cumulative progress callback to a per-chunk one."""
+    if progress is None:
+        return None
+    sent = 0
+
+    def callback(consumed_bytes: int, total_bytes: Optional[int]) -> None:
+        nonlocal sent
+        progress(consumed_bytes - sent)
+        sent = consumed_bytes
+
+    return callback
+
+
+def _object_key(prefix: str, file_name: str) -> str:
+    """Object key (blob name) of an uploaded file."""
+    key = f"{prefix}/{file_name}" if prefix else file_name
+    return key.lstrip("/")
+
+
+def strip_credentials(storage_url: Optional[str]) -> Optional[str]:
+    """
+    storage_url without the ``ACCESS_KEY:SECRET@`` part, safe to store.
+
+    Pre-signing a result found by such a URL uses the server's own
+    credentials (environment variables) instead.
+    """
+    if not storage_url:
+        return storage_url
+    parsed = urlparse(storage_url)
+    if "@" not in parsed.netloc:
+        return storage_url
+    return parsed._replace(netloc=parsed.netloc.rpartition("@")[2]).geturl()
+
+
+class _ProgressReader:
+    """File wrapper reporting every read() to a progress callback."""
+
+    def __init__(self, fileobj, progress: ProgressCallback):
+        self._fileobj = fileobj
+        self._progress = progress
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fileobj.read(size)
+        self._progress(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+
 class StorageUploader:
     """
     Cloud storage uploader.
@@ -45,6 +125,8 @@ class StorageUploader:
         storage_type: str,
         storage_url: Optional[str] = None,
         delete_local: bool = False,
+        bandwidth: Optional[BandwidthShare] = None,
+        cancel: Optional[CancelToken] = None,
     ) -> str:
         """
         Upload file to cloud storage.
@@ -54,12 +136,16 @@ class StorageUploader:
             storage_type: Storage type (local, s3, gcs, s3_compatible)
             storage_url: Storage URL (required for cloud storage)
             delete_local: Delete local file after upload
+            bandwidth: Optional upload bandwidth share to pace the upload to
+            cancel: Optional cancellation token checked while uploading
 
         Returns:
             URL to the uploaded file
 
         Raises:
             StorageError: If upload fails
+            TaskCancelled: If the task was cancelled during the upload (any
+                multipart upload has been aborted)
         """
         if not local_path.exists():
             raise StorageError("FILE_NOT_FOUND", f"Local file not found: {local_path}")
@@ -70,13 +156,14 @@ class StorageUploader:
         if not storage_url:
             raise StorageError("MISSING_STORAGE_URL", "storage_url is required for cloud storage")
 
+        progress = _progress_callback(bandwidth, cancel)
         try:
             if storage_type == "s3":
-                remote_url = self._upload_s3(local_path, storage_url)
+                remote_url = self._upload_s3(local_path, storage_url, progress)
             elif storage_type == "gcs":
-                remote_url = self._upload_gcs(local_path, storage_url)
+                remote_url = self._upload_gcs(local_path, storage_url, progress)
             elif storage_type == "s3_compatible":
-                remote_url = self._upload_s3_compatible(local_path, storage_url)
+                remote_url = self._upload_s3_compatible(local_path, storage_url, progress)
             else:
                 raise StorageError("INVALID_STORAGE_TYPE", f"Unknown storage type: {storage_type}")
 
@@ -90,12 +177,69 @@ class StorageUploader:
 
             return remote_url
 
-        except StorageError:
+        except (StorageError, TaskCancelled):
             raise
         except Exception as e:
             logger.exception(f"Failed to upload to {storage_type}")
             raise StorageError("UPLOAD_ERROR", str(e))
 
+    def object_key(self, storage_type: str, storage_url: str, file_name: str) -> str:
+        """
+        Object key an uploaded file is stored under.
+
+        Args:
+            storage_type: Storage type (s3, gcs, s3_compatible)
+            storage_url: Storage URL the file was uploaded to
+            file_name: Name of the uploaded file
+
+        Returns:
+            Object key (blob name) within the bucket
+        """
+        if storage_type == "s3":
+            _, prefix = self._parse_s3_url(storage_url)
+        elif storage_type == "gcs":
+            _, prefix = self._parse_gcs_url(storage_url)
+        elif storage_type == "s3_compatible":
+            prefix = self._parse_s3_compatible_url(storage_url)["prefix"]
+        else:
+            raise StorageError("INVALID_STORAGE_TYPE", f"Unknown storage type: {storage_type}")
+        return _object_key(prefix, file_name)
+
+    def presign(self, storage_type: str, storage_url: str, key: str, expires_in: int) -> str:
+        """
+        Pre-signed GET URL of an uploaded object.
+
+        Signing happens locally with this server's own credentials (storage
+        URLs are stored without theirs, see strip_credentials), so buckets
+        can stay private. Apart from looking up an S3 bucket's region once,
+        no request is made to the storage service.
+
+        Args:
+            storage_type: Storage type (s3, gcs, s3_compatible)
+            storage_url: Storage URL the file was uploaded to
+            key: Object key returned by object_key()
+            expires_in: Seconds the URL stays valid
+
+        Returns:
+            Pre-signed URL
+
+        Raises:
+            StorageError: If the URL cannot be signed
+        """
+        try:
+            if storage_type == "s3":
+                return self._presign_s3(storage_url, key, expires_in)
+            elif storage_type == "gcs":
+                return self._presign_gcs(storage_url, key, expires_in)
+            elif storage_type == "s3_compatible":
+                return self._presign_s3_compatible(storage_url, key, expires_in)
+            raise StorageError("INVALID_STORAGE_TYPE", f"Unknown storage type: {storage_type}")
+        except StorageError:
+            raise
+        except Exception as e:
+            logger.exception(f"Failed to pre-sign {storage_type} object {key}")
+            raise StorageError("PRESIGN_ERROR", str(e))
+
     def _parse_s3_url(self, storage_url: str) -> Tuple[str, str]:
         """
         Parse S3 URL to extract bucket and prefix.
@@ -192,7 +336,7 @@ class StorageUploader:
             "secret_key": secret_key,
         }
 
-    def _upload_s3(self, local_path: Path, storage_url: str) -> str:
+    def _upload_s3(self, local_path: Path, storage_url: str, progress: Optional[ProgressCallback] = None) -> str:
         """Upload file to AWS S3."""
         try:
             import boto3
@@ -203,14 +347,15 @@ class StorageUploader:
         bucket, prefix = self._parse_s3_url(storage_url)
 
         # Build the S3 key
-        key = f"{prefix}/{local_path.name}" if prefix else local_path.name
-        key = key.lstrip("/")
+        key = _object_key(prefix, local_path.name)
 
         logger.info(f"Uploading to S3: s3://{bucket}/{key}")
 
         try:
             s3_client = boto3.client("s3")
-            s3_client.upload_file(str(local_path), bucket, key)
+            # An exception raised by the callback aborts the transfer,
+            # including any multipart upload it started
+            s3_client.upload_file(str(local_path), bucket, key, Callback=progress)
 
             # Return the S3 URL
             region = s3_client.get_bucket_location(Bucket=bucket).get("LocationConstraint", "us-east-1")
@@ -223,7 +368,7 @@ class StorageUploader:
             error_code = e.response.get("Error", {}).get("Code", "Unknown")
             raise StorageError(f"S3_ERROR_{error_code}", str(e))
 
-    def _upload_gcs(self, local_path: Path, storage_url: str) -> str:
+    def _upload_gcs(self, local_path: Path, storage_url: str, progress: Optional[ProgressCallback] = None) -> str:
         """Upload file to Google Cloud Storage."""
         try:
             from google.cloud import storage
@@ -236,8 +381,7 @@ class StorageUploader:
         bucket_name, prefix = self._parse_gcs_url(storage_url)
 
         # Build the blob name
-        blob_name = f"{prefix}/{local_path.name}" if prefix else local_path.name
-        blob_name = blob_name.lstrip("/")
+        blob_name = _object_key(prefix, local_path.name)
 
         logger.info(f"Uploading to GCS: gs://{bucket_name}/{blob_name}")
 
@@ -245,45 +389,44 @@ class StorageUploader:
             client = storage.Client()
             bucket = client.bucket(bucket_name)
             blob = bucket.blob(blob_name)
-            blob.upload_from_filename(str(local_path))
+            if progress is None:
+                blob.upload_from_filename(str(local_path))
+            else:
+                with open(local_path, "rb") as f:
+                    blob.upload_from_file(_ProgressReader(f, progress), size=local_path.stat().st_size)
 
             return f"https://storage.googleapis.com/{bucket_name}/{blob_name}"
 
+        except TaskCancelled:
+            # An unfinished resumable upload session expires on its own
+            raise
         except Exception as e:
             raise StorageError("GCS_ERROR", str(e))
 
-    def _upload_s3_compatible(self, local_path: Path, storage_url: str) -> str:
+    def _upload_s3_compatible(
+        self,
+        local_path: Path,
+        storage_url: str,
+        progress: Optional[ProgressCallback] = None,
+    ) -> str:
         """Upload file to S3-compatible storage (OSS, MinIO, R2, etc.)."""
         config = self._parse_s3_compatible_url(storage_url)
 
         # Check if this is Alibaba OSS - use native SDK for better compatibility
         if "aliyuncs.com" in config["endpoint_url"]:
-            return self._upload_oss_native(local_path, config)
+            return self._upload_oss_native(local_path, config, progress)
 
         # For other S3-compatible storage, use boto3
-        try:
-            import boto3
-            from botocore.exceptions import ClientError
-            from botocore.config import Config
-        except ImportError:
-            raise StorageError("MISSING_DEPENDENCY", "boto3 is required for S3-compatible upload. Install with: pip install boto3")
+        s3_client = self._s3_compatible_client(config)
+        from botocore.exceptions import ClientError
 
         # Build the key
-        key = f"{config['prefix']}/{local_path.name}" if config["prefix"] else local_path.name
-        key = key.lstrip("/")
+        key = _object_key(config["prefix"], local_path.name)
 
         logger.info(f"Uploading to S3-compatible storage: {config['endpoint_url']}/{config['bucket']}/{key}")
 
         try:
-            s3_client = boto3.client(
-                "s3",
-                endpoint_url=config["endpoint_url"],
-                aws_access_key_id=config["access_key"] or os.environ.get("AWS_ACCESS_KEY_ID"),
-                aws_secret_access_key=config["secret_key"] or os.environ.get("AWS_SECRET_ACCESS_KEY"),
-                config=Config(signature_version="s3v4"),
-            )
-
-            s3_client.upload_file(str(local_path), config["bucket"], key)
+            s3_client.upload_file(str(local_path), config["bucket"], key, Callback=progress)
 
             # Return the URL
             return f"{config['endpoint_url']}/{config['bucket']}/{key}"
@@ -292,25 +435,29 @@ class StorageUploader:
             error_code = e.response.get("Error", {}).get("Code", "Unknown")
             raise StorageError(f"S3_COMPATIBLE_ERROR_{error_code}", str(e))
 
-    def _upload_oss_native(self, local_path: Path, config: dict) -> str:
-        """Upload file to Alibaba OSS using native oss2 SDK."""
+    def _s3_compatible_client(self, config: dict):
+        """boto3 client for an S3-compatible endpoint."""
         try:
-            import oss2
+            import boto3
+            from botocore.config import Config
         except ImportError:
-            raise StorageError(
-                "MISSING_DEPENDENCY",
-                "oss2 is required for Alibaba OSS upload. Install with: pip install oss2"
-            )
+            raise StorageError("MISSING_DEPENDENCY", "boto3 is required for S3-compatible upload. Install with: pip install boto3")
 
-        access_key = config["access_key"] or os.environ.get("OSS_ACCESS_KEY_ID") or os.environ.get("AWS_ACCESS_KEY_ID")
-        secret_key = config["secret_key"] or os.environ.get("OSS_ACCESS_KEY_SECRET") or os.environ.get("AWS_SECRET_ACCESS_KEY")
+        return boto3.client(
+            "s3",
+            endpoint_url=config["endpoint_url"],
+            aws_access_key_id=config["access_key"] or os.environ.get("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=config["secret_key"] or os.environ.get("AWS_SECRET_ACCESS_KEY"),
+            config=Config(signature_version="s3v4"),
+        )
 
-        if not access_key or not secret_key:
-            raise StorageError("MISSING_CREDENTIALS", "OSS access key and secret are required")
+    def _upload_oss_native(self, local_path: Path, config: dict, progress: Optional[ProgressCallback] = None) -> str:
+        """Upload file to Alibaba OSS using native oss2 SDK."""
+        bucket = self._oss_bucket(config)
+        import oss2  # installed, _oss_bucket checked
 
         # Build the key
-        key = f"{config['prefix']}/{local_path.name}" if config["prefix"] else local_path.name
-        key = key.lstrip("/")
+        key = _object_key(config["prefix"], local_path.name)
 
         # endpoint_url is like https://oss-cn-beijing.aliyuncs.com
         endpoint = config["endpoint_url"]
@@ -319,9 +466,10 @@ class StorageUploader:
         logger.info(f"Uploading to Alibaba OSS: {bucket_name}/{key}")
 
         try:
-            auth = oss2.Auth(access_key, secret_key)
-            bucket = oss2.Bucket(auth, endpoint, bucket_name)
-            bucket.put_object_from_file(key, str(local_path))
+            bucket.put_object_from_file(
+                key, str(local_path),
+                progress_callback=_oss_progress_callback(progress),
+            )
 
             # Return the public URL
             return f"https://{bucket_name}.{endpoint.replace('https://', '')}/{key}"
@@ -329,6 +477,92 @@ class StorageUploader:
         except oss2.exceptions.OssError as e:
             raise StorageError(f"OSS_ERROR_{e.code}", e.message)
 
+    def _oss_bucket(self, config: dict):
+        """oss2 Bucket for an Alibaba OSS storage URL."""
+        try:
+            import oss2
+        except ImportError:
+            raise StorageError(
+                "MISSING_DEPENDENCY",
+                "oss2 is required for Alibaba OSS upload. Install with: pip install oss2"
+            )
+
+        access_key = config["access_key"] or os.environ.get("OSS_ACCESS_KEY_ID") or os.environ.get("AWS_ACCESS_KEY_ID")
+        secret_key = config["secret_key"] or os.environ.get("OSS_ACCESS_KEY_SECRET") or os.environ.get("AWS_SECRET_ACCESS_KEY")
+
+        if not access_key or not secret_key:
+            raise StorageError("MISSING_CREDENTIALS", "OSS access key and secret are required")
+
+        return oss2.Bucket(oss2.Auth(access_key, secret_key), config["endpoint_url"], config["bucket"])
+
+    def _presign_s3(self, storage_url: str, key: str, expires_in: int) -> str:
+        """Pre-signed GET URL of an AWS S3 object."""
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise StorageError("MISSING_DEPENDENCY", "boto3 is required for S3 upload. Install with: pip install boto3")
+
+        bucket, _ = self._parse_s3_url(storage_url)
+        # SigV4 signatures are only valid for the bucket's own region (and its regional endpoint)
+        region = self._s3_region(bucket)
+        s3_client = boto3.client(
+            "s3",
+            region_name=region,
+            endpoint_url=f"https://s3.{region}.amazonaws.com" if region else None,
+            config=Config(signature_version="s3v4", s3={"addressing_style": "virtual"}),
+        )
+        return s3_client.generate_presigned_url(
+            "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires_in,
+        )
+
+    def _s3_region(self, bucket: str) -> Optional[str]:
+        """Region of an AWS S3 bucket: S3_REGION, else looked up once per bucket."""
+        if settings.s3_region:
+            return settings.s3_region
+        if bucket not in _s3_bucket_regions:
+            import boto3
+            from botocore.exceptions import BotoCoreError, ClientError
+
+            try:
+                location = boto3.client("s3").get_bucket_location(Bucket=bucket).get("LocationConstraint")
+            except (BotoCoreError, ClientError) as e:
+                # Not cached: the next signing tries again
+                logger.warning(f"Failed to look up the region of S3 bucket {bucket}: {e}")
+                return None
+            _s3_bucket_regions[bucket] = location or "us-east-1"
+        return _s3_bucket_regions[bucket]
+
+    def _presign_gcs(self, storage_url: str, key: str, expires_in: int) -> str:
+        """V4 signed GET URL of a GCS object (needs service account credentials)."""
+        try:
+            from google.cloud import storage
+        except ImportError:
+            raise StorageError(
+                "MISSING_DEPENDENCY",
+                "google-cloud-storage is required for GCS upload. Install with: pip install google-cloud-storage"
+            )
+
+        bucket_name, _ = self._parse_gcs_url(storage_url)
+        blob = storage.Client().bucket(bucket_name).blob(key)
+        return blob.generate_signed_url(version="v4", expiration=timedelta(seconds=expires_in), method="GET")
+
+    def _presign_s3_compatible(self, storage_url: str, key: str, expires_in: int) -> str:
+        """Pre-signed GET URL of an object in S3-compatible storage (OSS, MinIO, R2, etc.)."""
+        config = self._parse_s3_compatible_url(storage_url)
+        if "aliyuncs.com" in config["endpoint_url"]:
+            return self._oss_bucket(config).sign_url("GET", key, expires_in, slash_safe=True)
+
+        s3_client = self._s3_compatible_client(config)
+        from botocore.exceptions import NoCredentialsError
+
+        try:
+            return s3_client.generate_presigned_url(
+                "get_object", Params={"Bucket": config["bucket"], "Key": key}, ExpiresIn=expires_in,
+            )
+        except NoCredentialsError:
+            raise StorageError("MISSING_CREDENTIALS", "S3-compatible access key and secret are required")
+
 
 # Convenience function
 def upload_to_storage(
@@ -336,7 +570,9 @@ def upload_to_storage(
     storage_type: str = "local",
     storage_url: Optional[str] = None,
     delete_local: bool = False,
+    bandwidth: Optional[BandwidthShare] = None,
+    cancel: Optional[CancelToken] = None,
 ) -> str:
     """Upload file to storage and return URL."""
     uploader = StorageUploader()
-    return uploader.upload(local_path, storage_type, storage_url, delete_local)
+    return uploader.upload(local_path, storage_type, storage_url, delete_local, bandwidth, cancel)
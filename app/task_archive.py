@@ -0,0 +1,257 @@
+"""
+Archival of finished tasks.
+
+Completed, failed and cancelled tasks older than ``archive_retention_days``
+are moved out of the ``tasks`` table by the ``archive_tasks_task`` beat
+task, so listing, counting and the database file stop growing with
+history. Each run writes append-only segment files to ``archive_dir``:
+
+    tasks-20240101T000000-1a2b3c4d.ndjson.gz
+
+A segment holds one JSON object per task (every column of the row, URLs
+stripped of embedded credentials) in NDJSON, compressed in blocks of BLOCK_ROWS records. Blocks are
+independent gzip members / zstd frames, so the whole file still
+decompresses with ``zcat`` or ``zstdcat``, and reading one task only
+decompresses its block. The ``task_archive_index`` table maps each task
+ID to its segment and block; ``GET /api/v1/tasks/{id}`` falls back to it
+for tasks no longer in the table.
+
+A segment is complete on disk (fsynced, then renamed into place) before
+the transaction that indexes its tasks and deletes them commits. A crash
+in between leaves an unreferenced segment and the tasks still in the
+table, to be archived again by the next run.
+
+A run writes at most ``archive_max_batches`` segments; a larger backlog
+drains over several runs. On SQLite, the pages freed by each batch are
+returned to the file system with ``PRAGMA incremental_vacuum`` when the
+database is in incremental auto-vacuum mode (new databases are, see
+app.database.init_db); an older file needs one offline
+``PRAGMA auto_vacuum = INCREMENTAL; VACUUM;`` to switch.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from sqlalchemy import DateTime, delete, text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import FINISHED_STATUSES, ArchivedTask, CallbackOutbox, CallbackStatus, Task
+from app.status_counters import record_removed
+from app.storage import strip_credentials
+
+logger = logging.getLogger(__name__)
+
+BLOCK_ROWS = 200  # records per compressed block
+
+_COLUMNS = Task.__table__.columns
+_DATETIME_COLUMNS = {column.name for column in _COLUMNS if isinstance(column.type, DateTime)}
+# URLs that may embed ACCESS_KEY:SECRET@ / user:password@ (segments are plain files)
+_CREDENTIAL_COLUMNS = {"storage_url", "callback_url"}
+
+
+class ArchiveError(Exception):
+    """Raised when a segment cannot be written or read."""
+
+
+def _codec(name: str) -> Tuple[str, Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """(file suffix, compress, decompress) of a compression name."""
+    if name == "gzip":
+        return ".gz", lambda data: gzip.compress(data, mtime=0), gzip.decompress
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ArchiveError("zstandard is required for zstd archives. Install with: pip install zstandard")
+        return ".zst", zstandard.ZstdCompressor(level=9).compress, zstandard.ZstdDecompressor().decompress
+    raise ArchiveError(f"Unknown archive compression: {name}")
+
+
+def _codec_of(segment: str) -> Callable[[bytes], bytes]:
+    return _codec("zstd" if segment.endswith(".zst") else "gzip")[2]
+
+
+def task_record(task: Task) -> dict:
+    """Every column of a task row, JSON-ready, without credentials."""
+    record = {}
+    for column in _COLUMNS:
+        value = getattr(task, column.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif column.name in _CREDENTIAL_COLUMNS:
+            value = strip_credentials(value)
+        record[column.name] = value
+    return record
+
+
+def task_from_record(record: dict) -> Task:
+    """Detached Task rebuilt from an archived record."""
+    values = {}
+    for column in _COLUMNS:
+        value = record.get(column.name)
+        if value is not None and column.name in _DATETIME_COLUMNS:
+            value = datetime.fromisoformat(value)
+        values[column.key] = value
+    return Task(**values)
+
+
+def write_segment(tasks: List[Task], root: Path) -> Tuple[str, List[Tuple[Task, int, int]]]:
+    """
+    Write tasks to a new segment file.
+
+    Returns:
+        Segment file name and (task, block offset, block length) per task
+    """
+    suffix, compress, _ = _codec(settings.archive_compression)
+    name = f"tasks-{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.ndjson{suffix}"
+    root.mkdir(parents=True, exist_ok=True)
+    partial = root / f".{name}.part"
+
+    placements = []
+    offset = 0
+    with open(partial, "wb") as f:
+        for start in range(0, len(tasks), BLOCK_ROWS):
+            block_tasks = tasks[start:start + BLOCK_ROWS]
+            lines = "".join(json.dumps(task_record(task), ensure_ascii=False) + "\n" for task in block_tasks)
+            block = compress(lines.encode())
+            f.write(block)
+            placements.extend((task, offset, len(block)) for task in block_tasks)
+            offset += len(block)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(partial, root / name)
+    return name, placements
+
+
+def read_archived(entries: Iterable[ArchivedTask], root: Path) -> Dict[str, Task]:
+    """
+    Load archived tasks, decompressing each needed block once.
+
+    Blocking file I/O: call through run_blocking from the API.
+    """
+    wanted: Dict[Tuple[str, int, int], set] = defaultdict(set)
+    for entry in entries:
+        wanted[(entry.segment, entry.block_offset, entry.block_length)].add(entry.task_id)
+
+    tasks = {}
+    for (segment, offset, length), task_ids in wanted.items():
+        try:
+            with open(root / segment, "rb") as f:
+                f.seek(offset)
+                block = _codec_of(segment)(f.read(length))
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read archive segment {segment} at {offset}: {e}")
+            continue
+        for line in block.decode().splitlines():
+            record = json.loads(line)
+            if record["id"] in task_ids:
+                tasks[record["id"]] = task_from_record(record)
+    return tasks
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_size: int) -> int:
+    """
+    Archive up to batch_size finished tasks last touched before cutoff.
+
+    Returns:
+        Number of tasks archived
+    """
+    tasks = (
+        db.query(Task)
+        .filter(
+            Task.status.in_(FINISHED_STATUSES),
+            Task.created_at < cutoff,
+            Task.updated_at < cutoff,
+        )
+        .order_by(Task.created_at, Task.id)
+        .limit(batch_size)
+        .all()
+    )
+    if not tasks:
+        return 0
+
+    segment, placements = write_segment(tasks, settings.archive_path)
+    now = datetime.utcnow()
+    db.add_all(
+        ArchivedTask(
+            task_id=task.id,
+            segment=segment,
+            block_offset=offset,
+            block_length=length,
+            status=task.status,
+            created_at=task.created_at,
+            archived_at=now,
+        )
+        for task, offset, length in placements
+    )
+
+    task_ids = [task.id for task in tasks]
+    removed = Counter(task.status for task in tasks)
+    # Settled callbacks of archived tasks go too; pending ones are left to the relay
+    db.execute(
+        delete(CallbackOutbox)
+        .where(CallbackOutbox.task_id.in_(task_ids), CallbackOutbox.status != CallbackStatus.PENDING.value)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(delete(Task).where(Task.id.in_(task_ids)).execution_options(synchronize_session=False))
+    db.commit()
+    db.expunge_all()
+
+    record_removed(dict(removed))
+    logger.info(f"Archived {len(task_ids)} tasks to {segment}")
+    return len(task_ids)
+
+
+def _incremental_vacuum_enabled(db: Session) -> bool:
+    """Whether freed pages can be given back with PRAGMA incremental_vacuum (SQLite only)."""
+    if db.get_bind().dialect.name != "sqlite":
+        return False
+    mode = db.execute(text("PRAGMA auto_vacuum")).scalar()
+    db.commit()
+    if mode != 2:  # 2 = INCREMENTAL
+        logger.info("SQLite database is not in incremental auto-vacuum mode; archived rows leave free pages")
+        return False
+    return True
+
+
+def _release_free_pages(db: Session) -> None:
+    # execute() steps the pragma once, freeing a single page; executescript runs it to the end
+    db.connection().connection.driver_connection.executescript("PRAGMA incremental_vacuum;")
+    db.commit()
+
+
+def archive_finished_tasks(db: Session) -> int:
+    """
+    Archive finished tasks past the retention window.
+
+    Writes at most archive_max_batches segments per run.
+
+    Returns:
+        Number of tasks archived
+    """
+    if settings.archive_retention_days <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=settings.archive_retention_days)
+    vacuum = _incremental_vacuum_enabled(db)
+    archived = 0
+    batches = 0
+    while True:
+        count = archive_batch(db, cutoff, settings.archive_batch_size)
+        archived += count
+        batches += 1
+        if count and vacuum:
+            _release_free_pages(db)
+        if count < settings.archive_batch_size:
+            return archived
+        if settings.archive_max_batches and batches >= settings.archive_max_batches:
+            logger.info(f"Archive run stopped after {batches} batches; the rest is left for the next run")
+            return archived
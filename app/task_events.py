@@ -0,0 +1,107 @@
+"""
+Task state change notifications for long-polling clients.
+
+Every write of a task state (app.task_state) publishes the task ID on the
+TASK_EVENTS_CHANNEL Redis channel. Each API process holds one subscription
+to it and wakes the requests waiting on that task, so
+``GET /api/v1/tasks/{id}?wait=30&since_version=N`` costs an idle coroutine
+and no thread or connection of its own while it waits.
+
+Events only say that a task changed; waiters read the new state themselves.
+When the subscription drops, every waiter is woken to re-read rather than
+left to miss a change.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Set
+
+import redis
+
+from app.redis_client import get_async_redis_blocking
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_CHANNEL = "vds:task_events"
+RECONNECT_DELAY = 1.0  # seconds before resubscribing after a Redis error
+
+
+class TaskEventHub:
+    """Fan out task change events of one Redis subscription to waiting requests."""
+
+    def __init__(self):
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    @asynccontextmanager
+    async def watch(self, task_id: str) -> AsyncIterator[asyncio.Event]:
+        """
+        Event set whenever the task changes while the context is open.
+
+        Register before reading the current state, so a change between the
+        read and the wait is not lost.
+        """
+        await self._ensure_listener()
+        event = asyncio.Event()
+        self._waiters.setdefault(task_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            waiters = self._waiters.get(task_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[task_id]
+
+    async def _ensure_listener(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._subscribed.clear()
+            self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=RECONNECT_DELAY * 5)
+        except asyncio.TimeoutError:
+            # Waiters still wake on their timeout; the listener keeps retrying
+            logger.warning("Task event subscription is not ready")
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = get_async_redis_blocking().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(TASK_EVENTS_CHANNEL)
+                self._subscribed.set()
+                async for message in pubsub.listen():
+                    for event in self._waiters.get(message["data"], ()):
+                        event.set()
+            except (redis.RedisError, OSError) as e:
+                logger.warning(f"Task event subscription failed: {e}")
+            finally:
+                self._subscribed.clear()
+                self._wake_all()
+                try:
+                    await pubsub.aclose()
+                except (redis.RedisError, OSError):
+                    pass
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _wake_all(self) -> None:
+        for waiters in self._waiters.values():
+            for event in waiters:
+                event.set()
+
+    async def close(self) -> None:
+        """Stop the subscription (application shutdown)."""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+
+# Singleton instance
+task_event_hub = TaskEventHub()
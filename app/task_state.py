@@ -0,0 +1,251 @@
+"""
+Serialized task state, cached in Redis for status polling.
+
+Every UPDATE of a task row increments ``Task.state_version`` (see
+app.models). The worker writes the serialized TaskResponse of each new
+state to Redis together with an ETag derived from that version, so
+``GET /api/v1/tasks/{id}`` answers from Redis, and with 304 when the
+client's If-None-Match still matches, without touching the database or
+serializing anything. Writers other than the worker invalidate the entry
+and the API fills it again on the next poll. Both also announce the change
+to long-polling requests (app.task_events).
+
+Entries are only replaced by newer versions, so a slow writer holding an
+older state cannot overwrite a newer one. Invalidating leaves a tombstone
+holding the committed version (no etag/body, read as a miss) rather than
+deleting the key, so a fill from a read made before the change is still
+rejected.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+import redis
+
+from app.config import settings
+from app.file_links import local_file, signed_file_url
+from app.models import Task, TaskStatus
+from app.redis_client import get_async_redis, get_redis
+from app.schemas import TaskError, TaskResponse, TaskResult, TaskTimings, VideoInfo
+from app.task_events import TASK_EVENTS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+TASK_STATE_KEY = "vds:task:{task_id}"
+
+_FIELDS = ("version", "etag", "body", "updated_at")
+
+# KEYS[1] = state key; ARGV = version, etag, body, updated_at, ttl. Keeps the newer version.
+_STORE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'version')
+if current and tonumber(current) > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[1], 'etag', ARGV[2], 'body', ARGV[3], 'updated_at', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+# KEYS[1] = state key; ARGV = committed version, ttl. Drops the state, keeps the version.
+_TOMBSTONE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'version')
+if current and tonumber(current) > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HDEL', KEYS[1], 'etag', 'body', 'updated_at')
+redis.call('HSET', KEYS[1], 'version', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class TaskState(NamedTuple):
+    """A serialized task state as cached in Redis."""
+    version: int
+    etag: str
+    body: str  # TaskResponse JSON
+    updated_at: Optional[datetime]
+
+
+def task_timings(task: Task) -> Optional[TaskTimings]:
+    """Stage timings of a task, or None before it was picked up."""
+    if task.queued_seconds is None:
+        return None
+    return TaskTimings(
+        extractor=task.extractor,
+        queued=task.queued_seconds,
+        extract=task.extract_seconds,
+        download=task.download_seconds,
+        postprocess=task.postprocess_seconds,
+        upload=task.upload_seconds,
+        callback=task.callback_seconds,
+        downloaded_bytes=task.downloaded_bytes,
+        throughput_bps=task.throughput_bps,
+    )
+
+
+def task_to_response(task: Task) -> TaskResponse:
+    """Convert Task model to TaskResponse."""
+    video_info = None
+    if task.video_title:
+        video_info = VideoInfo(
+            title=task.video_title,
+            duration=task.video_duration,
+            thumbnail=task.video_thumbnail,
+            filesize=task.video_filesize,
+        )
+
+    result = None
+    if task.status == TaskStatus.COMPLETED.value:
+        result = TaskResult(
+            download_url=task.download_url,
+            file_name=task.file_name,
+            file_size=task.file_size,
+            signed_url=signed_file_url(task.id) if local_file(task.download_url) else None,
+        )
+
+    error = None
+    if task.status == TaskStatus.FAILED.value:
+        error = TaskError(
+            code=task.error_code,
+            message=task.error_message,
+        )
+
+    return TaskResponse(
+        task_id=task.id,
+        video_url=task.video_url,
+        status=task.status,
+        progress=task.progress or 0,
+        video_info=video_info,
+        result=result,
+        error=error,
+        timings=task_timings(task),
+        format_plan=task.format_plan,
+        version=task.state_version or 0,
+        created_at=task.created_at,
+        updated_at=task.updated_at,
+        completed_at=task.completed_at,
+    )
+
+
+def make_etag(version: int, response: TaskResponse) -> str:
+    """
+    ETag of a task state.
+
+    Signed links change without a new version (they are re-signed before
+    they expire), so they are part of the tag.
+    """
+    signed_url = response.result.signed_url if response.result else None
+    if not signed_url:
+        return f'"{version}"'
+    return f'"{version}-{hashlib.sha1(signed_url.encode()).hexdigest()[:12]}"'
+
+
+def _cache_ttl(response: TaskResponse) -> int:
+    # A cached signed link must stay valid for a while after it is served
+    if response.result and response.result.signed_url:
+        return max(1, min(settings.task_state_cache_ttl, settings.presigned_url_refresh_margin))
+    return settings.task_state_cache_ttl
+
+
+def serialize(response: TaskResponse) -> Tuple[TaskState, int]:
+    """Serialized state of a task and how long to cache it."""
+    state = TaskState(
+        version=response.version,
+        etag=make_etag(response.version, response),
+        body=response.model_dump_json(),
+        updated_at=response.updated_at,
+    )
+    return state, _cache_ttl(response)
+
+
+def _store_args(state: TaskState, ttl: int) -> tuple:
+    updated_at = state.updated_at.isoformat() if state.updated_at else ""
+    return state.version, state.etag, state.body, updated_at, ttl
+
+
+def _parse(values: list) -> Optional[TaskState]:
+    version, etag, body, updated_at = values
+    if version is None or etag is None or body is None:
+        return None
+    return TaskState(int(version), etag, body, datetime.fromisoformat(updated_at) if updated_at else None)
+
+
+def publish_task_state(task: Task) -> None:
+    """
+    Cache the committed state of a task (worker side).
+
+    Results that need a pre-signed URL are left for the API to fill, since
+    signing is done on demand there.
+    """
+    key = TASK_STATE_KEY.format(task_id=task.id)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        if settings.task_state_cache_ttl > 0:
+            if task.storage_key and task.status == TaskStatus.COMPLETED.value:
+                pipe.eval(_TOMBSTONE_SCRIPT, 1, key, task.state_version or 0, settings.task_state_cache_ttl)
+            else:
+                pipe.eval(_STORE_SCRIPT, 1, key, *_store_args(*serialize(task_to_response(task))))
+        pipe.publish(TASK_EVENTS_CHANNEL, task.id)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache state of task {task.id}: {e}")
+
+
+async def store_task_states(states: Dict[str, Tuple[TaskState, int]]) -> None:
+    """Cache task states read by the API, keyed by task ID, with their TTLs."""
+    if settings.task_state_cache_ttl <= 0 or not states:
+        return
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        for task_id, (state, ttl) in states.items():
+            pipe.eval(_STORE_SCRIPT, 1, TASK_STATE_KEY.format(task_id=task_id), *_store_args(state, ttl))
+        await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache state of {len(states)} task(s): {e}")
+
+
+async def get_cached_task_states(task_ids: Iterable[str]) -> Dict[str, TaskState]:
+    """Cached states of the given tasks (one round trip); missing ones are left out."""
+    task_ids = list(task_ids)
+    if settings.task_state_cache_ttl <= 0 or not task_ids:
+        return {}
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hmget(TASK_STATE_KEY.format(task_id=task_id), *_FIELDS)
+        replies = await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read cached state of {len(task_ids)} task(s): {e}")
+        return {}
+    states = {}
+    for task_id, values in zip(task_ids, replies):
+        state = _parse(values)
+        if state is not None:
+            states[task_id] = state
+    return states
+
+
+async def invalidate_task_state(task_id: str, version: int) -> None:
+    """
+    Drop the cached state of a task after changing it outside the worker.
+
+    Args:
+        task_id: Task ID
+        version: state_version read after the change was committed
+    """
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        if settings.task_state_cache_ttl > 0:
+            pipe.eval(
+                _TOMBSTONE_SCRIPT, 1, TASK_STATE_KEY.format(task_id=task_id),
+                version, settings.task_state_cache_ttl,
+            )
+        pipe.publish(TASK_EVENTS_CHANNEL, task_id)
+        await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to invalidate cached state of task {task_id}: {e}")
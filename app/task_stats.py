@@ -0,0 +1,109 @@
+"""
+Task timing statistics.
+
+Aggregates the per-stage durations stored on tasks into percentiles per
+extractor, for finding where time goes (queue, extraction, download,
+postprocessing, upload or callback delivery).
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Task, TaskStatus
+
+# Stage name -> Task column
+STAGE_COLUMNS = {
+    "queued": Task.queued_seconds,
+    "extract": Task.extract_seconds,
+    "download": Task.download_seconds,
+    "postprocess": Task.postprocess_seconds,
+    "upload": Task.upload_seconds,
+    "callback": Task.callback_seconds,
+}
+
+MAX_TASKS = 100_000  # most recent rows read per request; bounds memory for wide windows
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of a sequence of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _summarize(values: List[float]) -> Optional[Dict[str, Any]]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": round(percentile(ordered, 50), 3),
+        "p90": round(percentile(ordered, 90), 3),
+        "p99": round(percentile(ordered, 99), 3),
+    }
+
+
+async def get_timing_stats(
+    db: AsyncSession,
+    since: datetime,
+    extractor: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Stage duration percentiles of tasks completed since ``since``.
+
+    Only the MAX_TASKS most recently completed tasks are read.
+
+    Args:
+        db: Database session
+        since: Start of the completion window
+        extractor: Only this extractor (e.g. "Youtube"); all when None
+
+    Returns:
+        One dict per extractor, busiest first, and whether older tasks of
+        the window were left out
+    """
+    query = (
+        select(Task.extractor, Task.throughput_bps, *STAGE_COLUMNS.values())
+        .where(Task.status == TaskStatus.COMPLETED.value, Task.completed_at >= since)
+        .order_by(Task.completed_at.desc())
+        .limit(MAX_TASKS + 1)
+    )
+    if extractor:
+        query = query.where(Task.extractor == extractor)
+
+    rows = (await db.execute(query)).all()
+    truncated = len(rows) > MAX_TASKS
+
+    samples: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    tasks: Dict[str, int] = defaultdict(int)
+    for row in rows[:MAX_TASKS]:
+        name = row[0] or "unknown"
+        tasks[name] += 1
+        if row[1] is not None:
+            samples[name]["throughput_bps"].append(row[1])
+        for stage, value in zip(STAGE_COLUMNS, row[2:]):
+            if value is not None:
+                samples[name][stage].append(value)
+
+    stats = []
+    for name in sorted(tasks, key=tasks.get, reverse=True):
+        stages = {}
+        for stage in STAGE_COLUMNS:
+            summary = _summarize(samples[name][stage])
+            if summary:
+                stages[stage] = summary
+        stats.append({
+            "extractor": name,
+            "tasks": tasks[name],
+            "stages": stages,
+            "throughput_bps": _summarize(samples[name]["throughput_bps"]),
+        })
+    return stats, truncated
@@ -1,39 +1,126 @@
 from __future__ import annotations
 
 import os
+import json
+import time
+import threading
 import logging
+from dataclasses import asdict
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 
 from celery import Task
+from celery.exceptions import SoftTimeLimitExceeded
+from sqlalchemy import func, select, update
 from sqlalchemy.orm import Session
 
 from app.celery_app import celery_app
 from app.database import SessionLocal
-from app.models import Task as TaskModel, TaskStatus
+from app.models import FINISHED_STATUSES, Task as TaskModel, TaskStatus
 from app.downloader import VideoDownloader, DownloadError
 from app.callback import callback_service, build_success_payload, build_failure_payload
-from app.storage import upload_to_storage, StorageError
+from app.storage import StorageUploader, upload_to_storage, StorageError, strip_credentials
+from app.status_counters import record_transition, seed_status_counts
+from app.task_state import publish_task_state
+from app.redis_client import get_redis
+from app.bandwidth import DOWNLOAD, UPLOAD, bandwidth_share
+from app.cancellation import CancelToken, TaskCancelled
+from app.download_layout import remove_empty_dirs
+from app.task_archive import archive_finished_tasks
+from app.video_info import REPLY_TTL, video_info_cache_key
+from app.metrics import (
+    AUDIO_EXTRACT_DURATION,
+    DOWNLOAD_ERRORS,
+    DOWNLOADED_BYTES,
+    STAGE_DURATION,
+    STORAGE_ERRORS,
+    UPLOADED_BYTES,
+)
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
 
 class DatabaseTask(Task):
-    """Base task with database session management."""
-    _db: Optional[Session] = None
+    """
+    Base task with database session management.
+
+    Celery runs every invocation of a task on one shared Task instance, so
+    the session is kept per thread (per greenlet under the gevent pool,
+    which patches threading.local) instead of on the instance.
+    """
+    _local = threading.local()
 
     @property
     def db(self) -> Session:
-        if self._db is None:
-            self._db = SessionLocal()
-        return self._db
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = SessionLocal()
+        return db
 
     def after_return(self, *args, **kwargs):
-        if self._db is not None:
-            self._db.close()
-            self._db = None
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+def _commit_status(
+    db: Session,
+    task: TaskModel,
+    status: TaskStatus,
+    unless: Tuple[str, ...] = (TaskStatus.CANCELLED.value,),
+) -> bool:
+    """
+    Commit a status change and keep the Redis status counters in sync.
+
+    Returns:
+        False, with the session rolled back, if the task is in a status
+        of ``unless`` by now (see _claim_status)
+    """
+    previous = _claim_status(db, task, status, unless)
+    if previous is None:
+        return False
+    db.commit()
+    record_transition(previous, status.value)
+    publish_task_state(task)
+    return True
+
+
+def _claim_status(
+    db: Session,
+    task: TaskModel,
+    status: TaskStatus,
+    unless: Tuple[str, ...] = (TaskStatus.CANCELLED.value,),
+) -> Optional[str]:
+    """
+    Set a status unless the task is in a status of ``unless`` by now.
+
+    The in-memory status may be stale (the API commits CANCELLED from its
+    own session), so the transition is a compare-and-set UPDATE on the
+    status just read, which also tells the counters exactly which status
+    was replaced. Pending changes to the task are flushed with it; nothing
+    is committed.
+
+    Returns:
+        The replaced status, or None (session rolled back) when the task
+        is in a status of ``unless``
+    """
+    db.flush()
+    while True:
+        current = db.scalar(select(TaskModel.status).where(TaskModel.id == task.id))
+        if current is None or current in unless:
+            db.rollback()
+            return None
+        matched = db.execute(
+            update(TaskModel)
+            .where(TaskModel.id == task.id, TaskModel.status == current)
+            .values(status=status.value, state_version=func.coalesce(TaskModel.state_version, 0) + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if matched:
+            return current
 
 
 @celery_app.task(
@@ -75,6 +162,9 @@ def download_video_task(
     video_quality = options.get("video_quality", "720")
     format_spec = options.get("format")
     audio_format = options.get("audio_format", "mp3")
+    start_time = options.get("start_time")
+    end_time = options.get("end_time")
+    chapter = options.get("chapter")
 
     # Legacy support: extract_audio -> download_type
     if options.get("extract_audio", False) and download_type == "audio_video":
@@ -91,44 +181,81 @@ def download_video_task(
         logger.info(f"Task {task_id} was cancelled, skipping")
         return {"status": "cancelled"}
 
+    cancel = CancelToken(task_id)
+    result = None
     try:
         # Create downloader
         downloader = VideoDownloader()
 
-        # Get video info first (before downloading)
-        try:
-            video_info = downloader.get_video_info(video_url)
-            task.video_title = video_info.title
-            task.video_duration = int(video_info.duration) if video_info.duration else None
-            task.video_thumbnail = video_info.thumbnail
-            task.video_filesize = video_info.filesize
-            logger.info(f"Task {task_id}: Video info - {video_info.title}, size: {video_info.filesize}")
-        except Exception as e:
-            logger.warning(f"Failed to get video info: {e}")
-
         # Update status to downloading
-        task.status = TaskStatus.DOWNLOADING.value
         task.started_at = datetime.utcnow()
+        task.queued_seconds = (task.started_at - task.created_at).total_seconds()
         task.celery_task_id = self.request.id
-        db.commit()
+        if not _commit_status(db, task, TaskStatus.DOWNLOADING):
+            raise TaskCancelled(task_id)
+
+        # Video info is known as soon as extraction finishes (single extraction)
+        def info_callback(video_info):
+            try:
+                task.video_title = video_info.title
+                task.video_duration = int(video_info.duration) if video_info.duration else None
+                task.video_thumbnail = video_info.thumbnail
+                task.video_filesize = video_info.filesize
+                db.commit()
+                publish_task_state(task)
+                logger.info(f"Task {task_id}: Video info - {video_info.title}, size: {video_info.filesize}")
+            except Exception as e:
+                logger.warning(f"Failed to store video info: {e}")
+
+        # Progress callback to update database, at most every progress_update_interval
+        last_progress_write = 0.0
 
-        # Progress callback to update database
         def progress_callback(percent: float, message: str):
+            nonlocal last_progress_write
+            now = time.monotonic()
+            if percent < 100 and now - last_progress_write < settings.progress_update_interval:
+                return
+            last_progress_write = now
             try:
                 task.progress = percent
                 db.commit()
+                publish_task_state(task)
             except Exception as e:
                 logger.warning(f"Failed to update progress: {e}")
 
-        # Download video with new parameters
-        result = downloader.download(
-            url=video_url,
-            progress_callback=progress_callback,
-            download_type=download_type,
-            video_quality=video_quality,
-            format_spec=format_spec,
-            audio_format=audio_format,
-        )
+        # Download video with new parameters, within this task's bandwidth share
+        with bandwidth_share(DOWNLOAD, task_id) as bandwidth:
+            result = downloader.download(
+                url=video_url,
+                progress_callback=progress_callback,
+                info_callback=info_callback,
+                download_type=download_type,
+                video_quality=video_quality,
+                format_spec=format_spec,
+                audio_format=audio_format,
+                start_time=start_time,
+                end_time=end_time,
+                chapter=chapter,
+                bandwidth=bandwidth,
+                cancel=cancel,
+            )
+
+        for stage, seconds in result.timings.items():
+            STAGE_DURATION.labels(stage).observe(seconds)
+        if result.audio_mode and result.audio_seconds is not None:
+            AUDIO_EXTRACT_DURATION.labels(result.audio_mode).observe(result.audio_seconds)
+        extractor = result.extractor or "unknown"
+        DOWNLOADED_BYTES.labels(extractor, storage_type or "local").inc(result.downloaded_bytes)
+
+        # Store stage timings
+        task.extractor = result.extractor
+        task.extract_seconds = result.timings.get("extract")
+        task.download_seconds = result.timings.get("download")
+        task.postprocess_seconds = result.timings.get("postprocess")
+        task.downloaded_bytes = result.downloaded_bytes
+        task.format_plan = result.format_plan.to_dict() if result.format_plan else None
+        if task.download_seconds:
+            task.throughput_bps = result.downloaded_bytes / task.download_seconds
 
         # Update task with video info
         task.video_title = result.video_info.title
@@ -143,19 +270,31 @@ def download_video_task(
 
         # Upload to cloud storage if configured
         if storage_type and storage_type != "local":
-            task.status = TaskStatus.UPLOADING.value
-            db.commit()
+            cancel.check()
+            if not _commit_status(db, task, TaskStatus.UPLOADING):
+                raise TaskCancelled(task_id)
 
             try:
-                download_url = upload_to_storage(
-                    local_path=result.file_path,
-                    storage_type=storage_type,
-                    storage_url=storage_url,
-                    delete_local=True,  # Delete local file after upload
-                )
+                started = time.monotonic()
+                with bandwidth_share(UPLOAD, task_id) as bandwidth:
+                    download_url = upload_to_storage(
+                        local_path=result.file_path,
+                        storage_type=storage_type,
+                        storage_url=storage_url,
+                        delete_local=True,  # Delete local file after upload
+                        bandwidth=bandwidth,
+                        cancel=cancel,
+                    )
+                task.upload_seconds = time.monotonic() - started
+                STAGE_DURATION.labels("upload").observe(task.upload_seconds)
+                UPLOADED_BYTES.labels(extractor, storage_type).inc(result.file_size)
                 task.download_url = download_url
+                task.storage_type = storage_type
+                task.storage_url = strip_credentials(storage_url)
+                task.storage_key = StorageUploader().object_key(storage_type, storage_url, result.file_path.name)
                 logger.info(f"Task {task_id}: Uploaded to {storage_type}: {download_url}")
             except StorageError as e:
+                STORAGE_ERRORS.labels(e.code).inc()
                 logger.error(f"Task {task_id}: Storage upload failed: {e.code} - {e.message}")
                 # Keep local file as fallback
                 task.download_url = f"file://{result.file_path}"
@@ -164,15 +303,17 @@ def download_video_task(
             # Local storage
             task.download_url = f"file://{result.file_path}"
 
-        # Update status to completed
-        task.status = TaskStatus.COMPLETED.value
+        # Cancelled while downloading or post-processing (no progress hooks run then)
+        cancel.check()
+
+        # Claim the completion first: a cancel the API committed meanwhile wins
         task.progress = 100
         task.completed_at = datetime.utcnow()
-        db.commit()
+        previous_status = _claim_status(db, task, TaskStatus.COMPLETED)
+        if previous_status is None:
+            raise TaskCancelled(task_id)
 
-        logger.info(f"Task {task_id} completed successfully: {result.file_name}")
-
-        # Send callback notification
+        # Queue callback notification (committed together with the status)
         if callback_url:
             payload = build_success_payload(
                 task_id=task_id,
@@ -186,7 +327,13 @@ def download_video_task(
                 file_name=result.file_name,
                 file_size=result.file_size,
             )
-            callback_service.send_callback_sync(callback_url, payload)
+            callback_service.send_callback(db, task_id, callback_url, payload)
+
+        db.commit()
+        record_transition(previous_status, TaskStatus.COMPLETED.value)
+        publish_task_state(task)
+
+        logger.info(f"Task {task_id} completed successfully: {result.file_name}")
 
         return {
             "status": "completed",
@@ -195,16 +342,23 @@ def download_video_task(
             "file_size": result.file_size,
         }
 
+    except TaskCancelled:
+        logger.info(f"Task {task_id}: cancelled while {task.status}, stopped")
+        db.rollback()
+        if result is not None:
+            # Downloaded (or mid-upload): the file is no longer wanted
+            result.file_path.unlink(missing_ok=True)
+
+        # The API normally set CANCELLED already; only record the transition once
+        _commit_status(db, task, TaskStatus.CANCELLED, unless=FINISHED_STATUSES)
+        cancel.clear()
+        return {"status": "cancelled", "task_id": task_id}
+
     except DownloadError as e:
+        DOWNLOAD_ERRORS.labels(e.code).inc()
         logger.error(f"Download error for task {task_id}: {e.code} - {e.message}")
 
-        # Update task with error
-        task.status = TaskStatus.FAILED.value
-        task.error_code = e.code
-        task.error_message = e.message
-        db.commit()
-
-        # Send failure callback
+        # Queue failure callback
         if callback_url:
             payload = build_failure_payload(
                 task_id=task_id,
@@ -212,7 +366,14 @@ def download_video_task(
                 error_code=e.code,
                 error_message=e.message,
             )
-            callback_service.send_callback_sync(callback_url, payload)
+            callback_service.send_callback(db, task_id, callback_url, payload)
+
+        # Update task with error (the callback is dropped with it if cancelled meanwhile)
+        task.error_code = e.code
+        task.error_message = e.message
+        if not _commit_status(db, task, TaskStatus.FAILED):
+            logger.info(f"Task {task_id}: cancelled meanwhile, not marked failed")
+            return {"status": "cancelled", "task_id": task_id}
 
         return {
             "status": "failed",
@@ -222,15 +383,13 @@ def download_video_task(
         }
 
     except Exception as e:
+        DOWNLOAD_ERRORS.labels("UNKNOWN_ERROR").inc()
         logger.exception(f"Unexpected error for task {task_id}")
 
-        # Update task with error
-        task.status = TaskStatus.FAILED.value
-        task.error_code = "UNKNOWN_ERROR"
-        task.error_message = str(e)
-        db.commit()
+        # Discard whatever the failed step left in the session
+        db.rollback()
 
-        # Send failure callback
+        # Queue failure callback
         if callback_url:
             payload = build_failure_payload(
                 task_id=task_id,
@@ -238,12 +397,68 @@ def download_video_task(
                 error_code="UNKNOWN_ERROR",
                 error_message=str(e),
             )
-            callback_service.send_callback_sync(callback_url, payload)
+            callback_service.send_callback(db, task_id, callback_url, payload)
+
+        # Update task with error (the callback is dropped with it if cancelled meanwhile)
+        task.error_code = "UNKNOWN_ERROR"
+        task.error_message = str(e)
+        if not _commit_status(db, task, TaskStatus.FAILED):
+            logger.info(f"Task {task_id}: cancelled meanwhile, not marked failed or retried")
+            return {"status": "cancelled", "task_id": task_id}
 
         # Re-raise for Celery retry mechanism
         raise
 
 
+@celery_app.task(
+    ignore_result=True,
+    soft_time_limit=settings.video_info_timeout,
+    time_limit=settings.video_info_timeout + 15,
+)
+def extract_video_info_task(video_url: str, reply_key: str) -> None:
+    """
+    Extract video info and push the result to a Redis reply list.
+
+    Runs on the ``video_info`` queue so slow extractors never hold an API
+    thread or a download slot.
+
+    Args:
+        video_url: URL of the video
+        reply_key: Redis list the API is waiting on (BLPOP)
+    """
+    redis_client = get_redis()
+
+    started = time.monotonic()
+    try:
+        info = VideoDownloader().get_video_info(video_url)
+        reply = {"info": asdict(info)}
+        STAGE_DURATION.labels("extract").observe(time.monotonic() - started)
+    except DownloadError as e:
+        if isinstance(e.__cause__, SoftTimeLimitExceeded):
+            # The soft time limit fired inside the downloader, which wrapped it
+            DOWNLOAD_ERRORS.labels("TIMEOUT").inc()
+            reply = {"error": {"code": "TIMEOUT", "message": "Video info extraction timed out"}}
+        else:
+            DOWNLOAD_ERRORS.labels(e.code).inc()
+            reply = {"error": {"code": e.code, "message": e.message}}
+    except SoftTimeLimitExceeded:
+        DOWNLOAD_ERRORS.labels("TIMEOUT").inc()
+        reply = {"error": {"code": "TIMEOUT", "message": "Video info extraction timed out"}}
+    except Exception as e:
+        # The API is blocked on the reply list: always answer
+        logger.exception(f"Unexpected error extracting info from {video_url}")
+        DOWNLOAD_ERRORS.labels("UNKNOWN_ERROR").inc()
+        reply = {"error": {"code": "UNKNOWN_ERROR", "message": str(e)}}
+
+    payload = json.dumps(reply)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.rpush(reply_key, payload)
+    pipe.expire(reply_key, REPLY_TTL)
+    if "info" in reply and settings.video_info_cache_ttl > 0:
+        pipe.set(video_info_cache_key(video_url), json.dumps(reply["info"]), ex=settings.video_info_cache_ttl)
+    pipe.execute()
+
+
 @celery_app.task(bind=True, base=DatabaseTask)
 def cleanup_old_files_task(self, max_age_hours: int = 24):
     """
@@ -252,21 +467,48 @@ def cleanup_old_files_task(self, max_age_hours: int = 24):
     Args:
         max_age_hours: Delete files older than this many hours
     """
-    import time
-
     download_dir = settings.download_path
     cutoff_time = time.time() - (max_age_hours * 3600)
     deleted_count = 0
 
-    for file_path in download_dir.iterdir():
-        if file_path.is_file():
-            if file_path.stat().st_mtime < cutoff_time:
-                try:
+    # Files sit in shard subdirectories (and directly in download_dir from before sharding)
+    for dirpath, _, filenames in os.walk(download_dir):
+        for name in filenames:
+            file_path = Path(dirpath) / name
+            try:
+                if file_path.stat().st_mtime < cutoff_time:
                     file_path.unlink()
                     deleted_count += 1
                     logger.info(f"Deleted old file: {file_path}")
-                except Exception as e:
-                    logger.warning(f"Failed to delete {file_path}: {e}")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Failed to delete {file_path}: {e}")
 
-    logger.info(f"Cleanup completed: {deleted_count} files deleted")
+    removed_dirs = remove_empty_dirs(download_dir)
+    logger.info(f"Cleanup completed: {deleted_count} files deleted, {removed_dirs} empty directories removed")
     return {"deleted_count": deleted_count}
+
+
+@celery_app.task(bind=True, base=DatabaseTask, ignore_result=True)
+def archive_tasks_task(self):
+    """
+    Periodic task moving finished tasks past the retention window to the archive.
+
+    Scheduled by celery beat every archive_interval seconds (see app.task_archive).
+    """
+    archived = archive_finished_tasks(self.db)
+    if archived:
+        logger.info(f"Archive run completed: {archived} tasks archived")
+    return {"archived_count": archived}
+
+
+@celery_app.task(bind=True, base=DatabaseTask, ignore_result=True)
+def reseed_status_counts_task(self):
+    """
+    Periodic task rebuilding the Redis status counters from the database.
+
+    Repairs drift left by counter updates lost to Redis errors. Scheduled by
+    celery beat every status_counts_reseed_interval seconds.
+    """
+    seed_status_counts(self.db, force=True)
@@ -0,0 +1,98 @@
+"""
+Video info extraction via the dedicated ``video_info`` worker queue.
+
+The API never runs yt-dlp itself: it enqueues ``extract_video_info_task``
+and waits on a Redis reply list with BLPOP. Concurrent requests for the
+same URL in one API process share a single extraction, and completed
+results are cached briefly in Redis for every process.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from typing import Any, Dict
+
+from app.celery_app import celery_app
+from app.config import settings
+from app.downloader import DownloadError
+from app.executors import run_blocking
+from app.redis_client import get_async_redis, get_async_redis_blocking
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_TASK_NAME = "app.tasks.extract_video_info_task"
+REPLY_TTL = 60  # seconds a reply is kept for a caller that gave up
+
+
+class VideoInfoTimeout(Exception):
+    """Raised when extraction does not finish within video_info_timeout."""
+
+
+def video_info_cache_key(video_url: str) -> str:
+    """Redis key of the cached extraction result for a URL."""
+    digest = hashlib.sha1(video_url.encode("utf-8")).hexdigest()
+    return f"vds:video_info:{digest}"
+
+
+class VideoInfoClient:
+    """Request video info from the worker queue with per-URL coalescing."""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get_info(self, video_url: str) -> Dict[str, Any]:
+        """
+        Get video info as a dict (fields of downloader.VideoInfo).
+
+        Raises:
+            DownloadError: If extraction fails
+            VideoInfoTimeout: If the worker does not reply in time
+        """
+        cache_key = video_info_cache_key(video_url)
+
+        cached = await get_async_redis().get(cache_key)
+        if cached:
+            return json.loads(cached)
+
+        future = self._inflight.get(cache_key)
+        if future is None:
+            future = asyncio.ensure_future(self._extract(video_url))
+            future.add_done_callback(self._on_done(cache_key))
+            self._inflight[cache_key] = future
+
+        # shield: one caller disconnecting must not cancel the shared wait
+        return await asyncio.shield(future)
+
+    def _on_done(self, cache_key: str):
+        def callback(future: asyncio.Future):
+            self._inflight.pop(cache_key, None)
+            if not future.cancelled():
+                future.exception()  # mark retrieved if every caller left
+        return callback
+
+    async def _extract(self, video_url: str) -> Dict[str, Any]:
+        reply_key = f"vds:video_info:reply:{uuid.uuid4().hex}"
+
+        await run_blocking(
+            celery_app.send_task,
+            EXTRACT_TASK_NAME,
+            kwargs={"video_url": video_url, "reply_key": reply_key},
+            expires=settings.video_info_timeout,  # drop if still queued when we give up
+        )
+
+        reply = await get_async_redis_blocking().blpop([reply_key], timeout=settings.video_info_timeout)
+        if reply is None:
+            raise VideoInfoTimeout(f"Timed out after {settings.video_info_timeout}s")
+
+        result = json.loads(reply[1])
+        if result.get("error"):
+            raise DownloadError(result["error"]["code"], result["error"]["message"])
+        return result["info"]
+
+
+# Singleton instance
+video_info_client = VideoInfoClient()
@@ -0,0 +1,99 @@
+"""
+Shared yt-dlp cache.
+
+yt-dlp caches the signature and n-parameter functions it solves from
+YouTube player JS (sections ``youtube-sigfuncs`` and ``youtube-nsig``) as
+small JSON files. By default they go to each container's own home
+directory and are lost with it, so every fresh worker solves them again.
+Workers instead share ``ytdlp_cache_dir``, namespaced by yt-dlp version:
+
+    data/ytdlp-cache/2024.11.18/youtube-nsig/<player id>.json
+
+yt-dlp writes cache files to a temporary name and renames them into
+place, so concurrent writers on a shared volume never expose a partial
+file. A new yt-dlp version starts with an empty namespace instead of
+trusting functions solved by older code; namespaces of other versions are
+deleted by workers at startup once unused for STALE_VERSION_AGE.
+
+Lookups are counted in ``vds_ytdlp_cache_lookups{section,result}``.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from yt_dlp import YoutubeDL
+from yt_dlp.cache import Cache
+from yt_dlp.version import __version__ as YTDLP_VERSION
+
+from app.config import settings
+from app.metrics import YTDLP_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+STALE_VERSION_AGE = 7 * 86400  # seconds without writes before another version's cache is deleted
+
+
+def cache_dir() -> Optional[Path]:
+    """Cache directory of the running yt-dlp version, or None for yt-dlp's default."""
+    if not settings.ytdlp_cache_dir:
+        return None
+    return Path(settings.ytdlp_cache_dir) / YTDLP_VERSION
+
+
+class CountingCache(Cache):
+    """yt-dlp Cache that records hits and misses."""
+
+    def load(self, section, key, dtype="json", default=None, *, min_ver=None):
+        data = super().load(section, key, dtype, default, min_ver=min_ver)
+        if self.enabled:
+            YTDLP_CACHE_LOOKUPS.labels(section, "miss" if data is default else "hit").inc()
+        return data
+
+
+def use_counting_cache(ydl: YoutubeDL) -> YoutubeDL:
+    """Swap a YoutubeDL instance's cache for a CountingCache."""
+    ydl.cache = CountingCache(ydl)
+    return ydl
+
+
+def _last_write(path: Path) -> float:
+    # Directory mtimes change when cache files are added or replaced in them
+    return max(
+        (os.stat(dirpath).st_mtime for dirpath, _, _ in os.walk(path)),
+        default=0.0,
+    )
+
+
+def prune_stale_versions(min_age: float = STALE_VERSION_AGE) -> int:
+    """
+    Delete the cache namespaces of other yt-dlp versions unused for min_age seconds.
+
+    Returns:
+        Number of namespaces removed
+    """
+    if not settings.ytdlp_cache_dir:
+        return 0
+    root = Path(settings.ytdlp_cache_dir)
+    if not root.is_dir():
+        return 0
+
+    removed = 0
+    cutoff = time.time() - min_age
+    for path in root.iterdir():
+        if path.name == YTDLP_VERSION or not path.is_dir():
+            continue
+        try:
+            if _last_write(path) >= cutoff:
+                continue  # still written by workers not yet upgraded
+            shutil.rmtree(path)
+            removed += 1
+            logger.info(f"Removed yt-dlp cache of version {path.name}")
+        except OSError as e:
+            logger.warning(f"Failed to remove yt-dlp cache {path}: {e}")
+    return removed
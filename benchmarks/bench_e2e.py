@@ -0,0 +1,363 @@
+"""
+Offline end-to-end benchmark: create_task -> worker -> storage -> callback.
+
+Starts local stand-ins (media fixtures, an S3 endpoint and a callback sink,
+see benchmarks/standins.py), submits tasks through a live API at a fixed
+concurrency and waits for each task's callback. Reports tasks/sec,
+end-to-end and per-stage latency percentiles (from the task timings), and
+CPU / RSS of the service processes (Linux /proc, matched by command line).
+
+The API, a download worker and the callback relay must be running on this
+host (or pass --advertise-host with an address the worker can reach).
+Results are written as JSON to --output-dir; pass --compare with an
+earlier result to print the differences.
+
+Usage:
+    python -m benchmarks.bench_e2e --base-url http://localhost:8000 \\
+        --tasks 40 --concurrency 8 --mix mp4,hls,dash,page --storage s3
+    python -m benchmarks.bench_e2e --diff benchmarks/results/<before>.json benchmarks/results/<after>.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from app.task_stats import STAGE_COLUMNS, percentile
+from benchmarks.standins import CallbackSink, FixtureServer, S3StandIn
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# label -> command line substring of the processes to sample
+DEFAULT_WATCH = {
+    "api": "uvicorn",
+    "worker": "celery",
+    "relay": "app.callback_dispatcher",
+}
+
+# Metrics shown by --compare: (path in the result, higher is better)
+COMPARED = [
+    (("tasks_per_sec",), True),
+    (("latency", "end_to_end", "p50"), False),
+    (("latency", "end_to_end", "p99"), False),
+] + [
+    (("latency", stage, pct), False) for stage in STAGE_COLUMNS for pct in ("p50", "p99")
+] + [
+    (("processes", label, key), False) for label in DEFAULT_WATCH for key in ("cpu_percent", "rss_peak_mb")
+]
+
+
+class ProcessSampler:
+    """Sample CPU time and RSS of processes whose command line matches."""
+
+    def __init__(self, watch: Dict[str, str], interval: float = 0.5):
+        self.watch = watch
+        self.interval = interval
+        self._ticks = os.sysconf("SC_CLK_TCK")
+        self._page = os.sysconf("SC_PAGE_SIZE")
+        self._first: Dict[int, float] = {}  # pid -> cpu seconds when first seen
+        self._last: Dict[int, float] = {}
+        self._labels: Dict[int, str] = {}
+        self._rss: Dict[str, List[float]] = {label: [] for label in watch}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._started = 0.0
+        self.available = Path("/proc/self/stat").exists()
+
+    def start(self) -> None:
+        if self.available:
+            self._started = time.monotonic()
+            self._sample()
+            self._thread.start()
+
+    def stop(self) -> Dict[str, dict]:
+        if not self.available:
+            return {}
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        elapsed = time.monotonic() - self._started
+
+        report = {}
+        for label in self.watch:
+            pids = [pid for pid, owner in self._labels.items() if owner == label]
+            cpu = sum(self._last[pid] - self._first[pid] for pid in pids)
+            rss = self._rss[label]
+            report[label] = {
+                "pids": len(pids),
+                "cpu_seconds": round(cpu, 2),
+                "cpu_percent": round(100 * cpu / elapsed, 1) if elapsed else 0.0,
+                "rss_peak_mb": round(max(rss, default=0), 1),
+                "rss_mean_mb": round(sum(rss) / len(rss), 1) if rss else 0.0,
+            }
+        return report
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self) -> None:
+        totals = {label: 0.0 for label in self.watch}
+        for entry in Path("/proc").iterdir():
+            if not entry.name.isdigit() or int(entry.name) == os.getpid():
+                continue
+            pid = int(entry.name)
+            try:
+                cmdline = (entry / "cmdline").read_bytes().replace(b"\0", b" ").decode(errors="replace")
+                label = next((label for label, pattern in self.watch.items() if pattern in cmdline), None)
+                if label is None:
+                    continue
+                fields = (entry / "stat").read_text().rsplit(")", 1)[1].split()
+                rss_pages = int((entry / "statm").read_text().split()[1])
+            except (OSError, IndexError, ValueError):
+                continue  # exited while reading
+
+            # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+            cpu = (int(fields[11]) + int(fields[12])) / self._ticks
+            self._first.setdefault(pid, cpu)
+            self._last[pid] = cpu
+            self._labels[pid] = label
+            totals[label] += rss_pages * self._page / (1024 * 1024)
+
+        for label, rss in totals.items():
+            if rss:
+                self._rss[label].append(rss)
+
+
+def _summary(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 3),
+        "p99": round(percentile(values, 99), 3),
+    }
+
+
+def _git_revision() -> Dict[str, Optional[str]]:
+    def git(*args) -> Optional[str]:
+        try:
+            return subprocess.run(
+                ["git", *args], capture_output=True, text=True, check=True,
+                cwd=Path(__file__).parent,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """Run the benchmark and return the result document."""
+    kinds = [kind.strip() for kind in args.mix.split(",") if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in FixtureServer.KINDS]
+    if unknown or not kinds:
+        raise SystemExit(f"Unknown fixture kinds {unknown}; choose from {FixtureServer.KINDS}")
+
+    loop = asyncio.get_running_loop()
+    waiters: Dict[str, asyncio.Future] = {}
+    early: Dict[str, tuple] = {}  # callbacks that beat the create response
+
+    def on_event(event: dict, received_at: float) -> None:
+        def resolve():
+            future = waiters.get(event.get("task_id"))
+            if future is None:
+                early[event.get("task_id")] = (event, received_at)
+            elif not future.done():
+                future.set_result((event, received_at))
+        loop.call_soon_threadsafe(resolve)
+
+    servers = dict(host=args.bind_host, advertise_host=args.advertise_host)
+    fixtures = FixtureServer(size_mb=args.size_mb, **servers).start()
+    s3 = S3StandIn(**servers).start()
+    sink = CallbackSink(on_event=on_event, **servers).start()
+
+    watch = dict(DEFAULT_WATCH)
+    for item in args.watch or []:
+        label, _, pattern = item.partition("=")
+        watch[label] = pattern
+    sampler = ProcessSampler(watch)
+
+    api = args.base_url.rstrip("/")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    outcomes: List[dict] = []
+
+    async def one(client: httpx.AsyncClient, index: int) -> None:
+        kind = kinds[index % len(kinds)]
+        body = {
+            "video_url": fixtures.url(kind),
+            "callback_url": sink.url,
+            "storage_type": "s3_compatible" if args.storage == "s3" else "local",
+            "options": {"download_type": "audio_video", "video_quality": "best"},
+        }
+        if args.storage == "s3":
+            body["storage_url"] = s3.storage_url()
+
+        async with semaphore:
+            submitted = time.time()
+            try:
+                response = await client.post(f"{api}/api/v1/tasks", json=body)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                outcomes.append({"kind": kind, "status": "submit_error", "error": str(e)})
+                return
+
+            task_id = response.json()["task_id"]
+            future = waiters[task_id] = loop.create_future()
+            if task_id in early:
+                future.set_result(early.pop(task_id))
+            try:
+                event, received_at = await asyncio.wait_for(future, args.task_timeout)
+            except asyncio.TimeoutError:
+                outcomes.append({"kind": kind, "task_id": task_id, "status": "timeout"})
+                return
+
+            outcomes.append({
+                "kind": kind,
+                "task_id": task_id,
+                "status": event.get("status"),
+                "error_code": (event.get("error") or {}).get("code"),
+                "end_to_end": received_at - submitted,
+            })
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(one(client, i) for i in range(args.tasks)))
+        finally:
+            wall = time.perf_counter() - started
+            processes = sampler.stop()
+
+        # Stage timings; give the relay a moment to record callback times
+        await asyncio.sleep(args.settle)
+        timings: List[dict] = []
+        for outcome in outcomes:
+            if "task_id" in outcome:
+                response = await client.get(f"{api}/api/v1/tasks/{outcome['task_id']}")
+                if response.status_code == 200 and response.json().get("timings"):
+                    timings.append(response.json()["timings"])
+
+    for server in (fixtures, s3, sink):
+        server.close()
+
+    completed = [o for o in outcomes if o["status"] == "completed"]
+    errors: Dict[str, int] = {}
+    for outcome in outcomes:
+        if outcome["status"] != "completed":
+            key = outcome.get("error_code") or outcome["status"]
+            errors[key] = errors.get(key, 0) + 1
+
+    latency = {"end_to_end": _summary([o["end_to_end"] for o in completed])}
+    for stage in STAGE_COLUMNS:
+        values = [t[stage] for t in timings if t.get(stage) is not None]
+        if values:
+            latency[stage] = _summary(values)
+    throughput = [t["throughput_bps"] for t in timings if t.get("throughput_bps")]
+
+    try:
+        import yt_dlp
+        yt_dlp_version = yt_dlp.version.__version__
+    except ImportError:
+        yt_dlp_version = None
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "yt_dlp": yt_dlp_version,
+            "cpus": os.cpu_count(),
+            "params": {
+                "tasks": args.tasks,
+                "concurrency": args.concurrency,
+                "mix": kinds,
+                "size_mb": args.size_mb,
+                "storage": args.storage,
+            },
+        },
+        "tasks": len(outcomes),
+        "completed": len(completed),
+        "errors": errors,
+        "wall_seconds": round(wall, 2),
+        "tasks_per_sec": round(len(completed) / wall, 3) if wall else 0.0,
+        "latency": latency,
+        "throughput_bps_p50": round(percentile(throughput, 50)) if throughput else None,
+        "s3_bytes_received": s3.bytes_received,
+        "callbacks_received": sink.received,
+        "processes": processes,
+    }
+
+
+def _lookup(result: dict, path: tuple):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(previous: dict, current: dict) -> List[str]:
+    """Format the compared metrics of two results side by side."""
+    lines = [f"{'metric':<32} {'before':>10} {'after':>10} {'change':>8}"]
+    for path, higher_is_better in COMPARED:
+        before, after = _lookup(previous, path), _lookup(current, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        marker = " !" if worse and abs(change) >= 10 else ""
+        lines.append(f"{'.'.join(path):<32} {before:>10.4g} {after:>10.4g} {change:>+7.1f}%{marker}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--tasks", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8, help="Tasks in flight")
+    parser.add_argument("--mix", default="mp4,hls,dash,page", help=f"Fixture kinds, cycled: {','.join(FixtureServer.KINDS)}")
+    parser.add_argument("--size-mb", type=float, default=5, help="Media size per fixture")
+    parser.add_argument("--storage", choices=("local", "s3"), default="s3")
+    parser.add_argument("--task-timeout", type=float, default=300, help="Seconds to wait for a callback")
+    parser.add_argument("--settle", type=float, default=2, help="Seconds to wait before reading timings")
+    parser.add_argument("--bind-host", default="127.0.0.1", help="Address the stand-ins listen on")
+    parser.add_argument("--advertise-host", help="Address the worker uses to reach the stand-ins")
+    parser.add_argument("--watch", action="append", metavar="LABEL=PATTERN",
+                        help="Sample processes whose command line contains PATTERN (repeatable)")
+    parser.add_argument("--output-dir", type=Path, default=RESULTS_DIR)
+    parser.add_argument("--compare", type=Path, metavar="RESULT_JSON", help="Earlier result to compare this run with")
+    parser.add_argument("--diff", type=Path, nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compare two saved results without running")
+    args = parser.parse_args()
+
+    if args.diff:
+        before, after = (json.loads(path.read_text()) for path in args.diff)
+        print("\n".join(compare(before, after)))
+        return
+
+    current = asyncio.run(run(args))
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    name = f"{current['meta']['timestamp'].replace(':', '')}-{current['meta']['git']['commit'] or 'nogit'}.json"
+    path = args.output_dir / name
+    path.write_text(json.dumps(current, indent=2))
+    print(json.dumps(current, indent=2))
+    print(f"\nSaved to {path}")
+
+    if args.compare:
+        print("\n" + "\n".join(compare(json.loads(args.compare.read_text()), current)))
+
+
+if __name__ == "__main__":
+    main()
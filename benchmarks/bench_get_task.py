@@ -0,0 +1,120 @@
+"""
+Load benchmark for GET /api/v1/tasks/{task_id}.
+
+Runs against a live API server and reports requests/sec and latency
+percentiles. Without --task-id, a completed task row is inserted into the
+database configured by DATABASE_URL (use the same .env as the server).
+
+Usage:
+    python -m benchmarks.bench_get_task --base-url http://localhost:8000 \\
+        --concurrency 64 --duration 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import List
+
+import httpx
+
+
+def seed_task() -> str:
+    """Insert a completed task and return its ID."""
+    from app.database import SessionLocal, init_db
+    from app.models import Task, TaskStatus
+
+    init_db()
+    db = SessionLocal()
+    try:
+        task = Task(
+            video_url="https://example.com/benchmark",
+            status=TaskStatus.COMPLETED.value,
+            progress=100,
+            video_title="Benchmark video",
+            video_duration=60,
+            download_url="file:///tmp/benchmark.mp4",
+            file_name="benchmark.mp4",
+            file_size=1024 * 1024,
+            completed_at=datetime.utcnow(),
+        )
+        db.add(task)
+        db.commit()
+        return task.id
+    finally:
+        db.close()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run(base_url: str, task_id: str, concurrency: int, duration: float, warmup: float) -> dict:
+    """Hammer the endpoint with ``concurrency`` clients for ``duration`` seconds."""
+    url = f"{base_url.rstrip('/')}/api/v1/tasks/{task_id}"
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        measure_from = start + warmup
+        deadline = measure_from + duration
+
+        async def worker():
+            nonlocal errors
+            while True:
+                t0 = time.perf_counter()
+                if t0 >= deadline:
+                    return
+                try:
+                    response = await client.get(url)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                t1 = time.perf_counter()
+                if t0 >= measure_from:
+                    if ok:
+                        latencies.append(t1 - t0)
+                    else:
+                        errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "duration": duration,
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--task-id", help="Existing task ID (default: insert one)")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="Unmeasured seconds before measuring")
+    args = parser.parse_args()
+
+    task_id = args.task_id or seed_task()
+    result = asyncio.run(run(args.base_url, task_id, args.concurrency, args.duration, args.warmup))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Local stand-ins for the end-to-end benchmark.
+
+- FixtureServer: serves generated media (progressive MP4, an HTML page
+  embedding it, HLS and DASH) that yt-dlp's generic extractor can download
+- S3StandIn: the subset of the S3 API used by boto3's upload_file
+  (PutObject and multipart upload), keeping only object sizes
+- CallbackSink: accepts task callbacks and reports them to the driver
+
+Each runs a ThreadingHTTPServer on a daemon thread, so no network access
+or external service is needed.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from functools import partial
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+SEGMENTS = 8  # HLS / DASH segments per fixture
+
+
+class _Server:
+    """ThreadingHTTPServer on a daemon thread."""
+
+    def __init__(self, handler, host: str = "127.0.0.1", port: int = 0, advertise_host: Optional[str] = None):
+        self._httpd = ThreadingHTTPServer((host, port), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self.host = advertise_host or host
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _reply(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+
+# ============ Media fixtures ============
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    extensions_map = {
+        **SimpleHTTPRequestHandler.extensions_map,
+        ".m3u8": "application/vnd.apple.mpegurl",
+        ".mpd": "application/dash+xml",
+        ".ts": "video/mp2t",
+        ".m4s": "video/iso.segment",
+        ".mp4": "video/mp4",
+    }
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(_Server):
+    """
+    Serve generated media fixtures.
+
+    The content is random bytes: the service never decodes media unless a
+    postprocessor runs, so this measures fetch, write and upload costs.
+    """
+
+    KINDS = ("mp4", "page", "hls", "dash")
+
+    def __init__(self, size_mb: float = 5, **kwargs):
+        self.root = Path(tempfile.mkdtemp(prefix="vds-bench-"))
+        self._generate(int(size_mb * 1024 * 1024))
+        super().__init__(partial(_FixtureHandler, directory=str(self.root)), **kwargs)
+
+    def url(self, kind: str) -> str:
+        """URL of the fixture of the given kind (see KINDS)."""
+        paths = {
+            "mp4": "video.mp4",
+            "page": "page.html",
+            "hls": "hls/index.m3u8",
+            "dash": "dash/manifest.mpd",
+        }
+        return f"{self.base_url}/{paths[kind]}"
+
+    def close(self) -> None:
+        super().close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _generate(self, size: int) -> None:
+        (self.root / "video.mp4").write_bytes(os.urandom(size))
+        (self.root / "page.html").write_text(
+            "<html><head><title>Benchmark page</title></head><body>"
+            '<video controls src="video.mp4"></video></body></html>'
+        )
+
+        segment_size = max(size // SEGMENTS, 188)
+        duration = 4
+
+        hls = self.root / "hls"
+        hls.mkdir()
+        playlist = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{duration}", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(SEGMENTS):
+            # 0x47 is the MPEG-TS sync byte
+            (hls / f"seg{i}.ts").write_bytes(b"\x47" + os.urandom(segment_size - 1))
+            playlist += [f"#EXTINF:{duration}.0,", f"seg{i}.ts"]
+        playlist.append("#EXT-X-ENDLIST")
+        (hls / "index.m3u8").write_text("\n".join(playlist) + "\n")
+
+        dash = self.root / "dash"
+        dash.mkdir()
+        (dash / "init.mp4").write_bytes(os.urandom(1024))
+        for i in range(1, SEGMENTS + 1):
+            (dash / f"seg{i}.m4s").write_bytes(os.urandom(segment_size))
+        (dash / "manifest.mpd").write_text(f"""<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{SEGMENTS * duration}S"
+     minBufferTime="PT2S" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">
+ <Period>
+  <AdaptationSet mimeType="video/mp4" segmentAlignment="true">
+   <Representation id="v0" codecs="avc1.64001f,mp4a.40.2" bandwidth="800000" width="1280" height="720">
+    <SegmentTemplate initialization="init.mp4" media="seg$Number$.m4s" startNumber="1" duration="{duration}" timescale="1"/>
+   </Representation>
+  </AdaptationSet>
+ </Period>
+</MPD>
+""")
+
+
+# ============ S3 ============
+
+class _S3Handler(_Handler):
+    store: "S3StandIn"
+
+    def _split(self):
+        parsed = urlparse(self.path)
+        return parsed.path.lstrip("/"), parse_qs(parsed.query, keep_blank_values=True)
+
+    def do_HEAD(self):
+        key, _ = self._split()
+        size = self.store.objects.get(key)
+        if size is None:
+            self._reply(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+
+    def do_PUT(self):
+        key, query = self._split()
+        body = self._read_body()
+        # boto3 may send aws-chunked bodies; the decoded length is in a header
+        size = int(self.headers.get("x-amz-decoded-content-length") or len(body))
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+
+        if "uploadId" in query:
+            upload = self.store.uploads.get(query["uploadId"][0])
+            if upload is None:
+                self._reply(404)
+                return
+            upload[int(query["partNumber"][0])] = size
+        else:
+            self.store.objects[key] = size
+            self.store.bytes_received += size
+        self._reply(200, headers={"ETag": etag})
+
+    def do_POST(self):
+        key, query = self._split()
+        self._read_body()
+        bucket = key.split("/", 1)[0]
+
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.store.uploads[upload_id] = {}
+            body = (
+                "<InitiateMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key.split('/', 1)[-1]}</Key><UploadId>{upload_id}</UploadId>"
+                "</InitiateMultipartUploadResult>"
+            )
+        elif "uploadId" in query:
+            parts = self.store.uploads.pop(query["uploadId"][0], None)
+            if parts is None:
+                self._reply(404)
+                return
+            size = sum(parts.values())
+            self.store.objects[key] = size
+            self.store.bytes_received += size
+            body = (
+                "<CompleteMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key.split('/', 1)[-1]}</Key><ETag>\"{uuid.uuid4().hex}\"</ETag>"
+                "</CompleteMultipartUploadResult>"
+            )
+        else:
+            self._reply(400)
+            return
+        self._reply(200, body.encode(), {"Content-Type": "application/xml"})
+
+    def do_DELETE(self):
+        key, query = self._split()
+        if "uploadId" in query:
+            self.store.uploads.pop(query["uploadId"][0], None)
+        else:
+            self.store.objects.pop(key, None)
+        self._reply(204)
+
+
+class S3StandIn(_Server):
+    """In-memory S3 endpoint; use storage_type "s3_compatible" with storage_url()."""
+
+    def __init__(self, **kwargs):
+        self.objects: Dict[str, int] = {}  # "bucket/key" -> size
+        self.uploads: Dict[str, Dict[int, int]] = {}  # upload id -> {part number: size}
+        self.bytes_received = 0
+        handler = type("S3Handler", (_S3Handler,), {"store": self})
+        super().__init__(handler, **kwargs)
+
+    def storage_url(self, bucket: str = "bench", prefix: str = "videos") -> str:
+        return f"http://bench:bench@{self.host}:{self.port}/{bucket}/{prefix}"
+
+
+# ============ Callbacks ============
+
+class _CallbackHandler(_Handler):
+    sink: "CallbackSink"
+
+    def do_POST(self):
+        received_at = time.time()
+        try:
+            payload = json.loads(self._read_body() or b"{}")
+        except ValueError:
+            self._reply(400)
+            return
+        events = payload["events"] if "events" in payload else [payload]
+        for event in events:
+            self.sink.record(event, received_at)
+        self._reply(200, b"{}", {"Content-Type": "application/json"})
+
+
+class CallbackSink(_Server):
+    """Receive callbacks and hand each event to ``on_event(event, received_at)``."""
+
+    def __init__(self, on_event: Optional[Callable[[dict, float], None]] = None, **kwargs):
+        self.on_event = on_event
+        self.received = 0
+        self._lock = threading.Lock()
+        handler = type("CallbackHandler", (_CallbackHandler,), {"sink": self})
+        super().__init__(handler, **kwargs)
+
+    def record(self, event: dict, received_at: float) -> None:
+        with self._lock:
+            self.received += 1
+        if self.on_event:
+            self.on_event(event, received_at)
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/callback"
+